@@ -0,0 +1,542 @@
+"""
+Synthetic repodata generator
+
+Writes a repository that looks like what createrepo_c makes, at whatever scale is needed:
+- xml/: primary, filelists, other, updateinfo and comps XML, uncompressed, for the parsers that take a file name
+- repodata/: the same XML gzipped, the matching primary, filelists and other SQLite databases bzip2'd, and a
+  repomd.xml listing all of them with their checksums, for ingest_repo()
+
+Every package is generated from its own random number generator, seeded with the seed and its number, so package N
+is the same package (pkgId, name, files, dependencies) in every repository made with the same seed, whatever the
+count. Its dependencies only point at packages before it, which are always there too. The generator is run again
+for every file instead of keeping the packages around, so memory use stays flat even at 500k packages.
+
+Usage: python -m benchmarks.generate 50000 /tmp/repo-50k [--seed 1]
+"""
+import argparse
+import bz2
+import gzip
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+# Scales that can be asked for by name
+SCALES = {
+    '1k': 1000,
+    '50k': 50000,
+    '500k': 500000
+}
+
+# Version of the SQLite databases, as listed in repomd.xml
+DATABASE_VERSION = 10
+
+# Bumped whenever the same count and seed make different packages, so repositories made before are generated again
+GENERATOR_VERSION = 2
+
+# Dependency types of primary, requires first since it has the extra pre column
+DEPENDENCY_TYPES = ['requires', 'provides', 'conflicts', 'obsoletes', 'recommends', 'suggests', 'supplements',
+                    'enhances']
+
+# One update in updateinfo for this many packages, and one comps group
+PACKAGES_PER_UPDATE = 20
+PACKAGES_PER_GROUP = 50
+GROUPS_PER_CATEGORY = 10
+
+# Languages the comps names and descriptions are translated to
+COMPS_LANGUAGES = ['de', 'fr', 'ja', 'zh_CN', 'pt_BR', 'ru', 'es', 'it']
+
+ARCHES = ['x86_64', 'x86_64', 'x86_64', 'noarch', 'noarch', 'i686']
+PREFIXES = ['', '', '', 'python3-', 'perl-', 'lib', 'golang-', 'rust-', 'texlive-', 'ghc-', 'nodejs-']
+WORDS = ['core', 'http', 'json', 'xml', 'parser', 'crypto', 'ssl', 'server', 'client', 'plugin', 'tools', 'utils',
+         'common', 'data', 'yaml', 'zlib', 'curl', 'kernel', 'net', 'fs', 'audio', 'video', 'font', 'theme']
+SUFFIXES = ['', '', '', '', '-devel', '-libs', '-doc', '-common', '-tools', '-static']
+DIRECTORIES = ['/usr/bin', '/usr/lib64', '/usr/share/doc', '/usr/share/man/man1', '/usr/share/licenses', '/etc',
+               '/usr/include', '/usr/share/locale/de/LC_MESSAGES']
+
+PRIMARY_NS = 'xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm"'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyntheticPackage(object):
+    """A generated package with everything the metadata files list about it"""
+    number: int
+    name: str
+    arch: str
+    epoch: int
+    version: str
+    release: str
+    pkg_id: str
+    summary: str
+    description: str
+    # {dependency type: [(name, flags, epoch, version, release, pre)]}
+    dependencies: dict = field(default_factory=dict)
+    # [(path, type)] of every file, the ones in primary are the ones under /usr/bin and /etc
+    files: List[Tuple[str, str]] = field(default_factory=list)
+    # [(author, date, text)]
+    changelogs: List[Tuple[str, int, str]] = field(default_factory=list)
+
+    @property
+    def primary_files(self) -> List[Tuple[str, str]]:
+        return [(path, file_type) for path, file_type in self.files if path.startswith(('/usr/bin/', '/etc/'))]
+
+
+def make_packages(count: int, seed: int = 1) -> Iterator[SyntheticPackage]:
+    """
+    Generator function that makes the packages of a synthetic repository
+
+    :param count: Number of packages
+    :param seed: Seed of the random number generator
+    :returns: SyntheticPackage, package N being the same for the same seed whatever the count
+    """
+    for number in range(count):
+        rng = random.Random(f'{seed}-{number}')
+        name = f'{rng.choice(PREFIXES)}{rng.choice(WORDS)}{number}{rng.choice(SUFFIXES)}'
+        arch = rng.choice(ARCHES)
+        epoch = rng.choice([0, 0, 0, 0, 1, 2])
+        version = f'{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 99)}'
+        release = f'{rng.randint(1, 20)}.el8'
+        pkg_id = hashlib.sha256(f'{seed}-{number}'.encode()).hexdigest()
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+        package = SyntheticPackage(number, name, arch, epoch, version, release, pkg_id,
+                                   f'{name} {rng.choice(WORDS)} {rng.choice(WORDS)} support',
+                                   f'The {name} package provides {words}.\n\nIt is part of a synthetic repository.')
+
+        evr = (str(epoch), version, release)
+        provides = [(name, 'EQ', *evr, None), (f'{name}({arch})', 'EQ', *evr, None)]
+        for library in range(rng.randint(0, 4)):
+            provides.append((f'lib{name}.so.{library}()(64bit)', None, None, None, None, None))
+        requires = [('/bin/sh', None, None, None, None, 1)]
+        for _ in range(rng.randint(2, 15)):
+            required = rng.randrange(number) if number else 0
+            if rng.random() < 0.5:
+                requires.append((f'lib{required}.so.0()(64bit)', None, None, None, None, 0))
+            else:
+                requires.append((f'pkg{required}', 'GE', '0', f'1.{rng.randint(0, 9)}', None, 0))
+        package.dependencies['provides'] = provides
+        package.dependencies['requires'] = requires
+        for dependency_type in DEPENDENCY_TYPES[2:]:
+            if rng.random() < 0.1:
+                package.dependencies[dependency_type] = [(f'old-{name}', 'LT', '0', '1.0', '1', None)]
+
+        package.files.append((f'/usr/share/doc/{name}', 'dir'))
+        for file_number in range(rng.randint(1, 25)):
+            package.files.append((f'{rng.choice(DIRECTORIES)}/{name}-{file_number}', 'file'))
+        if rng.random() < 0.2:
+            package.files.append((f'/var/log/{name}.log', 'ghost'))
+
+        for change in range(rng.randint(0, 10)):
+            package.changelogs.append((f'Packager {change} <packager{change}@example.com> - {version}-{change}',
+                                       1500000000 + change * 86400 + number,
+                                       f'- Rebuilt for change {change}\n- Fixed {rng.choice(WORDS)} handling'))
+        yield package
+
+
+def _entries(dependencies: list) -> str:
+    lines = []
+    for name, flags, epoch, version, release, pre in dependencies:
+        attributes = f'name={quoteattr(name)}'
+        if flags is not None:
+            attributes += f' flags="{flags}" epoch="{epoch}" ver="{version}"'
+            if release is not None:
+                attributes += f' rel="{release}"'
+        if pre:
+            attributes += ' pre="1"'
+        lines.append(f'        <rpm:entry {attributes}/>\n')
+    return ''.join(lines)
+
+
+def write_primary_xml(packages: Iterator[SyntheticPackage], count: int, file):
+    file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<metadata {PRIMARY_NS} packages="{count}">\n')
+    for package in packages:
+        number = package.number
+        file.write(f'''<package type="rpm">
+  <name>{package.name}</name>
+  <arch>{package.arch}</arch>
+  <version epoch="{package.epoch}" ver="{package.version}" rel="{package.release}"/>
+  <checksum type="sha256" pkgid="YES">{package.pkg_id}</checksum>
+  <summary>{escape(package.summary)}</summary>
+  <description>{escape(package.description)}</description>
+  <packager>Synthetic Build System &lt;build@example.com&gt;</packager>
+  <url>https://example.com/{package.name}</url>
+  <time file="{1600000000 + number}" build="{1590000000 + number}"/>
+  <size package="{10000 + number}" installed="{50000 + number}" archive="{51000 + number}"/>
+  <location href="Packages/{package.name[0]}/{package.name}-{package.version}-{package.release}.{package.arch}.rpm"/>
+  <format>
+    <rpm:license>MIT</rpm:license>
+    <rpm:vendor>Synthetic</rpm:vendor>
+    <rpm:group>Unspecified</rpm:group>
+    <rpm:buildhost>build{number % 100}.example.com</rpm:buildhost>
+    <rpm:sourcerpm>{package.name}-{package.version}-{package.release}.src.rpm</rpm:sourcerpm>
+    <rpm:header-range start="4504" end="{20000 + number}"/>
+''')
+        for dependency_type in DEPENDENCY_TYPES:
+            dependencies = package.dependencies.get(dependency_type)
+            if dependencies:
+                file.write(f'    <rpm:{dependency_type}>\n{_entries(dependencies)}    </rpm:{dependency_type}>\n')
+        for path, file_type in package.primary_files:
+            type_attribute = f' type="{file_type}"' if file_type != 'file' else ''
+            file.write(f'    <file{type_attribute}>{escape(path)}</file>\n')
+        file.write('  </format>\n</package>\n')
+    file.write('</metadata>\n')
+
+
+def _package_header(package: SyntheticPackage) -> str:
+    return (f'<package pkgid="{package.pkg_id}" name="{package.name}" arch="{package.arch}">\n'
+            f'  <version epoch="{package.epoch}" ver="{package.version}" rel="{package.release}"/>\n')
+
+
+def write_filelists_xml(packages: Iterator[SyntheticPackage], count: int, file):
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               f'<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="{count}">\n')
+    for package in packages:
+        file.write(_package_header(package))
+        for path, file_type in package.files:
+            type_attribute = f' type="{file_type}"' if file_type != 'file' else ''
+            file.write(f'  <file{type_attribute}>{escape(path)}</file>\n')
+        file.write('</package>\n')
+    file.write('</filelists>\n')
+
+
+def write_other_xml(packages: Iterator[SyntheticPackage], count: int, file):
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               f'<otherdata xmlns="http://linux.duke.edu/metadata/other" packages="{count}">\n')
+    for package in packages:
+        file.write(_package_header(package))
+        for author, date, text in package.changelogs:
+            file.write(f'  <changelog author={quoteattr(author)} date="{date}">{escape(text)}</changelog>\n')
+        file.write('</package>\n')
+    file.write('</otherdata>\n')
+
+
+def write_updateinfo_xml(packages: Iterator[SyntheticPackage], file):
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n<updates>\n')
+    for package in packages:
+        number = package.number
+        if number % PACKAGES_PER_UPDATE:
+            continue
+        security = number % (PACKAGES_PER_UPDATE * 2) == 0
+        update_type = 'security' if security else 'bugfix'
+        nevra = f'{package.name}-{package.version}-{package.release}'
+        file.write(f'''  <update from="releng@example.com" status="final" type="{update_type}" version="2">
+    <id>SYNTH-2021:{number:06d}</id>
+    <title>{'Important' if security else 'Moderate'}: {package.name} update</title>
+    <issued date="2021-{number % 12 + 1:02d}-01 00:00:00"/>
+    <updated date="2021-{number % 12 + 1:02d}-02 00:00:00"/>
+    <rights>Copyright 2021 Synthetic</rights>
+    <release>0</release>
+    <pushcount>1</pushcount>
+    <severity>{'Important' if security else 'Moderate'}</severity>
+    <summary>An update for {package.name} is now available</summary>
+    <description>{escape(package.description)}</description>
+    <references>
+      <reference href="https://example.com/errata/SYNTH-2021:{number:06d}" id="SYNTH-2021:{number:06d}" \
+type="self" title="SYNTH-2021:{number:06d}"/>
+      <reference href="https://example.com/cve/CVE-2021-{number:06d}" id="CVE-2021-{number:06d}" type="cve" \
+title="CVE-2021-{number:06d}"/>
+    </references>
+    <pkglist>
+      <collection short="synthetic-8-{package.arch}">
+        <name>synthetic-8-{package.arch}</name>
+        <package name="{package.name}" version="{package.version}" release="{package.release}" \
+epoch="{package.epoch}" arch="{package.arch}" src="{nevra}.src.rpm">
+          <filename>{nevra}.{package.arch}.rpm</filename>
+          <sum type="sha256">{package.pkg_id}</sum>
+        </package>
+      </collection>
+    </pkglist>
+  </update>
+''')
+    file.write('</updates>\n')
+
+
+def _translations(tag: str, text: str) -> str:
+    lines = [f'    <{tag}>{escape(text)}</{tag}>\n']
+    for language in COMPS_LANGUAGES:
+        lines.append(f'    <{tag} xml:lang="{language}">{escape(text)} ({language})</{tag}>\n')
+    return ''.join(lines)
+
+
+def write_comps_xml(packages: Iterator[SyntheticPackage], count: int, file):
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<!DOCTYPE comps PUBLIC "-//Red Hat, Inc.//DTD Comps info//EN" "comps.dtd">\n<comps>\n')
+    members = []
+    group_count = 0
+    for package in packages:
+        members.append(package.name)
+        if len(members) == PACKAGES_PER_GROUP or package.number == count - 1:
+            file.write(f'  <group>\n    <id>group{group_count}</id>\n')
+            file.write(_translations('name', f'Group {group_count}'))
+            file.write(_translations('description', f'Packages of group {group_count}'))
+            file.write('    <default>false</default>\n    <uservisible>true</uservisible>\n    <packagelist>\n')
+            for member_number, member in enumerate(members):
+                member_type = ['mandatory', 'default', 'optional'][member_number % 3]
+                file.write(f'      <packagereq type="{member_type}">{member}</packagereq>\n')
+            file.write('    </packagelist>\n  </group>\n')
+            members = []
+            group_count += 1
+
+    for category in range(0, group_count, GROUPS_PER_CATEGORY):
+        file.write(f'  <category>\n    <id>category{category}</id>\n')
+        file.write(_translations('name', f'Category {category}'))
+        file.write(_translations('description', f'Groups {category} and up'))
+        file.write(f'    <display_order>{category}</display_order>\n    <grouplist>\n')
+        for group in range(category, min(category + GROUPS_PER_CATEGORY, group_count)):
+            file.write(f'      <groupid>group{group}</groupid>\n')
+        file.write('    </grouplist>\n  </category>\n')
+
+    file.write('  <environment>\n    <id>synthetic-environment</id>\n')
+    file.write(_translations('name', 'Synthetic Environment'))
+    file.write(_translations('description', 'Every group'))
+    file.write('    <display_order>1</display_order>\n    <grouplist>\n')
+    for group in range(min(group_count, GROUPS_PER_CATEGORY)):
+        file.write(f'      <groupid>group{group}</groupid>\n')
+    file.write('    </grouplist>\n    <optionlist>\n')
+    for group in range(GROUPS_PER_CATEGORY, group_count):
+        file.write(f'      <groupid>group{group}</groupid>\n')
+    file.write('    </optionlist>\n  </environment>\n</comps>\n')
+
+
+# Schema of the databases createrepo_c writes, database_version 10
+PRIMARY_SCHEMA = [
+    'CREATE TABLE db_info (dbversion INTEGER, checksum TEXT)',
+    'CREATE TABLE packages ( pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, version TEXT, '
+    'epoch TEXT, release TEXT, summary TEXT, description TEXT, url TEXT, time_file INTEGER, time_build INTEGER, '
+    'rpm_license TEXT, rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT, rpm_sourcerpm TEXT, '
+    'rpm_header_start INTEGER, rpm_header_end INTEGER, rpm_packager TEXT, size_package INTEGER, '
+    'size_installed INTEGER, size_archive INTEGER, location_href TEXT, location_base TEXT, checksum_type TEXT)',
+    'CREATE TABLE files ( name TEXT, type TEXT, pkgKey INTEGER)',
+    'CREATE INDEX packagename ON packages (name)',
+    'CREATE INDEX packageId ON packages (pkgId)',
+    'CREATE INDEX filenames ON files (name)'
+] + [f'CREATE TABLE {dependency_type} ( name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, '
+     f'pkgKey INTEGER {", pre BOOLEAN DEFAULT FALSE" if dependency_type == "requires" else ""})'
+     for dependency_type in DEPENDENCY_TYPES]
+
+FILELISTS_SCHEMA = [
+    'CREATE TABLE db_info (dbversion INTEGER, checksum TEXT)',
+    'CREATE TABLE packages ( pkgKey INTEGER PRIMARY KEY, pkgId TEXT)',
+    'CREATE TABLE filelist ( pkgKey INTEGER, dirname TEXT, filenames TEXT, filetypes TEXT)',
+    'CREATE INDEX keyfile ON filelist (pkgKey)',
+    'CREATE INDEX pkgId ON packages (pkgId)',
+    'CREATE INDEX dirnames ON filelist (dirname)'
+]
+
+OTHER_SCHEMA = [
+    'CREATE TABLE db_info (dbversion INTEGER, checksum TEXT)',
+    'CREATE TABLE packages ( pkgKey INTEGER PRIMARY KEY, pkgId TEXT)',
+    'CREATE TABLE changelog ( pkgKey INTEGER, author TEXT, date INTEGER, changelog TEXT)',
+    'CREATE INDEX keychange ON changelog (pkgKey)',
+    'CREATE INDEX pkgId ON packages (pkgId)'
+]
+
+
+def _new_database(filename: str, schema: List[str], open_checksum: str) -> sqlite3.Connection:
+    if os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename)
+    for statement in schema:
+        connection.execute(statement)
+    connection.execute('INSERT INTO db_info VALUES (?, ?)', (DATABASE_VERSION, open_checksum))
+    return connection
+
+
+def write_primary_sqlite(packages: Iterator[SyntheticPackage], filename: str, open_checksum: str):
+    with _new_database(filename, PRIMARY_SCHEMA, open_checksum) as connection:
+        for package in packages:
+            key = package.number + 1
+            number = package.number
+            connection.execute(
+                'INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '
+                '?, ?)',
+                (key, package.pkg_id, package.name, package.arch, package.version, str(package.epoch),
+                 package.release, package.summary, package.description, f'https://example.com/{package.name}',
+                 1600000000 + number, 1590000000 + number, 'MIT', 'Synthetic', 'Unspecified',
+                 f'build{number % 100}.example.com', f'{package.name}-{package.version}-{package.release}.src.rpm',
+                 4504, 20000 + number, 'Synthetic Build System <build@example.com>', 10000 + number,
+                 50000 + number, 51000 + number,
+                 f'Packages/{package.name[0]}/{package.name}-{package.version}-{package.release}.{package.arch}.rpm',
+                 None, 'sha256'))
+            connection.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                                   [(path, file_type, key) for path, file_type in package.primary_files])
+            for dependency_type, dependencies in package.dependencies.items():
+                if dependency_type == 'requires':
+                    connection.executemany('INSERT INTO requires VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                           [(*dependency[:5], key, 'TRUE' if dependency[5] else 'FALSE')
+                                            for dependency in dependencies])
+                else:
+                    connection.executemany(f'INSERT INTO {dependency_type} VALUES (?, ?, ?, ?, ?, ?)',
+                                           [(*dependency[:5], key) for dependency in dependencies])
+    connection.close()
+
+
+def write_filelists_sqlite(packages: Iterator[SyntheticPackage], filename: str, open_checksum: str):
+    with _new_database(filename, FILELISTS_SCHEMA, open_checksum) as connection:
+        for package in packages:
+            key = package.number + 1
+            connection.execute('INSERT INTO packages VALUES (?, ?)', (key, package.pkg_id))
+            # One row per directory, file names joined with / and one character per file type
+            directories = {}
+            for path, file_type in package.files:
+                dirname, basename = path.rsplit('/', 1)
+                names, types = directories.setdefault(dirname or '/', ([], []))
+                names.append(basename)
+                types.append(file_type[0])
+            connection.executemany('INSERT INTO filelist VALUES (?, ?, ?, ?)',
+                                   [(key, dirname, '/'.join(names), ''.join(types))
+                                    for dirname, (names, types) in directories.items()])
+    connection.close()
+
+
+def write_other_sqlite(packages: Iterator[SyntheticPackage], filename: str, open_checksum: str):
+    with _new_database(filename, OTHER_SCHEMA, open_checksum) as connection:
+        for package in packages:
+            key = package.number + 1
+            connection.execute('INSERT INTO packages VALUES (?, ?)', (key, package.pkg_id))
+            connection.executemany('INSERT INTO changelog VALUES (?, ?, ?, ?)',
+                                   [(key, *changelog) for changelog in package.changelogs])
+    connection.close()
+
+
+def _sha256(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for data in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _compress(source: str, destination: str, module):
+    with open(source, 'rb') as source_file, module.open(destination, 'wb') as destination_file:
+        for data in iter(lambda: source_file.read(1024 * 1024), b''):
+            destination_file.write(data)
+
+
+@dataclass
+class GeneratedRepo(object):
+    """Where the files of a generated repository are"""
+    # Directory that contains the repodata directory
+    path: str
+    count: int
+    seed: int
+
+    @property
+    def xml_dir(self) -> str:
+        return os.path.join(self.path, 'xml')
+
+    def xml(self, data_type: str) -> str:
+        """The uncompressed XML file of a metadata type, ie. primary or comps"""
+        return os.path.join(self.xml_dir, f'{data_type}.xml')
+
+    def sqlite(self, data_type: str) -> str:
+        """The uncompressed SQLite database of a metadata type, ie. primary"""
+        return os.path.join(self.xml_dir, f'{data_type}.sqlite')
+
+    @property
+    def marker(self) -> str:
+        return os.path.join(self.path, '.generated')
+
+    @property
+    def complete(self) -> bool:
+        """Whether the repository was generated completely with the same count, seed and generator version"""
+        if not os.path.exists(self.marker):
+            return False
+        with open(self.marker) as marker:
+            return marker.read() == f'{self.count} {self.seed} {GENERATOR_VERSION}'
+
+
+def generate_repo(count: int, path: str, seed: int = 1) -> GeneratedRepo:
+    """
+    Write a synthetic repository
+
+    :param count: Number of packages
+    :param path: Directory to write the repository to, repodata and xml directories are made in it
+    :param seed: Seed of the random number generator
+    :returns: GeneratedRepo
+    """
+    start = time.perf_counter()
+    repo = GeneratedRepo(path, count, seed)
+    repodata = os.path.join(path, 'repodata')
+    for directory in (repo.xml_dir, repodata):
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+    if os.path.exists(repo.marker):
+        os.remove(repo.marker)
+
+    writers = {
+        'primary': lambda file: write_primary_xml(make_packages(count, seed), count, file),
+        'filelists': lambda file: write_filelists_xml(make_packages(count, seed), count, file),
+        'other': lambda file: write_other_xml(make_packages(count, seed), count, file),
+        'updateinfo': lambda file: write_updateinfo_xml(make_packages(count, seed), file),
+        'comps': lambda file: write_comps_xml(make_packages(count, seed), count, file)
+    }
+    sqlite_writers = {
+        'primary': write_primary_sqlite,
+        'filelists': write_filelists_sqlite,
+        'other': write_other_sqlite
+    }
+    # (data type, file name in the xml directory, compression module, file name suffix in repodata, database version)
+    listed = []
+    for data_type, write in writers.items():
+        with open(repo.xml(data_type), 'w', encoding='utf8') as file:
+            write(file)
+        logger.info(f'Wrote {data_type}.xml')
+        repomd_type = 'group_gz' if data_type == 'comps' else data_type
+        listed.append((repomd_type, repo.xml(data_type), gzip, f'{data_type}.xml.gz', None))
+        if data_type in sqlite_writers:
+            sqlite_writers[data_type](make_packages(count, seed), repo.sqlite(data_type), _sha256(repo.xml(data_type)))
+            logger.info(f'Wrote {data_type}.sqlite')
+            listed.append((f'{data_type}_db', repo.sqlite(data_type), bz2, f'{data_type}.sqlite.bz2',
+                           DATABASE_VERSION))
+
+    repomd = ['<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+              'xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n  <revision>1620000000</revision>\n']
+    for repomd_type, source, module, suffix, database_version in listed:
+        temporary = os.path.join(repodata, suffix)
+        _compress(source, temporary, module)
+        checksum = _sha256(temporary)
+        filename = f'{checksum}-{suffix}'
+        os.rename(temporary, os.path.join(repodata, filename))
+        repomd.append(f'''  <data type="{repomd_type}">
+    <checksum type="sha256">{checksum}</checksum>
+    <open-checksum type="sha256">{_sha256(source)}</open-checksum>
+    <location href="repodata/{filename}"/>
+    <timestamp>1620000000</timestamp>
+    <size>{os.path.getsize(os.path.join(repodata, filename))}</size>
+    <open-size>{os.path.getsize(source)}</open-size>
+''')
+        if database_version is not None:
+            repomd.append(f'    <database_version>{database_version}</database_version>\n')
+        repomd.append('  </data>\n')
+    repomd.append('</repomd>\n')
+    with open(os.path.join(repodata, 'repomd.xml'), 'w', encoding='utf8') as repomd_file:
+        repomd_file.write(''.join(repomd))
+
+    with open(repo.marker, 'w') as marker:
+        marker.write(f'{count} {seed} {GENERATOR_VERSION}')
+    logger.info(f'Generated {count} packages in {path} in {time.perf_counter() - start:.2f}s')
+    return repo
+
+
+def parse_count(count: str) -> int:
+    """Read a package count, either a number or one of SCALES"""
+    return SCALES[count] if count in SCALES else int(count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic repository')
+    parser.add_argument('count', type=parse_count, help=f'Number of packages, or one of {", ".join(SCALES)}')
+    parser.add_argument('path', help='Directory to write the repository to')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random number generator')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate_repo(args.count, args.path, args.seed)
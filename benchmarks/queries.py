@@ -0,0 +1,239 @@
+"""
+Query benchmarks
+
+Times the lookups the explorer does the most against a loaded database: a package by pkgId, by name and by name and
+architecture, what provides or requires a capability, which package owns a file, and the dependencies, file list and
+changelog of a package. Each query runs once for every value of a sample taken from the database itself, and the
+mean time per query is reported.
+
+The queries only use columns every schema version has, so the same run can be pointed at a database of an older
+layout (--database) to compare it with a migrated or freshly loaded one. Without --database a generated repository
+(see benchmarks.generate) is loaded into a new SQLite database first.
+
+Usage: python -m benchmarks.queries [--scale 50k] [--database sqlite:///old.db] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.engine import Connection, Engine
+
+from rpm_package_explorer.db_model.loader import BulkLoader
+from rpm_package_explorer.db_model.migrate import schema_version
+from rpm_package_explorer.db_model.utils import DB_TABLE
+from rpm_package_explorer.ingest import Repo, ingest_repo
+
+from .generate import SCALES, GeneratedRepo, generate_repo, parse_count
+from .run import DEFAULT_WORKDIR, _git_commit
+
+# Bumped whenever the layout of the results changes
+RESULTS_FORMAT_VERSION = 1
+
+# Number of values each query is run with
+DEFAULT_SAMPLE_SIZE = 200
+
+# {query name: (sample name, function(connection, value) running the query)}
+QUERIES: Dict[str, Tuple[str, Callable]] = {}
+
+logger = logging.getLogger(__name__)
+
+
+def query(name: str, sample: str):
+    """Decorator that registers a query, run with every value of a sample from SAMPLES"""
+    def register(function: Callable):
+        QUERIES[name] = (sample, function)
+        return function
+    return register
+
+
+def _rows(connection: Connection, statement) -> int:
+    return len(connection.execute(statement).fetchall())
+
+
+@query('package_by_pkgid', 'pkgId')
+def _package_by_pkgid(connection: Connection, pkg_id: str) -> int:
+    packages = DB_TABLE['packages']
+    return _rows(connection, select(packages.c.name, packages.c.version).where(packages.c.pkgId == pkg_id))
+
+
+@query('packages_by_name', 'name')
+def _packages_by_name(connection: Connection, name: Tuple[str, str]) -> int:
+    packages = DB_TABLE['packages']
+    return _rows(connection, select(packages.c.pkgId, packages.c.version).where(packages.c.name == name[0]))
+
+
+@query('packages_by_name_arch', 'name')
+def _packages_by_name_arch(connection: Connection, name: Tuple[str, str]) -> int:
+    packages = DB_TABLE['packages']
+    return _rows(connection, select(packages.c.pkgId, packages.c.version)
+                 .where(packages.c.name == name[0], packages.c.arch == name[1]))
+
+
+@query('whatprovides', 'provides')
+def _whatprovides(connection: Connection, capability: str) -> int:
+    provides = DB_TABLE['provides']
+    return _rows(connection, select(provides.c.pkgId, provides.c.version).where(provides.c.name == capability))
+
+
+@query('whatrequires', 'requires')
+def _whatrequires(connection: Connection, capability: str) -> int:
+    requires = DB_TABLE['requires']
+    return _rows(connection, select(requires.c.pkgId, requires.c.flags).where(requires.c.name == capability))
+
+
+@query('file_owner', 'file')
+def _file_owner(connection: Connection, path: str) -> int:
+    files = DB_TABLE['files']
+    return _rows(connection, select(files.c.pkgId).where(files.c.name == path))
+
+
+@query('requires_of_package', 'pkgId')
+def _requires_of_package(connection: Connection, pkg_id: str) -> int:
+    requires = DB_TABLE['requires']
+    return _rows(connection, select(requires.c.name, requires.c.flags).where(requires.c.pkgId == pkg_id))
+
+
+@query('filelist_of_package', 'pkgId')
+def _filelist_of_package(connection: Connection, pkg_id: str) -> int:
+    filelist = DB_TABLE['filelist']
+    return _rows(connection, select(filelist.c.filename, filelist.c.filetype)
+                 .where(filelist.c.pkgId == pkg_id).order_by(filelist.c.filename))
+
+
+@query('changelog_of_package', 'pkgId')
+def _changelog_of_package(connection: Connection, pkg_id: str) -> int:
+    changelog = DB_TABLE['changelog']
+    return _rows(connection, select(changelog.c.author, changelog.c.date)
+                 .where(changelog.c.pkgId == pkg_id).order_by(changelog.c.date.desc()))
+
+
+# {sample name: query selecting the values it's drawn from}
+SAMPLES = {
+    'pkgId': lambda: select(DB_TABLE['packages'].c.pkgId),
+    'name': lambda: select(DB_TABLE['packages'].c.name, DB_TABLE['packages'].c.arch),
+    'provides': lambda: select(DB_TABLE['provides'].c.name).distinct(),
+    'requires': lambda: select(DB_TABLE['requires'].c.name).distinct(),
+    'file': lambda: select(DB_TABLE['files'].c.name).distinct()
+}
+
+
+def draw_samples(connection: Connection, size: int, seed: int = 1) -> Dict[str, list]:
+    """
+    Draw the values the queries are run with from the database
+
+    :param connection: A connection to the database
+    :param size: Number of values per sample
+    :param seed: Seed of the random number generator, the same database and seed give the same values
+    :returns: Dictionary of {sample name: list of values}
+    """
+    rng = random.Random(seed)
+    samples = {}
+    for name, statement in SAMPLES.items():
+        values = sorted(tuple(row) if len(row) > 1 else row[0] for row in connection.execute(statement()))
+        samples[name] = rng.sample(values, min(size, len(values)))
+    return samples
+
+
+def run_queries(engine: Engine, sample_size: int = DEFAULT_SAMPLE_SIZE, names: List[str] = None,
+                seed: int = 1) -> List[dict]:
+    """
+    Run every query with every value of its sample
+
+    :param engine: The SQLAlchemy engine of the database
+    :param sample_size: Number of values each query is run with
+    :param names: The queries to run. Runs all of them if not provided
+    :param seed: Seed of the sampling
+    :returns: List of {query, runs, rows, seconds, mean_milliseconds}
+    """
+    results = []
+    with engine.connect() as connection:
+        samples = draw_samples(connection, sample_size, seed)
+        for name in names or QUERIES:
+            sample, function = QUERIES[name]
+            # Once untimed, so every query starts with the same pages cached
+            for value in samples[sample]:
+                function(connection, value)
+            rows = 0
+            start = time.perf_counter()
+            for value in samples[sample]:
+                rows += function(connection, value)
+            seconds = time.perf_counter() - start
+            runs = len(samples[sample])
+            results.append({
+                'query': name,
+                'runs': runs,
+                'rows': rows,
+                'seconds': seconds,
+                'mean_milliseconds': seconds / runs * 1000 if runs else None
+            })
+            logger.info(f'{name}: {runs} runs, {rows} rows, {results[-1]["mean_milliseconds"]:.3f}ms per query')
+    return results
+
+
+def load_generated(count: int, workdir: str = DEFAULT_WORKDIR, seed: int = 1) -> str:
+    """
+    Load a generated repository into a new SQLite database, generating the repository if it's missing
+
+    :param count: Package count of the repository
+    :param workdir: Directory generated repositories are kept in
+    :param seed: Seed of the repository generator
+    :returns: The SQLAlchemy URL of the database
+    """
+    repo = GeneratedRepo(os.path.join(workdir, f'repo-{count}-{seed}'), count, seed)
+    if not repo.complete:
+        repo = generate_repo(count, repo.path, seed)
+    database = os.path.join(workdir, f'queries-{count}-{seed}.db')
+    if os.path.exists(database):
+        os.remove(database)
+    loader = BulkLoader(f'sqlite:///{database}')
+    loader.create_tables()
+    ingest_repo(loader, Repo('benchmark', repo.path), workdir, ['primary_db', 'filelists_db', 'other_db'])
+    loader.engine.dispose()
+    return f'sqlite:///{database}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the common queries against a loaded database')
+    parser.add_argument('--scale', type=parse_count, default=SCALES['50k'],
+                        help=f'Package count of the generated repository, a number or {", ".join(SCALES)}. '
+                             f'Defaults to 50k')
+    parser.add_argument('--database', default=None,
+                        help='SQLAlchemy URL of an already loaded database to run against instead')
+    parser.add_argument('--query', nargs='+', choices=list(QUERIES), default=None,
+                        help='Queries to run, defaults to all of them')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLE_SIZE, help='Values each query is run with')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='Directory generated repositories are kept in')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the repository generator and the sampling')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file, defaults to stdout')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    database = args.database or load_generated(args.scale, args.workdir, args.seed)
+    engine = create_engine(database)
+    with engine.connect() as version_connection:
+        version = schema_version(version_connection)
+    output = {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'commit': _git_commit(),
+        'timestamp': int(time.time()),
+        'database': database,
+        'schema_version': version,
+        'results': run_queries(engine, args.samples, args.query, args.seed)
+    }
+    if engine.dialect.name == 'sqlite' and engine.url.database:
+        output['database_bytes'] = os.path.getsize(engine.url.database)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
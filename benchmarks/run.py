@@ -0,0 +1,290 @@
+"""
+Parser benchmarks
+
+Generates synthetic repositories (see benchmarks.generate) and times every parser against them:
+- the XML parsers: parse_primary_new, parse_filelists_new, parse_otherdata_new, parse_updateinfo and parse_groups
+- the SQLite databases read row by row (iter_sqlite_rows), which is what non-SQLite databases go through
+- ingest_repo() into a new SQLite database, which is what parse_repodata.py runs, for each SQLite and XML
+  metadata type on its own
+
+Every benchmark runs in a fresh process so its memory use isn't mixed up with the others. It runs once for the time
+and once more under tracemalloc for the peak memory allocated by Python; the maximum RSS of the process is reported
+as well. Results are written as JSON, and --compare checks them against the results of an earlier run, ie. of the
+previous commit, exiting with status 1 if anything got slower by more than the threshold.
+
+Usage: python -m benchmarks.run [--scale 1k 50k] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+from sqlalchemy import func, select
+
+from rpm_package_explorer.db_model.loader import BulkLoader
+from rpm_package_explorer.db_model.refresh import METADATA_TABLES, metadata_name
+from rpm_package_explorer.db_model.utils import DB_TABLE, iter_sqlite_rows
+from rpm_package_explorer.ingest import Repo, ingest_repo
+from rpm_package_explorer.xmlparser import parse_filelists_new, parse_groups, parse_otherdata_new, \
+    parse_primary_new, parse_updateinfo
+
+from .generate import DATABASE_VERSION, SCALES, GeneratedRepo, generate_repo, parse_count
+
+# Bumped whenever the layout of the results changes
+RESULTS_FORMAT_VERSION = 1
+
+# Default slowdown that --compare reports as a regression, 0.1 is 10% slower
+DEFAULT_THRESHOLD = 0.1
+
+# Where generated repositories are kept between runs
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'rpm-package-explorer-benchmarks')
+
+# {benchmark name: function(GeneratedRepo, scratch directory) returning the number of rows or items parsed}
+BENCHMARKS: Dict[str, Callable] = {}
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark(name: str):
+    """Decorator that registers a benchmark"""
+    def register(function: Callable):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _count_rows(parsed: dict) -> int:
+    return sum(len(rows) for rows in parsed.values())
+
+
+@benchmark('parse_primary_new')
+def _parse_primary_new(repo: GeneratedRepo, scratch: str) -> int:
+    return _count_rows(parse_primary_new(repo.xml('primary')))
+
+
+@benchmark('parse_filelists_new')
+def _parse_filelists_new(repo: GeneratedRepo, scratch: str) -> int:
+    return _count_rows(parse_filelists_new(repo.xml('filelists')))
+
+
+@benchmark('parse_otherdata_new')
+def _parse_otherdata_new(repo: GeneratedRepo, scratch: str) -> int:
+    return _count_rows(parse_otherdata_new(repo.xml('other')))
+
+
+@benchmark('parse_updateinfo')
+def _parse_updateinfo(repo: GeneratedRepo, scratch: str) -> int:
+    return len(parse_updateinfo(repo.xml('updateinfo'))['update'])
+
+
+@benchmark('parse_groups')
+def _parse_groups(repo: GeneratedRepo, scratch: str) -> int:
+    return _count_rows(parse_groups(repo.xml('comps')))
+
+
+def _sqlite_rows_benchmark(data_type: str):
+    def run(repo: GeneratedRepo, scratch: str) -> int:
+        return sum(1 for _ in iter_sqlite_rows(repo.sqlite(data_type), f'{data_type}_db', DATABASE_VERSION))
+    return run
+
+
+def _ingest_benchmark(repo_category: str):
+    def run(repo: GeneratedRepo, scratch: str) -> int:
+        database = os.path.join(scratch, f'{repo_category}.db')
+        if os.path.exists(database):
+            os.remove(database)
+        loader = BulkLoader(f'sqlite:///{database}')
+        loader.create_tables()
+        try:
+            ingest_repo(loader, Repo('benchmark', repo.path), scratch, [repo_category])
+            with loader.engine.connect() as connection:
+                return sum(connection.execute(select(func.count()).select_from(DB_TABLE[table_name])).scalar()
+                           for table_name in METADATA_TABLES[metadata_name(repo_category)])
+        finally:
+            loader.engine.dispose()
+            os.remove(database)
+    return run
+
+
+for _data_type in ('primary', 'filelists', 'other'):
+    benchmark(f'iter_sqlite_rows:{_data_type}_db')(_sqlite_rows_benchmark(_data_type))
+for _repo_category in ('primary_db', 'filelists_db', 'other_db', 'primary', 'filelists', 'other'):
+    benchmark(f'ingest_repo:{_repo_category}')(_ingest_benchmark(_repo_category))
+
+
+def _max_rss() -> int:
+    """Maximum RSS of this process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _run_in_process(name: str, repo: GeneratedRepo, scratch: str, repeat: int, trace_memory: bool) -> dict:
+    """Run a benchmark, called in its own process"""
+    function = BENCHMARKS[name]
+    times = []
+    rows = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        rows = function(repo, scratch)
+        times.append(time.perf_counter() - start)
+    max_rss = _max_rss()
+    peak = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        function(repo, scratch)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'benchmark': name,
+        'packages': repo.count,
+        'seconds': min(times),
+        'rows': rows,
+        'rows_per_second': rows / min(times) if rows and min(times) else None,
+        'peak_traced_bytes': peak,
+        'max_rss_bytes': max_rss
+    }
+
+
+def run_benchmark(name: str, repo: GeneratedRepo, scratch: str, repeat: int = 1, trace_memory: bool = True) -> dict:
+    """
+    Run a benchmark in a new process
+
+    :param name: The benchmark name, one of BENCHMARKS
+    :param repo: The generated repository to run it against
+    :param scratch: Directory the benchmark can write to
+    :param repeat: Number of timed runs, the fastest one is reported
+    :param trace_memory: Whether to run it once more under tracemalloc for the peak memory use
+    :returns: Dictionary of the results
+    """
+    # spawn rather than fork, so the process starts without anything the parent allocated
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_in_process, name, repo, scratch, repeat, trace_memory).result()
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(counts: List[int], workdir: str = DEFAULT_WORKDIR, names: List[str] = None, repeat: int = 1,
+                   trace_memory: bool = True, seed: int = 1) -> dict:
+    """
+    Generate the repositories that are missing and run the benchmarks against each of them
+
+    :param counts: Package counts of the repositories to run against
+    :param workdir: Directory generated repositories are kept in, and reused from on the next run
+    :param names: The benchmarks to run. Runs all of them if not provided
+    :param repeat: Number of timed runs of each benchmark
+    :param trace_memory: Whether to measure the peak memory use with tracemalloc as well
+    :param seed: Seed of the repository generator
+    :returns: Dictionary of the results, as written to the JSON output
+    """
+    results = []
+    for count in counts:
+        repo = GeneratedRepo(os.path.join(workdir, f'repo-{count}-{seed}'), count, seed)
+        if not repo.complete:
+            repo = generate_repo(count, repo.path, seed)
+        scratch = tempfile.mkdtemp(prefix='scratch-', dir=workdir)
+        try:
+            for name in names or BENCHMARKS:
+                result = run_benchmark(name, repo, scratch, repeat, trace_memory)
+                logger.info(f'{name} ({count} packages): {result["seconds"]:.3f}s, {result["rows"]} rows, '
+                            f'max RSS {result["max_rss_bytes"] / 1024 / 1024:.0f} MiB')
+                results.append(result)
+        finally:
+            for name in os.listdir(scratch):
+                path = os.path.join(scratch, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+            os.rmdir(scratch)
+    return {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'commit': _git_commit(),
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """
+    Compare two runs
+
+    :param baseline: Results of the earlier run
+    :param current: Results of this run
+    :param threshold: Slowdown that counts as a regression, ie. 0.1 for 10% slower
+    :returns: List of {benchmark, packages, baseline_seconds, seconds, ratio, regression} for every benchmark that's
+              in both runs
+    """
+    earlier = {(result['benchmark'], result['packages']): result for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        before = earlier.get((result['benchmark'], result['packages']))
+        if before is None:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else None
+        comparison.append({
+            'benchmark': result['benchmark'],
+            'packages': result['packages'],
+            'baseline_seconds': before['seconds'],
+            'seconds': result['seconds'],
+            'ratio': ratio,
+            'regression': ratio is not None and ratio > 1 + threshold
+        })
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the repodata parsers against synthetic repositories')
+    parser.add_argument('--scale', nargs='+', type=parse_count, default=[SCALES['1k']],
+                        help=f'Package counts to run against, numbers or {", ".join(SCALES)}. Defaults to 1k')
+    parser.add_argument('--benchmark', nargs='+', choices=list(BENCHMARKS), default=None,
+                        help='Benchmarks to run, defaults to all of them')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='Directory generated repositories are kept in')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per benchmark, the fastest is reported')
+    parser.add_argument('--no-memory', action='store_true', help="Don't run the benchmarks again under tracemalloc")
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the repository generator')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file, defaults to stdout')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Slowdown reported as a regression by --compare, 0.1 is 10%% slower')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    output = run_benchmarks(args.scale, args.workdir, args.benchmark, args.repeat, not args.no_memory, args.seed)
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare, encoding='utf8') as baseline_file:
+            output['comparison'] = compare_results(json.load(baseline_file), output, args.threshold)
+        for entry in output['comparison']:
+            logger.info(f'{entry["benchmark"]} ({entry["packages"]} packages): {entry["baseline_seconds"]:.3f}s -> '
+                        f'{entry["seconds"]:.3f}s{" REGRESSION" if entry["regression"] else ""}')
+        regressions = [entry for entry in output['comparison'] if entry['regression']]
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,99 @@
+"""
+Local HTTP stand-in for a mirror
+
+Serves a directory, ie. one with repositories made by benchmarks.generate, over HTTP so the prefetcher
+(rpm_package_explorer.prefetch) can be run against repositories that aren't local. A mirror is rarely as fast as
+the loopback interface, so every response can be delayed and throttled to look more like one.
+
+    with serve_directory('/tmp/rpm-package-explorer-benchmarks', latency=0.05) as url:
+        prefetch_and_ingest(loader, [Repo('benchmark', f'{url}/repo-1000-1')])
+
+Usage: python -m benchmarks.serve /tmp/rpm-package-explorer-benchmarks [--port 8080] [--latency 0.05]
+                                  [--bandwidth 10M]
+"""
+import argparse
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Bytes written at a time when the bandwidth is limited
+THROTTLE_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class MirrorRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files like SimpleHTTPRequestHandler, delayed by latency seconds and at most bandwidth bytes a second"""
+    latency: float = 0.0
+    bandwidth: int = None
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        if not self.bandwidth:
+            return super().copyfile(source, outputfile)
+        while True:
+            data = source.read(THROTTLE_CHUNK_SIZE)
+            if not data:
+                break
+            outputfile.write(data)
+            time.sleep(len(data) / self.bandwidth)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+@contextmanager
+def serve_directory(directory: str, port: int = 0, latency: float = 0.0, bandwidth: int = None):
+    """
+    Context manager that serves a directory over HTTP from a background thread
+
+    :param directory: The directory to serve
+    :param port: The port to listen on, on the loopback interface. Picks a free one if 0
+    :param latency: Seconds every response is delayed by
+    :param bandwidth: Bytes per second every response is limited to. Not limited if not provided
+    :returns: The base URL, without a trailing slash
+    """
+    handler = type('ThrottledHandler', (MirrorRequestHandler,), {'latency': latency, 'bandwidth': bandwidth})
+    server = ThreadingHTTPServer(('127.0.0.1', port), functools.partial(handler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, name='mirror', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def parse_size(size: str) -> int:
+    """Parse a byte count such as 512k or 10M"""
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    if size[-1:].lower() in units:
+        return int(float(size[:-1]) * units[size[-1].lower()])
+    return int(size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a directory of repositories over HTTP')
+    parser.add_argument('directory', help='Directory to serve')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on, on the loopback interface')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every response is delayed by')
+    parser.add_argument('--bandwidth', type=parse_size, default=None,
+                        help='Bytes per second every response is limited to, ie. 10M')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    with serve_directory(args.directory, args.port, args.latency, args.bandwidth) as url:
+        logger.info(f'Serving {args.directory} at {url}, Ctrl+C to stop')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
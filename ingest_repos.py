@@ -0,0 +1,57 @@
+"""
+Load every repository listed in a manifest into the explorer database
+
+Usage: python ingest_repos.py manifest.json [--workers 8] [--database sqlite:///rpm_package_explorer.db]
+                                            [--search-index search.idx] [--metrics stages.json]
+                                            [--xml-index xml-index/] [--prefetch [--concurrency 8]]
+
+See rpm_package_explorer.ingest.read_manifest() for the manifest format.
+"""
+import argparse
+import logging
+
+from rpm_package_explorer.db_model.loader import BulkLoader, DEFAULT_BATCH_SIZE
+from rpm_package_explorer.instrumentation import INSTRUMENTATION
+from rpm_package_explorer.ingest import DEFAULT_PARSE_DATA, PARSE_DATA, ingest_repos, read_manifest
+from rpm_package_explorer.prefetch import DEFAULT_CONCURRENCY, prefetch_and_ingest
+from rpm_package_explorer.search import SearchIndex
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load repositories listed in a manifest into the database')
+    parser.add_argument('manifest', help='JSON file listing the repositories to load')
+    parser.add_argument('--database', default='sqlite:///rpm_package_explorer.db', help='SQLAlchemy database URL')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parser processes, defaults to CPU count')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per insert batch')
+    parser.add_argument('--workdir', default=None,
+                        help='Directory to decompress metadata into, defaults to tmpfs when available')
+    parser.add_argument('--parse', nargs='+', choices=PARSE_DATA, default=DEFAULT_PARSE_DATA,
+                        help='Metadata types to load, the first of each kind listed in repomd.xml is used')
+    parser.add_argument('--search-index', default=None,
+                        help='Rebuild the package search index of every loaded repository into this file')
+    parser.add_argument('--xml-index', default=None,
+                        help='Keep the decompressed primary, filelists and other XML of every repository in this '
+                             'directory, with an index for reading single packages back')
+    parser.add_argument('--prefetch', action='store_true',
+                        help='Fetch and decompress the metadata with threads in this process rather than parsing it '
+                             'in a process pool. Needed for repositories at http(s) URLs')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of metadata files fetched and decompressed at once with --prefetch')
+    parser.add_argument('--metrics', default=None,
+                        help='Write the time and memory of each stage to this file, in the Prometheus text format '
+                             'if it ends with .prom and as JSON otherwise')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    loader = BulkLoader(args.database, args.batch_size)
+    loader.create_tables()
+    if args.prefetch:
+        prefetch_and_ingest(loader, read_manifest(args.manifest), args.workdir, args.parse, args.concurrency,
+                            args.xml_index)
+    else:
+        ingest_repos(loader, read_manifest(args.manifest), args.workdir, args.parse, args.workers, args.xml_index)
+    if args.search_index is not None:
+        SearchIndex.from_database(loader.engine).save(args.search_index)
+    INSTRUMENTATION.log_summary()
+    if args.metrics is not None:
+        INSTRUMENTATION.write(args.metrics)
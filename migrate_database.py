@@ -0,0 +1,34 @@
+"""
+Migrate the explorer database to the current schema version, or create it if it doesn't exist yet
+
+Usage: python migrate_database.py [--database sqlite:///rpm_package_explorer.db]
+
+See rpm_package_explorer.db_model.migrate for what changed between versions.
+"""
+import argparse
+import logging
+
+from sqlalchemy import create_engine
+
+from rpm_package_explorer.db_model.migrate import SCHEMA_VERSION, migrate
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate the database to the current schema version')
+    parser.add_argument('--database', default='sqlite:///rpm_package_explorer.db', help='SQLAlchemy database URL')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    engine = create_engine(args.database)
+    version = migrate(engine)
+    if version == SCHEMA_VERSION:
+        logging.info(f'The database is already at schema version {SCHEMA_VERSION}')
+    elif version == 0:
+        logging.info(f'Created the database at schema version {SCHEMA_VERSION}')
+    else:
+        logging.info(f'Migrated the database from schema version {version} to {SCHEMA_VERSION}')
+        if engine.dialect.name == 'sqlite':
+            # SQLite keeps the pages of the dropped old tables around for reuse rather than shrinking the file
+            logging.info('Compacting the database')
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('vacuum')
@@ -1,179 +1,36 @@
+import logging
 import os
-import sqlite3
-import shutil
 
-from contextlib import closing
-from rpm_package_explorer.xmlparser import parse_filelists_new, parse_groups, parse_other_new, parse_primary_new, parse_repomd, parse_updateinfo
-from rpm_package_explorer.utils import open_file
-from rpm_package_explorer.io_handler import read_data
-from rpm_package_explorer.db_model.utils import map_row_to_dict, DBModelFactory
-
-# Create workdir before begin processing data
-WORKDIR = 'workdir'
-SUPPORTED_DATABASE_VERSIONS = [10]
-# Define which to read first
-
-PARSE_DATA = ['primary_db', 'filelists_db', 'other_db', 'primary', 'filelists', 'other', 'group',
-              'group_gz', 'updateinfo']
-
-SKIP_PARSE = ['filelists_db', 'other_db', 'primary', 'filelists', 'other', 'group',
-              'group_gz', 'updateinfo']
-
-PRIORITY = {
-    'primary': ['primary_db', 'primary'],
-    'filelists': ['filelists_db', 'filelists'],
-    'other': ['other_db', 'other'],
-    'group': ['group', 'group_gz'],
-    'updateinfo': ['updateinfo']
-}
-
-parse_data = [x for x in PARSE_DATA if x not in SKIP_PARSE]
-
-# Set up directories
-real_workdir = os.path.join(os.getcwd(), WORKDIR)
-if os.path.isdir(real_workdir):
-    shutil.rmtree(real_workdir)
-os.mkdir(real_workdir)
-
-real_repo_data = os.path.join(os.getcwd())
-
-# Parse repomd.xml data
-repomd_data = parse_repomd('repodata/repomd.xml')
-
-# Start filtering data
-for priority_list in PRIORITY.values():
-    found = False
-    for p in priority_list:
-        if p in SKIP_PARSE:
-            repomd_data.pop(p)
-        elif p in parse_data and not found:
-            found = True
-            continue
-        else:
-            repomd_data.pop(p)
-            parse_data.remove(p)
-
-processed_data = {}
-
-# Start processing files listed in repomd.xml
-for repo_type in parse_data:
-    # Do quick and dirty data detection
-    # TODO: trim this to a one-liner
-    data = repomd_data.get(repo_type)
-    if 'open_checksum_hash_type' in data and \
-       'open_checksum_hash' in data and \
-       'open_size' in data:
-        is_archive = True
-    else:
-        is_archive = False
-    # TODO: trim this to a one-liner
-    if 'database_version' in data:
-        is_db = False
-        if data['database_version'] in SUPPORTED_DATABASE_VERSIONS:
-            is_db = True
-    else:
-        is_db = False
-
-    if is_archive:
-        source_filename: str = data['href']
-        dest_filename = source_filename.rsplit('.', maxsplit=1)[0].replace('repodata/', '')
-    else:
-        source_filename: str = data['href']
-        dest_filename = source_filename.replace('repodata/', '')
-
-    source_filepath = os.path.join(real_repo_data, source_filename)
-    dest_filepath = os.path.join(real_workdir, dest_filename)
-    if os.path.exists(dest_filepath):
-        continue
-    with open_file(source_filepath, 'rb') as source_data,\
-         open_file(dest_filepath, 'wb') as dest_data:
-        for binary_data in read_data(source_data):
-            dest_data.write(binary_data)
-        dest_data.flush()
-    del data['href']
-    data['source_filepath'] = source_filepath
-    data['dest_filepath'] = dest_filepath
-    processed_data.update({repo_type: data})
-# Finish processing repomd.xml
-
-# Start processing data based on processed_data variable
+from rpm_package_explorer.db_model.loader import BulkLoader
+from rpm_package_explorer.ingest import DEFAULT_PARSE_DATA, Repo
+from rpm_package_explorer.instrumentation import INSTRUMENTATION
+from rpm_package_explorer.prefetch import DEFAULT_CONCURRENCY, prefetch_and_ingest
+
+logging.basicConfig(level=logging.INFO)
+
+# Directory to decompress SQLite databases into, None uses tmpfs if there is one
+WORKDIR = None
+# Name the repository is stored as, used to tell what changed since the last run
+REPO_NAME = 'repodata'
+# Directory that contains the repodata directory, or the http(s) URL of one
+REPO_PATH = os.getcwd()
+# Number of metadata files fetched and decompressed at once
+CONCURRENCY = DEFAULT_CONCURRENCY
+# Database that the parsed data is loaded into
+DATABASE_URL = 'sqlite:///rpm_package_explorer.db'
+# Number of rows per table sent to the database at once
+BATCH_SIZE = 5000
+# Directory to keep the decompressed XML and its package offset index in, None doesn't keep them
+XML_INDEX_DIR = None
+# File to write the time and memory of each stage to, .prom for the Prometheus text format, JSON otherwise
+METRICS_FILE = None
+
+loader = BulkLoader(DATABASE_URL, BATCH_SIZE)
+loader.create_tables()
 try:
-    for repo_category, data in processed_data.items():
-        if repo_category == 'primary_db':
-            # SQLite doesn't close the "normal" way, so it needs slightly insane way to really close connection.
-            with closing(sqlite3.connect(data['dest_filepath'])) as connection, connection, closing(connection.cursor()) as cursor:
-                tables = [x[0] for x in cursor.execute(
-                    "select tbl_name from sqlite_master where type='table'").fetchall()]
-                for table in tables:
-                    cursor.execute(f'select * from {table}')
-                    # TODO: process data
-                    cursor.row_factory = map_row_to_dict
-                    for row in cursor.fetchall():
-                        row: dict
-                        if table == 'db_info':
-                            row['repo_category'] = repo_category
-                        db_object = DBModelFactory(table, row)
-                        print(f"{repo_category} has {db_object}")
-        elif repo_category == 'primary':
-            extracted_data = parse_primary_new(data['dest_filepath'])
-            for d in extracted_data.values():
-                print(f'{repo_category} has {d}')
-        elif repo_category == 'filelists_db':
-            # SQLite doesn't close the "normal" way, so it needs slightly insane way to really close connection.
-            with closing(sqlite3.connect(data['dest_filepath'])) as connection, connection, closing(connection.cursor()) as cursor:
-                cursor = connection.cursor()
-                tables = [x[0] for x in cursor.execute(
-                    "select tbl_name from sqlite_master where type='table'").fetchall()]
-                # We don't need to process packages table
-                tables.remove('packages')
-                for table in tables:
-                    cursor.execute(f'select * from {table}')
-                    # TODO: process data
-                    cursor.row_factory = map_row_to_dict
-                    for row in cursor.fetchall():
-                        row: dict
-                        if table == 'db_info':
-                            row['repo_category'] = repo_category
-                        db_object = DBModelFactory(table, row)
-                        print(f"{repo_category} has {db_object}")
-        elif repo_category == 'filelists':
-            extracted_data = parse_filelists_new(data['dest_filepath'])
-            for d in extracted_data.values():
-                print(f'{repo_category} has {d}')
-        elif repo_category == 'other_db':
-            # SQLite doesn't close the "normal" way, so it needs slightly insane way to really close connection.
-            with closing(sqlite3.connect(data['dest_filepath'])) as connection, connection, closing(connection.cursor()) as cursor:
-                cursor = connection.cursor()
-                tables = [x[0] for x in cursor.execute(
-                    "select tbl_name from sqlite_master where type='table'").fetchall()]
-                # We don't need to process packages table
-                tables.remove('packages')
-                for table in tables:
-                    cursor.execute(f'select * from {table}')
-                    # TODO: process data
-                    cursor.row_factory = map_row_to_dict
-                    for row in cursor.fetchall():
-                        row: dict
-                        if table == 'db_info':
-                            row['repo_category'] = repo_category
-                        db_object = DBModelFactory(table, row)
-                        print(f"{repo_category} has {db_object}")
-        elif repo_category == 'other':
-            extracted_data = parse_other_new(data['dest_filepath'])
-            for d in extracted_data.values():
-                print(f'{repo_category} has {d}')
-        elif repo_category == 'group' or repo_category == 'group_gz':
-            extracted_data = parse_groups(data['dest_filepath'])
-            for d in extracted_data.values():
-                print(f'{repo_category} has {d}')
-        elif repo_category == 'updateinfo':
-            extracted_data = parse_updateinfo(data['dest_filepath'])
-            for d in extracted_data.values():
-                print(f'{repo_category} has {d}')
-        else:
-            print(f'No handler for {repo_category} available. Please raise an issue')
+    prefetch_and_ingest(loader, [Repo(REPO_NAME, REPO_PATH)], WORKDIR, DEFAULT_PARSE_DATA, CONCURRENCY, XML_INDEX_DIR)
+    INSTRUMENTATION.log_summary()
+    if METRICS_FILE is not None:
+        INSTRUMENTATION.write(METRICS_FILE)
 except Exception as e:
     print(e)
-# Clean up workdir
-
-shutil.rmtree(real_workdir)
@@ -0,0 +1,318 @@
+"""
+Capability index for dependency queries
+
+Answers "what provides X >= 1.2", "what requires Y" and "what depends on this package" without going through the
+provides and requires rows one by one.
+
+Every capability name maps to the packages that provide it. Provides that pin a version (flags EQ, which is what
+rpmbuild generates for almost everything) are kept sorted by their EVR sort key, so a versioned query is a binary
+search. The few provides that have no version or use another comparison are kept aside and checked one by one.
+Files listed in primary are indexed as unversioned provides, same as rpm does for file requires.
+
+The index can be saved to disk and loaded back, so it doesn't have to be rebuilt every time it's needed.
+"""
+import logging
+import pickle
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.loader import row_to_dict
+from .db_model.utils import DB_TABLE
+from .evr import evr_key, parse_evr, version_key
+
+# Bumped whenever the saved index layout changes
+INDEX_FORMAT_VERSION = 1
+
+# Comparison flags as written in repodata, with the operators people actually type
+FLAGS = {
+    'LT': 'LT', '<': 'LT',
+    'LE': 'LE', '<=': 'LE',
+    'EQ': 'EQ', '=': 'EQ', '==': 'EQ',
+    'GE': 'GE', '>=': 'GE',
+    'GT': 'GT', '>': 'GT'
+}
+
+# Which side of a version each flag covers
+LESS = {'LT', 'LE'}
+EQUAL = {'LE', 'EQ', 'GE'}
+GREATER = {'GT', 'GE'}
+
+# Sorts after the sort key of any release, used to find the end of a run of provides with the same epoch:version
+_AFTER_ANY_RELEASE = ((5,),)
+
+logger = logging.getLogger(__name__)
+
+
+class Capability(NamedTuple):
+    """A single provides or requires entry"""
+    pkg_id: str
+    flags: Optional[str] = None
+    epoch: Optional[int] = None
+    version: Optional[str] = None
+    release: Optional[str] = None
+
+
+def normalize_flags(flags: Optional[str]):
+    """
+    Convert a comparison flag into the flags used by repodata, ie. >= into GE
+
+    :param flags: The flag or operator. None or an empty string means no version comparison
+    :returns: The repodata flag, or None
+    """
+    if not flags:
+        return None
+    if flags not in FLAGS:
+        raise ValueError(f'Unknown comparison flag: {flags}')
+    return FLAGS[flags]
+
+
+def _compare(a: Capability, b: Capability) -> int:
+    """Compare the EVR of two capabilities the way rpm does for dependencies: a missing release matches any release"""
+    result = (int(a.epoch or 0) > int(b.epoch or 0)) - (int(a.epoch or 0) < int(b.epoch or 0))
+    if result == 0:
+        key_a = version_key(a.version or '')
+        key_b = version_key(b.version or '')
+        result = (key_a > key_b) - (key_a < key_b)
+    if result == 0 and a.release and b.release:
+        key_a = version_key(a.release)
+        key_b = version_key(b.release)
+        result = (key_a > key_b) - (key_a < key_b)
+    return result
+
+
+def overlaps(provide: Capability, require: Capability) -> bool:
+    """
+    Check whether a provide satisfies a requirement, ie. foo = 1.4-1 satisfies foo >= 1.2
+
+    :param provide: The provided capability
+    :param require: The required capability
+    :returns: True if the version ranges of both overlap
+    """
+    if not provide.flags or not require.flags:
+        # No version on either side matches anything
+        return True
+    result = _compare(provide, require)
+    if result < 0:
+        return provide.flags in GREATER or require.flags in LESS
+    if result > 0:
+        return provide.flags in LESS or require.flags in GREATER
+    return bool({provide.flags, require.flags} <= EQUAL or {provide.flags, require.flags} <= LESS
+                or {provide.flags, require.flags} <= GREATER)
+
+
+def _requirement(flags: Optional[str], evr: Optional[str]) -> Capability:
+    """Build the capability a query asks for out of a flag and an EVR string such as 1:1.2-3"""
+    flags = normalize_flags(flags)
+    if flags is None or not evr:
+        return Capability('', None)
+    epoch, version, release = parse_evr(evr)
+    return Capability('', flags, epoch, version, release)
+
+
+class CapabilityIndex(object):
+    """Index of what every package provides and requires"""
+
+    def __init__(self) -> None:
+        # {name: [Capability]} of provides with flags EQ, sorted by EVR, with their sort keys alongside
+        self._versioned = {}
+        self._versioned_keys = {}
+        # {name: [Capability]} of the provides without a version or with another flag
+        self._unversioned = {}
+        # {name: [Capability]} of the requires
+        self._requires = {}
+        # {pkgId: [(name, Capability)]} of the provides of each package, for reverse dependencies
+        self._provided_by = {}
+        # Names of versioned provides that were added since they were last sorted
+        self._unsorted = set()
+
+    def add_provide(self, name: str, capability: Capability):
+        """
+        Add a provide to the index
+
+        :param name: The capability name, ie. libc.so.6()(64bit)
+        :param capability: The providing package along with the version it provides
+        """
+        capability = capability._replace(flags=normalize_flags(capability.flags))
+        if capability.flags == 'EQ':
+            self._versioned.setdefault(name, []).append(capability)
+            self._unsorted.add(name)
+        else:
+            self._unversioned.setdefault(name, []).append(capability)
+        self._provided_by.setdefault(capability.pkg_id, []).append((name, capability))
+
+    def add_require(self, name: str, capability: Capability):
+        """
+        Add a require to the index
+
+        :param name: The capability name
+        :param capability: The requiring package along with the versions it accepts
+        """
+        self._requires.setdefault(name, []).append(capability._replace(flags=normalize_flags(capability.flags)))
+
+    def add(self, table_name: str, row):
+        """
+        Add a provides, requires or files row
+
+        :param table_name: The table name as used in DB_MODEL. Rows of other tables are ignored
+        :param row: Database model object or dictionary containing the row data
+        """
+        if table_name not in ('provides', 'requires', 'files'):
+            return
+        data = row_to_dict(row)
+        if table_name == 'files':
+            self.add_provide(data['name'], Capability(data['pkgId']))
+            return
+        capability = Capability(data['pkgId'], data.get('flags'), data.get('epoch'), data.get('version'),
+                                data.get('release'))
+        if table_name == 'provides':
+            self.add_provide(data['name'], capability)
+        else:
+            self.add_require(data['name'], capability)
+
+    def add_all(self, rows: Iterable[Tuple[str, object]]):
+        """
+        Add every (table_name, row) tuple from an iterable, such as the output of xmlparser.iter_primary()
+
+        :param rows: Iterable of (table_name, row) tuples
+        """
+        for table_name, row in rows:
+            self.add(table_name, row)
+
+    def _sort(self):
+        """Sort the versioned provides that were added since the last query"""
+        for name in self._unsorted:
+            capabilities = self._versioned[name]
+            capabilities.sort(key=lambda capability: evr_key(capability.epoch, capability.version, capability.release))
+            self._versioned_keys[name] = [evr_key(capability.epoch, capability.version, capability.release)
+                                          for capability in capabilities]
+        self._unsorted.clear()
+
+    def what_provides(self, name: str, flags: str = None, evr: str = None) -> List[Capability]:
+        """
+        Find the packages that provide a capability, ie. what_provides('python3', '>=', '3.6')
+
+        :param name: The capability name, or a file path
+        :param flags: The comparison flag, ie. GE or >=. Matches any version if not provided
+        :param evr: The EVR to compare with, ie. 1.2 or 1:1.2-3
+        :returns: A list of the matching provides
+        """
+        self._sort()
+        require = _requirement(flags, evr)
+        unversioned = [capability for capability in self._unversioned.get(name, []) if overlaps(capability, require)]
+        versioned = self._versioned.get(name, [])
+        if require.flags is None:
+            return versioned + unversioned
+
+        # The run of provides with the same epoch:version as the requirement has to be checked one by one since the
+        # release may or may not matter, everything before or after it either matches or it doesn't
+        keys = self._versioned_keys[name] if versioned else []
+        epoch_version = (int(require.epoch or 0), version_key(require.version or ''))
+        start = bisect_left(keys, epoch_version)
+        end = bisect_left(keys, epoch_version + (_AFTER_ANY_RELEASE,), start)
+        matches = []
+        if require.flags in LESS:
+            matches.extend(versioned[:start])
+        matches.extend(capability for capability in versioned[start:end] if overlaps(capability, require))
+        if require.flags in GREATER:
+            matches.extend(versioned[end:])
+        return matches + unversioned
+
+    def what_requires(self, name: str, flags: str = None, evr: str = None) -> List[Capability]:
+        """
+        Find the packages that require a capability
+
+        :param name: The capability name, or a file path
+        :param flags: Only return the requires that a provide with this flag and EVR would satisfy
+        :param evr: The EVR of the provide, ie. 1.2-3
+        :returns: A list of the matching requires
+        """
+        provide = _requirement(flags, evr)
+        return [capability for capability in self._requires.get(name, []) if overlaps(provide, capability)]
+
+    def reverse_dependencies(self, pkg_id: str) -> Dict[str, List[str]]:
+        """
+        Find the packages that directly depend on a package, through anything it provides
+
+        :param pkg_id: The pkgId of the package
+        :returns: Dictionary of {pkgId of the depending package: [names of the capabilities it requires]}
+        """
+        dependents = {}
+        for name, provide in self._provided_by.get(pkg_id, []):
+            for require in self._requires.get(name, []):
+                if require.pkg_id != pkg_id and overlaps(provide, require):
+                    names = dependents.setdefault(require.pkg_id, [])
+                    if name not in names:
+                        names.append(name)
+        return dependents
+
+    def __len__(self) -> int:
+        """Number of distinct capability names that are provided"""
+        return len(self._versioned.keys() | self._unversioned.keys())
+
+    def save(self, filename: str):
+        """
+        Save the index to a file
+
+        :param filename: The file to write
+        """
+        self._sort()
+        with open(filename, 'wb') as index_file:
+            pickle.dump((INDEX_FORMAT_VERSION, self._versioned, self._versioned_keys, self._unversioned,
+                         self._requires, self._provided_by), index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename: str) -> 'CapabilityIndex':
+        """
+        Load an index saved with save(). The file is unpickled, so only load files this project wrote
+
+        :param filename: The file to read
+        :returns: The CapabilityIndex
+        """
+        with open(filename, 'rb') as index_file:
+            data = pickle.load(index_file)
+        if data[0] != INDEX_FORMAT_VERSION:
+            raise ValueError(f'Capability index format {data[0]} is unsupported, rebuild the index')
+        index = cls()
+        (_, index._versioned, index._versioned_keys, index._unversioned, index._requires,
+         index._provided_by) = data
+        return index
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, object]]) -> 'CapabilityIndex':
+        """
+        Build an index out of parsed rows, such as the output of xmlparser.iter_primary()
+
+        :param rows: Iterable of (table_name, row) tuples
+        :returns: The CapabilityIndex
+        """
+        index = cls()
+        index.add_all(rows)
+        index._sort()
+        return index
+
+    @classmethod
+    def from_database(cls, engine: Engine, repo_name: str = None) -> 'CapabilityIndex':
+        """
+        Build an index out of the explorer database
+
+        :param engine: The SQLAlchemy engine of the explorer database
+        :param repo_name: Only index the packages of this repository. Indexes every package if not provided
+        :returns: The CapabilityIndex
+        """
+        index = cls()
+        repo_package = DB_TABLE['repo_package']
+        with engine.connect() as connection:
+            for table_name in ('provides', 'requires', 'files'):
+                table = DB_TABLE[table_name]
+                query = select(table)
+                if repo_name is not None:
+                    query = query.where(table.c.pkgId.in_(
+                        select(repo_package.c.pkgId).where(repo_package.c.repo_name == repo_name)))
+                for row in connection.execute(query).mappings():
+                    index.add(table_name, dict(row))
+        index._sort()
+        logger.info(f'Indexed {len(index)} capabilities')
+        return index
@@ -0,0 +1,255 @@
+"""
+Bulk loader that persists parsed repository data into the database
+
+Rows are buffered per table and written with SQLAlchemy Core executemany inserts rather than adding ORM objects
+one at a time, which is what makes loading a full repository take minutes rather than hours.
+
+Works with anything SQLAlchemy can connect to; tested with SQLite and written to stay within what PostgreSQL
+accepts as well.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Tuple, Union
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Connection, Engine
+
+from ..instrumentation import stage
+from .migrate import create_schema
+from .records import CompactRecord
+from .utils import DB_INFO_QUERY, DB_TABLE, format_query, get_db_queries
+
+# Tables whose rows belong to a single repository and get the repository name of the BatchWriter stamped on them
+REPO_NAME_TABLES = {'db_info', 'repo_package', 'advisory', 'advisory_package', 'advisory_reference'}
+
+# Number of rows per table to buffer before they're sent to the database in one executemany call
+DEFAULT_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TableStats(object):
+    """Keeps track of how many rows were written to a table and how long the inserts took"""
+    rows: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.seconds == 0:
+            return 0.0
+        return self.rows / self.seconds
+
+
+def row_to_dict(row) -> dict:
+    """
+    Convert a database model, a compact record or a dictionary into a dictionary of column values
+
+    :param row: Database model object from DBModelFactory, CompactRecord or a dictionary from map_row_to_dict
+    :returns: A dictionary of {column_name: value}
+    """
+    if isinstance(row, dict):
+        return row
+    if isinstance(row, CompactRecord):
+        return row.to_dict()
+    return vars(row)
+
+
+def format_stats(stats: dict):
+    """
+    Format the loader statistics into human-readable lines
+
+    :param stats: Dictionary of {table_name: TableStats}
+    :returns: A list of lines, one per table
+    """
+    return [f'{table_name}: {table_stats.rows} rows in {table_stats.seconds:.2f}s '
+            f'({table_stats.rows_per_second:.0f} rows/s)'
+            for table_name, table_stats in stats.items()]
+
+
+class BatchWriter(object):
+    """Buffers rows per table and writes them to the database once batch_size rows are pending"""
+
+    def __init__(self, connection: Connection, batch_size=DEFAULT_BATCH_SIZE, repo_name: str = None) -> None:
+        """
+        :param connection: The connection that the rows are written with
+        :param batch_size: Number of rows per table to send in a single executemany call
+        :param repo_name: The repository name stamped on every row of REPO_NAME_TABLES
+        """
+        self._connection = connection
+        self._batch_size = batch_size
+        self.repo_name = repo_name
+        self._pending = {}
+        # Primary keys are left out so the database assigns them
+        self._columns = {table_name: [column.name for column in table.c if not column.primary_key]
+                         for table_name, table in DB_TABLE.items()}
+        self._attached = []
+        self.stats = {}
+
+    def write(self, table_name: str, row):
+        """
+        Queue a row to be written to the table
+
+        :param table_name: The table name as used in DB_MODEL
+        :param row: Database model object or dictionary containing the row data
+        """
+        data = row_to_dict(row)
+        # executemany needs every row to have the same keys, so fill in missing columns with None
+        pending = self._pending.setdefault(table_name, [])
+        pending.append({column: data.get(column) for column in self._columns[table_name]})
+        if table_name in REPO_NAME_TABLES and self.repo_name is not None:
+            pending[-1]['repo_name'] = self.repo_name
+        if len(pending) >= self._batch_size:
+            self.flush(table_name)
+
+    def write_all(self, rows: Iterable[Tuple[str, object]]):
+        """
+        Queue every (table_name, row) tuple from an iterable, such as the output of xmlparser.iter_primary()
+
+        :param rows: Iterable of (table_name, row) tuples
+        """
+        for table_name, row in rows:
+            self.write(table_name, row)
+
+    def flush(self, table_name: str = None):
+        """
+        Write the pending rows to the database
+
+        :param table_name: Only flush this table. Flushes every table if not provided
+        """
+        table_names = [table_name] if table_name is not None else list(self._pending)
+        for name in table_names:
+            pending = self._pending.get(name)
+            if not pending:
+                continue
+            start = time.perf_counter()
+            with stage('db_insert', repo=self.repo_name, table=name) as recorder:
+                self._connection.execute(insert(DB_TABLE[name]), pending)
+                recorder.add_rows(len(pending))
+            self._record(name, len(pending), time.perf_counter() - start)
+            self._pending[name] = []
+
+    def _record(self, table_name: str, rows: int, seconds: float):
+        table_stats = self.stats.setdefault(table_name, TableStats())
+        table_stats.seconds += seconds
+        table_stats.rows += rows
+
+    @property
+    def connection(self) -> Connection:
+        return self._connection
+
+    @property
+    def supports_copy(self) -> bool:
+        """Whether copy_sqlite() can be used, which is only when the data is being loaded into SQLite"""
+        return self._connection.dialect.name == 'sqlite'
+
+    def copy_sqlite(self, filename: str, repo_category: str, database_version: int, where: str = None):
+        """
+        Copy a createrepo SQLite database (primary_db, filelists_db or other_db) straight into the database
+
+        The database is ATTACHed to the connection and every table is copied with a single INSERT INTO ... SELECT,
+        so SQLite does all the work and the rows never pass through Python.
+
+        :param filename: The decompressed SQLite database file name
+        :param repo_category: The repomd data type, ie. primary_db
+        :param database_version: The database_version listed in repomd.xml
+        :param where: Extra condition on the pkgId-keyed rows, ie. to only copy packages that aren't stored yet
+        :returns: The schema name the database is attached as, valid until the transaction ends
+        """
+        queries = get_db_queries(repo_category, database_version)
+        schema = f'repodata_{len(self._attached)}'
+        self._connection.exec_driver_sql(f'attach database ? as {schema}', (filename,))
+        self._attached.append(schema)
+
+        self._copy_query('db_info', format_query(DB_INFO_QUERY, schema), repo_category=repo_category,
+                         repo_name=self.repo_name)
+        for table_name, query in queries.items():
+            query = format_query(query, schema)
+            if where is not None:
+                query = f'select * from ({query}) where {where}'
+            self._copy_query(table_name, query)
+        return schema
+
+    def _copy_query(self, table_name: str, query: str, **constants):
+        """Insert the result of the query into the table, filling in any constant columns"""
+        # Write out anything that's still pending first so rows land in the same order as they were written
+        self.flush(table_name)
+        start = time.perf_counter()
+        table = DB_TABLE[table_name]
+        query_columns = [column[0] for column in self._connection.exec_driver_sql(
+            f'select * from ({query}) limit 0').cursor.description]
+        columns = [column for column in self._columns[table_name] if column in query_columns or column in constants]
+        insert_columns = ', '.join(f'"{column}"' for column in columns)
+        select_columns = ', '.join(f':{column}' if column in constants else f'"{column}"' for column in columns)
+        with stage('db_copy', repo=self.repo_name, table=table_name) as recorder:
+            result = self._connection.exec_driver_sql(
+                f'insert into "{table.name}" ({insert_columns}) '
+                f'select {select_columns} from ({query})', constants)
+            recorder.add_rows(result.rowcount)
+        self._record(table_name, result.rowcount, time.perf_counter() - start)
+
+    def detach_all(self):
+        """Detach every database attached by copy_sqlite(). SQLite only allows this once the transaction ended"""
+        while self._attached:
+            self._connection.exec_driver_sql(f'detach database {self._attached.pop()}')
+
+
+class BulkLoader(object):
+    """Loads parsed repository data into the database, one transaction per repository"""
+
+    def __init__(self, engine: Union[Engine, str], batch_size=DEFAULT_BATCH_SIZE) -> None:
+        """
+        :param engine: SQLAlchemy engine or database URL, ie. sqlite:///rpm_package_explorer.db
+        :param batch_size: Number of rows per table to send in a single executemany call
+        """
+        if isinstance(engine, str):
+            engine = create_engine(engine)
+        self.engine = engine
+        self.batch_size = batch_size
+
+    def create_tables(self):
+        """
+        Create the tables if they don't exist yet
+
+        :raises UnsupportedSchemaVersionException: If the database has an older layout, see migrate.migrate()
+        """
+        with self.engine.begin() as connection:
+            create_schema(connection)
+
+    @contextmanager
+    def transaction(self, repo_name: str):
+        """
+        Context manager that provides a BatchWriter for a single repository
+
+        Everything written to the BatchWriter is committed together when the block exits, or rolled back if the
+        block raises an exception.
+
+        :param repo_name: The name of the repository, stamped on every row of REPO_NAME_TABLES and used for reporting
+        :returns: A BatchWriter bound to the transaction
+        """
+        start = time.perf_counter()
+        with self.engine.connect() as connection:
+            writer = BatchWriter(connection, self.batch_size, repo_name)
+            try:
+                with connection.begin():
+                    yield writer
+                    writer.flush()
+            finally:
+                writer.detach_all()
+        logger.info(f'Loaded {repo_name} in {time.perf_counter() - start:.2f}s')
+        for line in format_stats(writer.stats):
+            logger.info(f'{repo_name} {line}')
+
+    def load(self, repo_name: str, rows: Iterable[Tuple[str, object]]):
+        """
+        Load every (table_name, row) tuple into the database in a single transaction
+
+        :param repo_name: The name of the repository, stamped on every row of REPO_NAME_TABLES and used for reporting
+        :param rows: Iterable of (table_name, row) tuples
+        :returns: Dictionary of {table_name: TableStats}
+        """
+        with self.transaction(repo_name) as writer:
+            writer.write_all(rows)
+        return writer.stats
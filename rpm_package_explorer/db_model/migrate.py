@@ -0,0 +1,180 @@
+"""
+Schema versions of the explorer database and migrating older databases to the current one
+
+The version is kept in the schema_version table. Databases from before it existed are told apart by their layout:
+- 0: nothing there yet
+- 1: uuid4 text primary keys and no declared indexes. The oldest of them have a repo_name column on packages and
+  the package and all of its rows stored once per repository, later ones store them once per pkgId and keep the
+  repository membership in repo_package
+- 2: integer primary keys the database assigns, indexes on pkgId, the package name and architecture and the
+  dependency names
+- 3: db_info rows have the repository they were loaded for, and requires.pre copied from createrepo's databases is
+  0/1 rather than 'TRUE'/'FALSE' text (SCHEMA_VERSION)
+
+Migrating renames the old tables out of the way, creates the current ones and copies the rows across with
+INSERT INTO ... SELECT, in a single transaction, so a migration that fails leaves the database as it was. Packages
+stored once per repository are merged into one row per pkgId, and their rows into a single copy.
+"""
+import logging
+import time
+
+from sqlalchemy import MetaData, Table, func, insert, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from ..exceptions import UnsupportedSchemaVersionException
+from .sqlalchemy_models import SCHEMA_VERSION
+from .utils import DB_METADATA, DB_TABLE
+
+# Suffix the tables of the old layout are renamed with while the rows are copied
+LEGACY_SUFFIX = '_legacy'
+
+logger = logging.getLogger(__name__)
+
+
+def schema_version(connection: Connection) -> int:
+    """
+    Get the schema version of a database
+
+    :param connection: A connection to the explorer database
+    :returns: The version, 0 if the database is empty
+    """
+    table_names = set(inspect(connection).get_table_names())
+    if DB_TABLE['schema_version'].name in table_names:
+        table = DB_TABLE['schema_version']
+        return connection.execute(select(func.max(table.c.version))).scalar() or 0
+    if DB_TABLE['packages'].name in table_names:
+        # Only the first layout didn't have a schema_version table
+        return 1
+    return 0
+
+
+def set_schema_version(connection: Connection, version: int = SCHEMA_VERSION):
+    """Record the version the database is now at"""
+    table = DB_TABLE['schema_version']
+    connection.execute(table.delete())
+    connection.execute(insert(table).values(version=version, timestamp=int(time.time())))
+
+
+def create_schema(connection: Connection):
+    """
+    Create the tables of the current layout if they don't exist yet
+
+    :param connection: A connection to the explorer database
+    :raises UnsupportedSchemaVersionException: If the database has another layout and has to be migrated first
+    """
+    version = schema_version(connection)
+    if version not in (0, SCHEMA_VERSION):
+        raise UnsupportedSchemaVersionException(version, SCHEMA_VERSION)
+    # Also creates the indexes that are missing, create_all() checks for them first
+    DB_METADATA.create_all(connection)
+    if version == 0:
+        set_schema_version(connection)
+
+
+def _pkgid_tables():
+    """The tables of rows that belong to a package, which are stored once per pkgId"""
+    return [table_name for table_name, table in DB_TABLE.items()
+            if 'pkgId' in table.c and table_name not in ('packages', 'repo_package')]
+
+
+def _merge_copies(legacy: Table, columns: list):
+    """
+    Select the rows of a package once, out of a table that has a copy of them for every repository with the package
+
+    The rows don't say which repository they're from, and a package can have the same row twice (ie. the same
+    requires with and without pre), so a row that's there k times is kept k / n times, n being the number of copies
+    of the package: the fewest times any of its rows is there. filelist and changelog rows, which were only stored
+    once per pkgId by the incremental refresh, have n = 1 and are kept as they are.
+    """
+    key = [column for column in legacy.c if column.primary_key][0]
+    content = [legacy.c[column] for column in columns]
+    counted = select(*content, func.count().over(partition_by=content).label('occurrences'),
+                     func.row_number().over(partition_by=content, order_by=key).label('occurrence')).subquery()
+    copies = select(counted, func.min(counted.c.occurrences).over(partition_by=counted.c.pkgId).label('copies')) \
+        .subquery()
+    return select(*(copies.c[column] for column in columns)) \
+        .where(copies.c.occurrence * copies.c.copies <= copies.c.occurrences)
+
+
+def _migrate_from_1(connection: Connection):
+    """Migrate the uuid4 keyed layout, merging packages stored once per repository if that's what's there"""
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    renamed = {}
+    for table_name, table in DB_TABLE.items():
+        if table.name not in existing:
+            continue
+        # Index names are per database rather than per table, so they'd clash with the ones created below
+        for index in inspector.get_indexes(table.name):
+            connection.exec_driver_sql(f'drop index "{index["name"]}"')
+        connection.exec_driver_sql(f'alter table "{table.name}" rename to "{table.name}{LEGACY_SUFFIX}"')
+        renamed[table_name] = Table(f'{table.name}{LEGACY_SUFFIX}', MetaData(), autoload_with=connection)
+    DB_METADATA.create_all(connection)
+
+    packages = renamed.get('packages')
+    per_repository = packages is not None and 'repo_name' in packages.c
+    for table_name, legacy in renamed.items():
+        table = DB_TABLE[table_name]
+        # The old primary keys are dropped, and so is the pkgKey copied from createrepo's databases
+        columns = [column.name for column in table.c if not column.primary_key and column.name in legacy.c]
+        query = select(*(legacy.c[column] for column in columns))
+        if per_repository and table_name == 'packages':
+            key = [column for column in legacy.c if column.primary_key][0]
+            query = query.where(key.in_(select(func.min(key)).group_by(legacy.c.pkgId)))
+            connection.execute(insert(DB_TABLE['repo_package']).from_select(
+                ['repo_name', 'pkgId'], select(legacy.c.repo_name, legacy.c.pkgId).distinct()))
+        elif per_repository and table_name in _pkgid_tables():
+            query = _merge_copies(legacy, columns)
+        result = connection.execute(insert(table).from_select(columns, query))
+        logger.info(f'Migrated {result.rowcount} {table_name} rows')
+        legacy.drop(connection)
+
+
+def _migrate_from_2(connection: Connection):
+    """Add the repository to db_info and turn requires.pre copied as text into 0/1"""
+    table = DB_TABLE['db_info']
+    # Databases migrated from version 1 were created with the current layout already. The db_info rows that are
+    # already there can't be told apart and are left without a repository
+    if 'repo_name' not in {column['name'] for column in inspect(connection).get_columns(table.name)}:
+        connection.exec_driver_sql(f'alter table "{table.name}" add column repo_name text')
+    if connection.dialect.name == 'sqlite':
+        # Only SQLite let the text into a Boolean column
+        requires = DB_TABLE['requires']
+        result = connection.exec_driver_sql(
+            f'update "{requires.name}" set pre = case when pre in (\'TRUE\', 1, \'1\') then 1 else 0 end '
+            f'where typeof(pre) == \'text\'')
+        logger.info(f'Converted pre of {result.rowcount} requires rows')
+
+
+# {version: function migrating a database of that version to the next one}
+MIGRATIONS = {
+    1: _migrate_from_1,
+    2: _migrate_from_2
+}
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Migrate a database to SCHEMA_VERSION, or create the tables if it's empty
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :returns: The version the database was at
+    :raises UnsupportedSchemaVersionException: If the database is newer than this version knows about
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            # pysqlite only starts the transaction at the first INSERT, and the migrations start with DDL
+            connection.exec_driver_sql('begin')
+        initial = version = schema_version(connection)
+        if version > SCHEMA_VERSION:
+            raise UnsupportedSchemaVersionException(version, SCHEMA_VERSION)
+        if version == 0:
+            create_schema(connection)
+            return initial
+        while version < SCHEMA_VERSION:
+            start = time.perf_counter()
+            MIGRATIONS[version](connection)
+            version += 1
+            logger.info(f'Migrated the database to schema version {version} in {time.perf_counter() - start:.2f}s')
+        set_schema_version(connection, version)
+    return initial
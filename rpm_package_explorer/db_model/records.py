@@ -0,0 +1,173 @@
+"""
+Compact in-memory rows for the parse stage
+
+The database models carry a __dict__ per object, which is fine for a few thousand rows but not for the millions of
+filelist rows a large repository has. The records here hold the same columns in __slots__ instead, and on top of that:
+- strings that repeat a lot (arch, flags, file types, dependency names...) are interned so every row shares one copy
+- pkgIds are stored as the raw checksum bytes rather than the hex string, shared by every row of the same package
+- file paths are split into an interned directory name and the file name, since most files share a directory
+
+Records are read the same way as the models, ie. record.pkgId or row_to_dict(record), and can be pickled so they can
+be passed between processes.
+"""
+import sys
+from functools import lru_cache
+
+from .utils import DB_MODEL, DB_TABLE
+
+# Columns whose values repeat across rows of a table and are worth interning
+INTERNED_COLUMNS = {
+    'packages': ['arch', 'version', 'release', 'rpm_license', 'rpm_vendor', 'rpm_group', 'rpm_buildhost',
+                 'rpm_packager', 'checksum_type', 'location_base'],
+    'repo_package': ['repo_name'],
+    'conflicts': ['name', 'flags', 'version', 'release'],
+    'enhances': ['name', 'flags', 'version', 'release'],
+    'files': ['type'],
+    'obsoletes': ['name', 'flags', 'version', 'release'],
+    'provides': ['name', 'flags', 'version', 'release'],
+    'recommends': ['name', 'flags', 'version', 'release'],
+    'requires': ['name', 'flags', 'version', 'release'],
+    'suggests': ['name', 'flags', 'version', 'release'],
+    'supplements': ['name', 'flags', 'version', 'release'],
+    'filelist': ['filetype'],
+    'changelog': ['author'],
+    'advisory': ['repo_name', 'issuer', 'status', 'type', 'version', 'rights', 'release', 'severity'],
+    'advisory_package': ['repo_name', 'collection', 'arch', 'checksum_type'],
+    'advisory_reference': ['repo_name', 'type'],
+    'db_info': ['repo_category'],
+    'refresh_state': ['repo_name', 'data_type', 'checksum_hash_type']
+}
+
+# Columns that hold a file path
+PATH_COLUMNS = {
+    'files': 'name',
+    'filelist': 'filename'
+}
+
+# Number of pkgIds to keep the checksum bytes of. Rows of the same package come one after another, so this only has
+# to be large enough for rows of a handful of packages to share the same bytes
+PKGID_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=PKGID_CACHE_SIZE)
+def _pkgid_digest(pkg_id: str):
+    """Convert a hex pkgId into its checksum bytes, leaving anything that isn't hex as it is"""
+    try:
+        return bytes.fromhex(pkg_id)
+    except ValueError:
+        return pkg_id
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class CompactRecord(object):
+    """Base class of the compact records, one subclass per table in DB_MODEL"""
+    __slots__ = ()
+    table_name: str = None
+    # Every column of the table except the primary key, in table order
+    columns: tuple = ()
+    _interned: frozenset = frozenset()
+
+    def __init__(self, **kwargs) -> None:
+        for column in self.columns:
+            value = kwargs.get(column)
+            if column in self._interned:
+                value = _intern(value)
+            setattr(self, column, value)
+
+    @property
+    def pkgId(self):
+        digest = self._pkgId
+        if isinstance(digest, bytes):
+            return digest.hex()
+        return digest
+
+    @pkgId.setter
+    def pkgId(self, value):
+        self._pkgId = _pkgid_digest(value) if isinstance(value, str) else value
+
+    def _get_path(self):
+        if self._basename is None:
+            return self._dirname
+        return f'{self._dirname}/{self._basename}'
+
+    def _set_path(self, value):
+        if isinstance(value, str) and '/' in value:
+            dirname, basename = value.rsplit('/', maxsplit=1)
+            self._dirname = sys.intern(dirname)
+            self._basename = basename
+        else:
+            self._dirname = value
+            self._basename = None
+
+    def to_dict(self) -> dict:
+        """
+        :returns: A dictionary of {column_name: value}, the same as vars() of the database model
+        """
+        return {column: getattr(self, column) for column in self.columns}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CompactRecord):
+            return NotImplemented
+        return self.table_name == other.table_name and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{column}={getattr(self, column)!r}' for column in self.columns)
+        return f'{self.__class__.__name__}({values})'
+
+
+def _make_record(table_name: str):
+    """Create the CompactRecord subclass of a table"""
+    columns = tuple(column.name for column in DB_TABLE[table_name].c if not column.primary_key)
+    namespace = {
+        'table_name': table_name,
+        'columns': columns,
+        '_interned': frozenset(INTERNED_COLUMNS.get(table_name, [])),
+        '__module__': __name__
+    }
+    slots = []
+    for column in columns:
+        if column == 'pkgId':
+            slots.append('_pkgId')
+            namespace['pkgId'] = CompactRecord.pkgId
+        elif PATH_COLUMNS.get(table_name) == column:
+            slots.extend(['_dirname', '_basename'])
+            namespace[column] = property(CompactRecord._get_path, CompactRecord._set_path)
+        else:
+            slots.append(column)
+    namespace['__slots__'] = tuple(slots)
+    name = f'{DB_MODEL[table_name].__name__}Record'
+    namespace['__qualname__'] = name
+    return type(name, (CompactRecord,), namespace)
+
+
+# Dictionary that returns the record class based on the table name, same as DB_MODEL
+DB_RECORD = {table_name: _make_record(table_name) for table_name in DB_MODEL}
+# pickle looks classes up by name, so they have to be reachable from the module
+globals().update({record.__name__: record for record in DB_RECORD.values()})
+
+
+def make_record(table_name: str, data: dict) -> CompactRecord:
+    """
+    Create the compact record of a row
+
+    :param table_name: The table name as used in DB_MODEL
+    :param data: Dictionary containing the row data
+    :returns: The record
+    """
+    return DB_RECORD[table_name](**data)
+
+
+def iter_records(rows):
+    """
+    Generator function that converts (table_name, row dictionary) tuples into (table_name, record) tuples
+
+    :param rows: Iterable of (table_name, dictionary) tuples
+    :returns: (table_name, CompactRecord) tuples
+    """
+    for table_name, row in rows:
+        yield table_name, DB_RECORD[table_name](**row)
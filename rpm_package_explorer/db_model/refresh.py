@@ -0,0 +1,248 @@
+"""
+Incremental repository refresh
+
+Mirrors publish small updates many times a day, so reloading a whole repository each time is a waste. The
+repomd.xml checksum of every metadata file that was loaded is kept in the refresh_state table:
+- metadata types with the same checksum as last time are skipped entirely
+- metadata types that did change only get the packages whose pkgId isn't stored yet inserted, and the packages
+  that are gone from the repository deleted
+- updateinfo isn't keyed by pkgId, so when it changes the advisories of the repository are replaced as a whole
+
+Packages are stored once per pkgId, which is the checksum of the RPM itself, so a package that's in several
+repositories (a mirror, or AppStream across minor releases) has its rows written once. Which repositories have it
+is kept in the repo_package table, and its rows are only deleted once no repository has it anymore.
+"""
+import logging
+from typing import Iterable, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+
+from .loader import BatchWriter, row_to_dict
+from .utils import DB_TABLE
+
+# The tables each kind of metadata is loaded into
+METADATA_TABLES = {
+    'primary': ['packages', 'conflicts', 'enhances', 'files', 'obsoletes', 'provides', 'recommends', 'requires',
+                'suggests', 'supplements'],
+    'filelists': ['filelist'],
+    'other': ['changelog']
+}
+
+# The tables of metadata that belongs to a repository as a whole rather than to packages, replaced when it changes
+REPO_METADATA_TABLES = {
+    'updateinfo': ['advisory', 'advisory_package', 'advisory_reference']
+}
+
+# Chunk size for IN (...) clauses, well below the bound parameter limit of older SQLite versions
+DELETE_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def metadata_name(repo_category: str):
+    """
+    Get the kind of metadata regardless of which flavour it is, ie. primary_db -> primary
+
+    :param repo_category: The repomd data type
+    :returns: The metadata name as used in METADATA_TABLES
+    """
+    if repo_category.endswith('_db'):
+        return repo_category[:-len('_db')]
+    return repo_category
+
+
+def load_refresh_state(engine: Engine, repo_name: str):
+    """
+    Read the checksums of the metadata that was last loaded for a repository
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param repo_name: The repository name
+    :returns: Dictionary of {data_type: checksum_hash}
+    """
+    table = DB_TABLE['refresh_state']
+    with engine.connect() as connection:
+        return {data_type: checksum_hash for data_type, checksum_hash in connection.execute(
+            select(table.c.data_type, table.c.checksum_hash).where(table.c.repo_name == repo_name))}
+
+
+def filter_unchanged(repomd_data: dict, data_types: list, refresh_state: dict, repo_name: str = None):
+    """
+    Drop the metadata types that have the same checksum as the last time they were loaded
+
+    :param repomd_data: Parsed repomd.xml data from parse_repomd()
+    :param data_types: The metadata types that are going to be loaded
+    :param refresh_state: Output of load_refresh_state()
+    :param repo_name: The repository name, used for logging
+    :returns: The metadata types that changed
+    """
+    changed = []
+    for data_type in data_types:
+        if refresh_state.get(data_type) == repomd_data[data_type]['checksum_hash']:
+            logger.info(f'{repo_name or "Repository"} {data_type} is unchanged, skipping')
+        else:
+            changed.append(data_type)
+    return changed
+
+
+class RepoRefresh(object):
+    """Writes only the difference between what's stored for a repository and the metadata that's being loaded"""
+
+    def __init__(self, writer: BatchWriter) -> None:
+        """
+        :param writer: The BatchWriter of the repository transaction. Its repo_name must be set
+        """
+        if writer.repo_name is None:
+            raise ValueError('RepoRefresh requires a BatchWriter with a repository name')
+        self._writer = writer
+        self.repo_name = writer.repo_name
+        # Number of packages added to and removed from the repository, per metadata kind
+        self.inserted = {}
+        self.removed = {}
+        # Number of packages whose rows were written, the rest were already stored for another repository
+        self.written = {}
+
+    @staticmethod
+    def _stored_pkgids_query(metadata: str):
+        """Select the pkgIds that already have data for this kind of metadata, from any repository"""
+        table = DB_TABLE[METADATA_TABLES[metadata][0]]
+        return select(table.c.pkgId).distinct()
+
+    def _member_pkgids(self) -> set:
+        """Get the pkgIds of the packages the repository has"""
+        table = DB_TABLE['repo_package']
+        return {pkg_id for pkg_id, in self._writer.connection.execute(
+            select(table.c.pkgId).where(table.c.repo_name == self.repo_name))}
+
+    def load_rows(self, repo_category: str, rows: Iterable[Tuple[str, object]]):
+        """
+        Write the rows of packages that aren't stored yet, and remove the packages that are no longer there
+
+        :param repo_category: The repomd data type, ie. primary
+        :param rows: (table_name, row) tuples such as the output of xmlparser.iter_primary()
+        """
+        metadata = metadata_name(repo_category)
+        stored = {pkg_id for pkg_id, in self._writer.connection.execute(self._stored_pkgids_query(metadata))}
+        parsed = set()
+        for table_name, row in rows:
+            if table_name == 'db_info':
+                self._replace_db_info(repo_category)
+                self._writer.write(table_name, row)
+                continue
+            pkg_id = row_to_dict(row)['pkgId']
+            parsed.add(pkg_id)
+            if pkg_id not in stored:
+                self._writer.write(table_name, row)
+        self._finish(metadata, parsed, len(parsed - stored))
+
+    def replace_rows(self, repo_category: str, rows: Iterable[Tuple[str, object]]):
+        """
+        Replace everything stored for the repository from metadata in REPO_METADATA_TABLES
+
+        :param repo_category: The repomd data type, ie. updateinfo
+        :param rows: (table_name, row) tuples such as the output of xmlparser.iter_updateinfo()
+        """
+        metadata = metadata_name(repo_category)
+        # Anything still pending has to be written first, otherwise it would be deleted along with the old rows
+        self._writer.flush()
+        for table_name in REPO_METADATA_TABLES[metadata]:
+            table = DB_TABLE[table_name]
+            self._writer.connection.execute(delete(table).where(table.c.repo_name == self.repo_name))
+        written = 0
+        for table_name, row in rows:
+            self._writer.write(table_name, row)
+            written += table_name == REPO_METADATA_TABLES[metadata][0]
+        self.inserted[metadata] = written
+        logger.info(f'{self.repo_name} {metadata}: replaced with {written} {REPO_METADATA_TABLES[metadata][0]} rows')
+
+    def copy_sqlite(self, filename: str, repo_category: str, database_version: int):
+        """
+        Same as load_rows(), but for createrepo SQLite databases copied with BatchWriter.copy_sqlite()
+
+        :param filename: The decompressed SQLite database file name
+        :param repo_category: The repomd data type, ie. primary_db
+        :param database_version: The database_version listed in repomd.xml
+        """
+        metadata = metadata_name(repo_category)
+        connection = self._writer.connection
+        stored_query = self._stored_pkgids_query(metadata)
+        connection.exec_driver_sql('create temp table if not exists stored_pkgids (pkgId text primary key)')
+        connection.exec_driver_sql('delete from temp.stored_pkgids')
+        connection.exec_driver_sql(
+            f'insert or ignore into temp.stored_pkgids '
+            f'{stored_query.compile(connection, compile_kwargs={"literal_binds": True})}')
+
+        self._replace_db_info(repo_category)
+        schema = self._writer.copy_sqlite(filename, repo_category, database_version,
+                                          where='pkgId not in (select pkgId from temp.stored_pkgids)')
+        parsed = {pkg_id for pkg_id, in connection.exec_driver_sql(f'select pkgId from {schema}.packages')}
+        written = connection.exec_driver_sql(f'select count(*) from {schema}.packages '
+                                             f'where pkgId not in (select pkgId from temp.stored_pkgids)').scalar()
+        self._finish(metadata, parsed, written)
+
+    def _replace_db_info(self, repo_category: str):
+        """Delete the db_info row of the database the repository had last time, it's replaced by the new one"""
+        table = DB_TABLE['db_info']
+        self._writer.flush('db_info')
+        self._writer.connection.execute(delete(table).where(table.c.repo_name == self.repo_name,
+                                                            table.c.repo_category == repo_category))
+
+    def _finish(self, metadata: str, parsed: set, written: int):
+        self.written[metadata] = written
+        if metadata != 'primary':
+            # Only primary decides which packages belong to the repository, the rest is shared between repositories
+            logger.info(f'{self.repo_name} {metadata}: {written} packages written')
+            return
+        members = self._member_pkgids()
+        added = parsed - members
+        removed = members - parsed
+        for pkg_id in added:
+            self._writer.write('repo_package', {'pkgId': pkg_id})
+        self.inserted[metadata] = len(added)
+        self.removed[metadata] = len(removed)
+        logger.info(f'{self.repo_name} {metadata}: {len(added)} packages added ({written} not stored for any '
+                    f'repository yet), {len(removed)} packages removed')
+        if removed:
+            self.remove_packages(removed)
+
+    def remove_packages(self, pkg_ids: set):
+        """
+        Remove packages from the repository, along with every row that belongs to them once no repository has them
+
+        :param pkg_ids: The pkgIds of the packages to remove
+        """
+        # Anything still pending has to be written first, otherwise it would be written after the delete
+        self._writer.flush()
+        connection = self._writer.connection
+        packages = DB_TABLE['packages']
+        repo_package = DB_TABLE['repo_package']
+        pkg_ids = list(pkg_ids)
+        for index in range(0, len(pkg_ids), DELETE_CHUNK_SIZE):
+            chunk = pkg_ids[index:index + DELETE_CHUNK_SIZE]
+            connection.execute(delete(repo_package).where(repo_package.c.repo_name == self.repo_name,
+                                                          repo_package.c.pkgId.in_(chunk)))
+            connection.execute(delete(packages).where(packages.c.pkgId.in_(chunk),
+                                                      packages.c.pkgId.not_in(select(repo_package.c.pkgId))))
+            for table_name in [name for tables in METADATA_TABLES.values() for name in tables if name != 'packages']:
+                table = DB_TABLE[table_name]
+                connection.execute(delete(table).where(table.c.pkgId.in_(chunk),
+                                                       table.c.pkgId.not_in(select(packages.c.pkgId))))
+
+    def save_state(self, repo_category: str, data: dict):
+        """
+        Record the checksum of the metadata that was just loaded, so it can be skipped next time if it's unchanged
+
+        :param repo_category: The repomd data type, ie. primary_db
+        :param data: The repomd.xml data of the metadata from parse_repomd()
+        """
+        table = DB_TABLE['refresh_state']
+        self._writer.flush('refresh_state')
+        self._writer.connection.execute(delete(table).where(table.c.repo_name == self.repo_name,
+                                                            table.c.data_type == repo_category))
+        self._writer.write('refresh_state', {
+            'repo_name': self.repo_name,
+            'data_type': repo_category,
+            'checksum_hash_type': data['checksum_hash_type'],
+            'checksum_hash': data['checksum_hash'],
+            'timestamp': data['timestamp']
+        })
@@ -1,13 +1,25 @@
-import uuid
+"""
+Database models of the explorer database
+
+Primary keys are integers the database assigns, so they're small and always appended at the end of the B-tree.
+Rows are joined by pkgId rather than by those keys, since the pkgId is what every metadata file has; every pkgId
+column, and every column packages are looked up by, is indexed. Composite indexes go in __table_args__.
+
+Bump SCHEMA_VERSION whenever the layout changes, along with a step in migrate.py.
+"""
 from dataclasses import dataclass
-from sqlalchemy import Text, Integer, Boolean, Column, TIMESTAMP
+from sqlalchemy import Text, Integer, Boolean, Column, Index
+
+# Version of the layout below, kept in the schema_version table
+SCHEMA_VERSION = 3
 
 
 @dataclass
 class DBInfo(object):
     __tablename__ = 'db_info'
 
-    dbinfo_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
+    dbinfo_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, comment='Repository the database was loaded for')
     repo_category: str = Column(Text, comment='Repository category that this row represents')
     dbversion: int = Column(Integer, comment='DB version')
     checksum: str = Column(Text, comment='Hash for the XML file')
@@ -20,13 +32,15 @@ class DBInfo(object):
 
 @dataclass
 class Packages(object):
-    """Represents the `packages` table"""
+    """Represents the `packages` table, one row per pkgId no matter how many repositories have the package"""
     __tablename__ = 'packages'
+    # Also serves lookups by name alone
+    __table_args__ = (Index('ix_packages_name_arch', 'name', 'arch'),)
 
-    pkg_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgKey: int = Column(Integer, comment='Primary key for the packages')
+    # Same name as in createrepo's databases, but assigned by this database rather than copied from them
+    pkgKey: int = Column(Integer, primary_key=True, comment='Primary key for the packages')
     # Also used as a package hash
-    pkgId: str = Column(Text, nullable=False, comment='The package ID of the package')
+    pkgId: str = Column(Text, nullable=False, index=True, comment='The package ID of the package')
     name: str = Column(Text, nullable=False, comment='Package name')
     arch: str = Column(Text, nullable=False, comment='Architecture the package is for')
     version: str = Column(Text, nullable=False, comment='Package version')
@@ -35,8 +49,8 @@ class Packages(object):
     summary: str = Column(Text, nullable=False, comment='Package summary')
     description: str = Column(Text, nullable=False, comment='Package description')
     url: str = Column(Text, comment='Package upstream URL')
-    time_file: int = Column(TIMESTAMP, comment='File timestamp')
-    time_build: int = Column(TIMESTAMP, comment='File build time')
+    time_file: int = Column(Integer, comment='File timestamp')
+    time_build: int = Column(Integer, comment='File build time')
     rpm_license: str = Column(Text, comment='Package license')
     rpm_vendor: str = Column(Text)
     rpm_group: str = Column(Text)
@@ -62,13 +76,27 @@ class Packages(object):
             setattr(self, k, v)
 
 
+@dataclass
+class RepoPackage(object):
+    """Which repositories have which packages, packages and their rows being stored once per pkgId"""
+    __tablename__ = 'repo_package'
+
+    repo_package_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, nullable=False, index=True, comment='Repository name')
+    pkgId: str = Column(Text, nullable=False, index=True, comment='The package ID of the package')
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
 @dataclass
 class Conflicts(object):
     __tablename__ = 'conflicts'
 
-    conflict_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    conflict_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package conflicts with')
     version = Column(Text, comment='Package version that the package conflicts with')
@@ -84,9 +112,9 @@ class Conflicts(object):
 class Enhances(object):
     __tablename__ = 'enhances'
 
-    enhance_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    enhance_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -108,9 +136,9 @@ class Files(object):
     """
     __tablename__ = 'files'
 
-    file_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='File name')
+    file_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='File name')
     type: str = Column(Text, comment='File type')
 
     def __init__(self, **kwargs):
@@ -123,9 +151,9 @@ class Files(object):
 class Obsoletes(object):
     __tablename__ = 'obsoletes'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    obsolete_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -141,9 +169,9 @@ class Obsoletes(object):
 class Provides(object):
     __tablename__ = 'provides'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    provide_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -157,11 +185,11 @@ class Provides(object):
 
 @dataclass
 class Recommends(object):
-    __tablename__ = 'Recommends'
+    __tablename__ = 'recommends'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    recommend_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -177,9 +205,9 @@ class Recommends(object):
 class Requires(object):
     __tablename__ = 'requires'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    require_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -194,11 +222,11 @@ class Requires(object):
 
 @dataclass
 class Suggests(object):
-    __tablename__ = 'Suggests'
+    __tablename__ = 'suggests'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    suggest_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -214,9 +242,9 @@ class Suggests(object):
 class Supplements(object):
     __tablename__ = 'supplements'
 
-    enhance_uuid = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
-    name: str = Column(Text, comment='Package name')
+    supplement_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
+    name: str = Column(Text, index=True, comment='Package name')
     flags: str = Column(Text, comment='Package conflict comparison flag')
     epoch: int = Column(Integer, comment='Package epoch that the package enhances')
     version: str = Column(Text, comment='Package version that the package enhances')
@@ -232,8 +260,8 @@ class Supplements(object):
 class FileList(object):
     __tablename__ = 'filelist'
 
-    filelist_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
+    filelist_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
     filename: str = Column(Text, comment='File name')
     filetype: str = Column(Text, comment='File type')
 
@@ -247,13 +275,112 @@ class FileList(object):
 class ChangeLog(object):
     __tablename__ = 'changelog'
 
-    changelog_uuid: str = Column(Text, primary_key=True, default=uuid.uuid4)
-    pkgId: str = Column(Text, nullable=False)
+    changelog_key: int = Column(Integer, primary_key=True)
+    pkgId: str = Column(Text, nullable=False, index=True)
     author: str = Column(Text, comment='Author name')
-    date: int = Column(TIMESTAMP, comment='Changelog date')
+    date: int = Column(Integer, comment='Changelog date')
     changelog: str = Column(Text, comment='Changes')
 
     def __init__(self, **kwargs):
         # FUUUUUUUUUUUCK
         for k, v in kwargs.items():
             setattr(self, k, v)
+
+
+@dataclass
+class Advisory(object):
+    """An update (erratum) from updateinfo, one row per update per repository"""
+    __tablename__ = 'advisory'
+
+    advisory_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, comment='Repository the advisory was loaded from')
+    advisory_id: str = Column(Text, nullable=False, index=True, comment='Advisory ID, ie. RHSA-2021:1234')
+    issuer: str = Column(Text, comment='Who issued the advisory, the from attribute')
+    status: str = Column(Text)
+    type: str = Column(Text, index=True, comment='Advisory type, ie. security, bugfix or enhancement')
+    version: str = Column(Text)
+    title: str = Column(Text)
+    issued: int = Column(Integer, index=True, comment='Issue date as a Unix timestamp')
+    updated: int = Column(Integer, comment='Update date as a Unix timestamp')
+    rights: str = Column(Text)
+    release: str = Column(Text)
+    pushcount: int = Column(Integer)
+    severity: str = Column(Text, index=True, comment='Severity, ie. Important')
+    summary: str = Column(Text)
+    description: str = Column(Text)
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+@dataclass
+class AdvisoryPackage(object):
+    """A package fixed by an advisory"""
+    __tablename__ = 'advisory_package'
+
+    advisory_package_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, comment='Repository the advisory was loaded from')
+    advisory_id: str = Column(Text, nullable=False, index=True, comment='Advisory ID, ie. RHSA-2021:1234')
+    collection: str = Column(Text, comment='Short name of the collection the package is listed under')
+    name: str = Column(Text, nullable=False, index=True, comment='Package name')
+    epoch: int = Column(Integer)
+    version: str = Column(Text)
+    release: str = Column(Text)
+    arch: str = Column(Text)
+    src: str = Column(Text, comment='Source RPM file name')
+    filename: str = Column(Text)
+    checksum_type: str = Column(Text)
+    checksum: str = Column(Text)
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+@dataclass
+class AdvisoryReference(object):
+    """A reference of an advisory, ie. a CVE or a bug"""
+    __tablename__ = 'advisory_reference'
+
+    advisory_reference_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, comment='Repository the advisory was loaded from')
+    advisory_id: str = Column(Text, nullable=False, index=True, comment='Advisory ID, ie. RHSA-2021:1234')
+    ref_id: str = Column(Text, index=True, comment='Referenced ID, ie. CVE-2021-3156')
+    type: str = Column(Text, comment='Reference type, ie. cve, bugzilla or self')
+    href: str = Column(Text)
+    title: str = Column(Text)
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+@dataclass
+class RefreshState(object):
+    """Keeps track of the repomd.xml checksum of the metadata that was last loaded for a repository"""
+    __tablename__ = 'refresh_state'
+
+    refresh_key: int = Column(Integer, primary_key=True)
+    repo_name: str = Column(Text, nullable=False, comment='Repository name')
+    data_type: str = Column(Text, nullable=False, comment='Metadata type in repomd.xml, ie. primary_db')
+    checksum_hash_type: str = Column(Text, comment='Hash type of checksum_hash')
+    checksum_hash: str = Column(Text, nullable=False, comment='Checksum of the metadata file listed in repomd.xml')
+    timestamp: int = Column(Integer, comment='Timestamp of the metadata file listed in repomd.xml')
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+@dataclass
+class SchemaVersion(object):
+    """The layout version of the database, see migrate.py"""
+    __tablename__ = 'schema_version'
+
+    version: int = Column(Integer, primary_key=True, autoincrement=False, comment='SCHEMA_VERSION of the layout')
+    timestamp: int = Column(Integer, comment='When the database was created or migrated to this version')
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
@@ -14,12 +14,17 @@ This shouldn't exist, but:
 - Flask-SQLAlchemy has issues with code suggestions when it comes to DB session queries.
 """
 import sqlite3
+from contextlib import closing
+from sqlalchemy import Column, Index, MetaData, Table
 from .sqlalchemy_models import *  # pylint: disable=unused-wildcard-import
+from ..exceptions import UnsupportedFileListException, UnsupportedOtherDatabaseException, \
+    UnsupportedPrimaryDatabaseException
 
 # Dictionary that returns the database model class based on what class it's from
 DB_MODEL = {
     'db_info': DBInfo,
     'packages': Packages,
+    'repo_package': RepoPackage,
     'conflicts': Conflicts,
     'enhances': Enhances,
     'files': Files,
@@ -30,7 +35,12 @@ DB_MODEL = {
     'suggests': Suggests,
     'supplements': Supplements,
     'filelist': FileList,
-    'changelog': ChangeLog
+    'changelog': ChangeLog,
+    'advisory': Advisory,
+    'advisory_package': AdvisoryPackage,
+    'advisory_reference': AdvisoryReference,
+    'refresh_state': RefreshState,
+    'schema_version': SchemaVersion
 }
 
 # A dictionary that provides the minimum set of attributes that a DB require
@@ -67,6 +77,10 @@ DB_REQUIRED_DATA = {
         'location_base',
         'checksum_type'
     ],
+    'repo_package': [
+        'repo_name',
+        'pkgId'
+    ],
     'conflicts': [
         'pkgId',
         'name',
@@ -147,28 +161,93 @@ DB_REQUIRED_DATA = {
         'author',
         'date',
         'changelog'
+    ],
+    'advisory': [
+        'advisory_id',
+        'type'
+    ],
+    'advisory_package': [
+        'advisory_id',
+        'name'
+    ],
+    'advisory_reference': [
+        'advisory_id',
+        'ref_id'
+    ],
+    'refresh_state': [
+        'repo_name',
+        'data_type',
+        'checksum_hash'
+    ],
+    'schema_version': [
+        'version'
     ]
 }
 
+
+def build_tables(metadata: MetaData):
+    """
+    Build SQLAlchemy Core tables out of the database models in DB_MODEL
+
+    The models are plain dataclasses that only carry Column definitions, so each Column is copied and named
+    after the attribute it's assigned to. Indexes in the __table_args__ of a model are copied the same way.
+
+    :param metadata: The MetaData that the tables will be registered to
+    :returns: A dictionary of {table_name: Table} with the same keys as DB_MODEL
+    """
+    tables = {}
+    for table_name, db_model in DB_MODEL.items():
+        columns = []
+        for attr_name, column in vars(db_model).items():
+            if isinstance(column, Column):
+                column = column._copy()
+                column.name = column.key = attr_name
+                columns.append(column)
+        indexes = [Index(index.name, *index.expressions, unique=index.unique)
+                   for index in getattr(db_model, '__table_args__', ())]
+        tables[table_name] = Table(db_model.__tablename__, metadata, *columns, *indexes)
+    return tables
+
+
+# Tables used to persist the database models
+DB_METADATA = MetaData()
+DB_TABLE = build_tables(DB_METADATA)
+
+# Queries that maps createrepo's SQLite database tables into the database models
+# {schema} is replaced with the name of the attached database (with a trailing dot), or nothing at all
+DB_INFO_QUERY = 'select dbversion, checksum from {schema}db_info'
+
+# createrepo stores requires.pre as 'TRUE'/'FALSE' text, it's mapped to 0/1 to match what xmlparser produces
 PRIMARY_DB_QUERY_V10 = {
-    'conflicts': 'select p.pkgId, c.name, c.flags, c.epoch, c.version, c.release from conflicts c inner join packages p on p.pkgKey == c.pkgKey',
-    'enhances': 'select p.pkgId, e.name, e.flags, e.epoch, e.version, e.release from enhances e inner join packages p on p.pkgKey == e.pkgKey',
-    'files': 'select p.pkgId, f.name, f.type from files f inner join packages p on p.pkgKey == f.pkgKey',
-    'obsoletes': 'select p.pkgId, o.name, o.flags, o.epoch, o.version, o.release from obsoletes o inner join packages p on p.pkgKey == o.pkgKey',
-    'packages': 'select * from packages',
-    'provides': 'select p.pkgId, pr.name, pr.flags, pr.epoch, pr.version, pr.release from provides pr inner join packages p on p.pkgKey == pr.pkgKey',
-    'recommends': 'select p.pkgId, r.name, r.flags, r.epoch, r.version, r.release from recommends r inner join packages p on p.pkgKey == r.pkgKey',
-    'requires': 'select p.pkgId, r.name, r.flags, r.epoch, r.version, r.release, r.pre from requires r inner join packages p on p.pkgKey == r.pkgKey',
-    'suggests': 'select p.pkgId, s.name, s.flags, s.epoch, s.version, s.release from suggests s inner join packages p on p.pkgKey == s.pkgKey',
-    'supplements': 'select p.pkgId, s.name, s.flags, s.epoch, s.version, s.release from supplements s inner join packages p on p.pkgKey == s.pkgKey'
+    'conflicts': 'select p.pkgId, c.name, c.flags, c.epoch, c.version, c.release from {schema}conflicts c inner join {schema}packages p on p.pkgKey == c.pkgKey',
+    'enhances': 'select p.pkgId, e.name, e.flags, e.epoch, e.version, e.release from {schema}enhances e inner join {schema}packages p on p.pkgKey == e.pkgKey',
+    'files': 'select p.pkgId, f.name, f.type from {schema}files f inner join {schema}packages p on p.pkgKey == f.pkgKey',
+    'obsoletes': 'select p.pkgId, o.name, o.flags, o.epoch, o.version, o.release from {schema}obsoletes o inner join {schema}packages p on p.pkgKey == o.pkgKey',
+    'packages': 'select * from {schema}packages',
+    'provides': 'select p.pkgId, pr.name, pr.flags, pr.epoch, pr.version, pr.release from {schema}provides pr inner join {schema}packages p on p.pkgKey == pr.pkgKey',
+    'recommends': 'select p.pkgId, r.name, r.flags, r.epoch, r.version, r.release from {schema}recommends r inner join {schema}packages p on p.pkgKey == r.pkgKey',
+    'requires': "select p.pkgId, r.name, r.flags, r.epoch, r.version, r.release, case when r.pre in ('TRUE', 1, '1') then 1 else 0 end as pre from {schema}requires r inner join {schema}packages p on p.pkgKey == r.pkgKey",
+    'suggests': 'select p.pkgId, s.name, s.flags, s.epoch, s.version, s.release from {schema}suggests s inner join {schema}packages p on p.pkgKey == s.pkgKey',
+    'supplements': 'select p.pkgId, s.name, s.flags, s.epoch, s.version, s.release from {schema}supplements s inner join {schema}packages p on p.pkgKey == s.pkgKey'
 }
 
 FILELISTS_DB_QUERY_V10 = {
-    'filelist': None
+    # filelists.sqlite packs every file in a directory into one row, with the file names separated by / and one
+    # character per file for the file type, so split them back into one row per file
+    'filelist': "with recursive split(pkgKey, dirname, filename, filetype, filenames, filetypes) as ("
+                "select pkgKey, dirname, null, null, filenames || '/', filetypes from {schema}filelist "
+                "union all "
+                "select pkgKey, dirname, substr(filenames, 1, instr(filenames, '/') - 1), substr(filetypes, 1, 1), "
+                "substr(filenames, instr(filenames, '/') + 1), substr(filetypes, 2) from split where filenames != '') "
+                "select p.pkgId, "
+                "case when s.dirname == '/' then '/' || s.filename "
+                "else s.dirname || '/' || s.filename end as filename, "
+                "case s.filetype when 'd' then 'dir' when 'g' then 'ghost' else 'file' end as filetype "
+                "from split s inner join {schema}packages p on p.pkgKey == s.pkgKey where s.filename is not null"
 }
 
 OTHER_DB_QUERY_V10 = {
-    'changelog': None
+    'changelog': 'select p.pkgId, c.author, c.date, c.changelog from {schema}changelog c inner join {schema}packages p on p.pkgKey == c.pkgKey'
 }
 
 PRIMARY_DB_VERSION = {
@@ -183,6 +262,63 @@ OTHER_DB_VERSION = {
     10: OTHER_DB_QUERY_V10
 }
 
+# Repomd data type to the supported database versions and the exception raised when it's not supported
+SQLITE_DB_VERSION = {
+    'primary_db': (PRIMARY_DB_VERSION, UnsupportedPrimaryDatabaseException),
+    'filelists_db': (FILELISTS_DB_VERSION, UnsupportedFileListException),
+    'other_db': (OTHER_DB_VERSION, UnsupportedOtherDatabaseException)
+}
+
+
+def get_db_queries(repo_category: str, database_version: int):
+    """
+    Get the queries that maps a createrepo SQLite database into the database models
+
+    :param repo_category: The repomd data type, ie. primary_db
+    :param database_version: The database_version listed in repomd.xml
+    :returns: A dictionary of {table_name: query}
+    """
+    db_versions, exception = SQLITE_DB_VERSION[repo_category]
+    if database_version not in db_versions:
+        raise exception(list(db_versions))
+    return db_versions[database_version]
+
+
+def format_query(query: str, schema: str = None):
+    """
+    Fill in the {schema} placeholder of the queries above
+
+    :param query: The query to format
+    :param schema: The name of the attached database that the query should read from. Reads from the main
+                   database if not provided
+    :returns: The query that can be executed
+    """
+    return query.format(schema=f'{schema}.' if schema else '')
+
+
+def iter_sqlite_rows(filename: str, repo_category: str, database_version: int):
+    """
+    Generator function that reads a createrepo SQLite database row by row
+
+    This is the slow path used when the data isn't loaded into an SQLite database. BatchWriter.copy_sqlite()
+    does the same thing without rows passing through Python.
+
+    :param filename: The SQLite database file name
+    :param repo_category: The repomd data type, ie. primary_db
+    :param database_version: The database_version listed in repomd.xml
+    :returns: (table_name, row) tuples
+    """
+    queries = get_db_queries(repo_category, database_version)
+    # SQLite doesn't close the "normal" way, so it needs slightly insane way to really close connection.
+    with closing(sqlite3.connect(filename)) as connection, connection, closing(connection.cursor()) as cursor:
+        cursor.row_factory = map_row_to_dict
+        for row in cursor.execute(format_query(DB_INFO_QUERY)):
+            row['repo_category'] = repo_category
+            yield 'db_info', row
+        for table_name, query in queries.items():
+            for row in cursor.execute(format_query(query)):
+                yield table_name, row
+
 
 class DBModelFactory(object):
     """Factory class that provide """
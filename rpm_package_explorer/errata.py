@@ -0,0 +1,188 @@
+"""
+Errata queries against the advisory tables
+
+updateinfo is loaded flattened into three tables (see xmlparser.iter_updateinfo()):
+- advisory: one row per update per repository, indexed on type, severity and issue date
+- advisory_package: one row per package an update fixes, indexed on the package name
+- advisory_reference: one row per reference of an update, indexed on the referenced ID such as a CVE
+
+so "which advisories fix package X" and "which advisories fix CVE-Y" are index lookups rather than going through
+every update. All the queries take the same filters on severity, type, issue date and repository.
+"""
+import logging
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Union
+
+from sqlalchemy import and_, select
+from sqlalchemy.engine import Engine
+
+from .db_model.utils import DB_TABLE
+from .evr import evr_key, evr_of
+
+# Columns of the advisory table returned by the queries
+ADVISORY_COLUMNS = ['advisory_id', 'repo_name', 'type', 'severity', 'status', 'title', 'issued', 'updated']
+# Columns of the advisory_package table returned along with the advisories
+PACKAGE_COLUMNS = ['name', 'epoch', 'version', 'release', 'arch', 'filename']
+# Columns of the advisory_reference table returned along with the advisories
+REFERENCE_COLUMNS = ['ref_id', 'type', 'href', 'title']
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value: Union[int, str, date, datetime]) -> int:
+    """Convert a Unix timestamp, date, datetime or YYYY-MM-DD string into a Unix timestamp, dates being in UTC"""
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d')
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp())
+    return int(value)
+
+
+def _values(value: Union[str, Iterable[str]]) -> list:
+    """Allow filters to be a single value or a list of them"""
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _filter(query, severity=None, types=None, issued_after=None, issued_before=None, repo_names=None):
+    """Add the filters shared by every query to a query on the advisory table"""
+    advisory = DB_TABLE['advisory']
+    if severity is not None:
+        query = query.where(advisory.c.severity.in_(_values(severity)))
+    if types is not None:
+        query = query.where(advisory.c.type.in_(_values(types)))
+    if issued_after is not None:
+        query = query.where(advisory.c.issued >= _timestamp(issued_after))
+    if issued_before is not None:
+        query = query.where(advisory.c.issued < _timestamp(issued_before))
+    if repo_names is not None:
+        query = query.where(advisory.c.repo_name.in_(_values(repo_names)))
+    return query
+
+
+def _advisory_select(*extra_columns):
+    advisory = DB_TABLE['advisory']
+    return select(*(advisory.c[column] for column in ADVISORY_COLUMNS), *extra_columns) \
+        .order_by(advisory.c.issued.desc(), advisory.c.advisory_id, advisory.c.repo_name)
+
+
+def _join_condition(table):
+    """Join a table keyed by advisory_id and repo_name to the advisory table"""
+    advisory = DB_TABLE['advisory']
+    return and_(advisory.c.advisory_id == table.c.advisory_id, advisory.c.repo_name == table.c.repo_name)
+
+
+def find_advisories(engine: Engine, severity: Union[str, Iterable[str]] = None, types: Union[str, Iterable[str]] = None,
+                    issued_after=None, issued_before=None, repo_names: Iterable[str] = None,
+                    limit: int = None) -> List[dict]:
+    """
+    Find advisories, ie. every critical security advisory of the last month
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param severity: Only find advisories of this severity or these severities, ie. Critical
+    :param types: Only find advisories of this type or these types, ie. security
+    :param issued_after: Only find advisories issued on or after this Unix timestamp, date or YYYY-MM-DD string
+    :param issued_before: Only find advisories issued before this Unix timestamp, date or YYYY-MM-DD string
+    :param repo_names: Only look in these repositories. Looks in every repository if not provided
+    :param limit: Return at most this many advisories
+    :returns: A list of dictionaries of ADVISORY_COLUMNS, newest first
+    """
+    query = _filter(_advisory_select(), severity, types, issued_after, issued_before, repo_names)
+    if limit is not None:
+        query = query.limit(limit)
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(query).mappings()]
+
+
+def advisories_for_package(engine: Engine, name: str, arch: str = None, installed=None, **filters) -> List[dict]:
+    """
+    Find the advisories that fix a package
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param name: The package name
+    :param arch: Only look at packages of this architecture
+    :param installed: Only find advisories with a package newer than this EVR, ie. the installed version. Takes
+                      anything evr.evr_of() does, such as 1:1.4-1.el8
+    :param filters: severity, types, issued_after, issued_before and repo_names, same as find_advisories()
+    :returns: A list of dictionaries of ADVISORY_COLUMNS with the fixed packages in packages, newest first
+    """
+    advisory_package = DB_TABLE['advisory_package']
+    query = _advisory_select(*(advisory_package.c[column].label(f'package_{column}') for column in PACKAGE_COLUMNS))
+    query = query.select_from(DB_TABLE['advisory'].join(advisory_package, _join_condition(advisory_package)))
+    query = _filter(query.where(advisory_package.c.name == name), **filters)
+    if arch is not None:
+        query = query.where(advisory_package.c.arch == arch)
+    installed_key = evr_of(installed) if installed is not None else None
+
+    advisories = {}
+    with engine.connect() as connection:
+        for row in connection.execute(query).mappings():
+            package = {column: row[f'package_{column}'] for column in PACKAGE_COLUMNS}
+            if installed_key is not None and \
+                    evr_key(package['epoch'], package['version'], package['release']) <= installed_key:
+                continue
+            key = (row['advisory_id'], row['repo_name'])
+            if key not in advisories:
+                advisories[key] = {column: row[column] for column in ADVISORY_COLUMNS}
+                advisories[key]['packages'] = []
+            advisories[key]['packages'].append(package)
+    return list(advisories.values())
+
+
+def advisories_for_reference(engine: Engine, ref_id: str, **filters) -> List[dict]:
+    """
+    Find the advisories that reference an ID, ie. a CVE or a bug number
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param ref_id: The referenced ID, ie. CVE-2021-3156
+    :param filters: severity, types, issued_after, issued_before and repo_names, same as find_advisories()
+    :returns: A list of dictionaries of ADVISORY_COLUMNS, newest first
+    """
+    advisory_reference = DB_TABLE['advisory_reference']
+    query = _advisory_select().select_from(
+        DB_TABLE['advisory'].join(advisory_reference, _join_condition(advisory_reference)))
+    query = _filter(query.where(advisory_reference.c.ref_id == ref_id), **filters).distinct()
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(query).mappings()]
+
+
+def advisories_for_cve(engine: Engine, cve_id: str, **filters) -> List[dict]:
+    """
+    Same as advisories_for_reference(), with the CVE ID normalized to upper case, ie. cve-2021-3156
+    """
+    return advisories_for_reference(engine, cve_id.upper(), **filters)
+
+
+def advisory_details(engine: Engine, advisory_id: str, repo_name: str = None) -> List[dict]:
+    """
+    Get everything about an advisory
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param advisory_id: The advisory ID, ie. RHSA-2021:0218
+    :param repo_name: Only look in this repository. Looks in every repository if not provided
+    :returns: A list of dictionaries of every advisory column, with its packages and references, one per repository
+              the advisory is in
+    """
+    advisory = DB_TABLE['advisory']
+    advisory_package = DB_TABLE['advisory_package']
+    advisory_reference = DB_TABLE['advisory_reference']
+    query = select(advisory).where(advisory.c.advisory_id == advisory_id).order_by(advisory.c.repo_name)
+    if repo_name is not None:
+        query = query.where(advisory.c.repo_name == repo_name)
+    details = []
+    with engine.connect() as connection:
+        for row in connection.execute(query).mappings():
+            entry = {column: value for column, value in row.items() if column != 'advisory_key'}
+            entry['packages'] = [dict(package) for package in connection.execute(
+                select(*(advisory_package.c[column] for column in PACKAGE_COLUMNS))
+                .where(advisory_package.c.advisory_id == advisory_id,
+                       advisory_package.c.repo_name == row['repo_name'])).mappings()]
+            entry['references'] = [dict(reference) for reference in connection.execute(
+                select(*(advisory_reference.c[column] for column in REFERENCE_COLUMNS))
+                .where(advisory_reference.c.advisory_id == advisory_id,
+                       advisory_reference.c.repo_name == row['repo_name'])).mappings()]
+            details.append(entry)
+    return details
@@ -0,0 +1,167 @@
+"""
+RPM version comparison
+
+Compares epoch:version-release the same way rpm does (rpmvercmp), without having to call into librpm.
+
+Rather than walking both strings every time two versions are compared, each version string is turned into a sort
+key once. The keys are plain tuples, so comparing, sorting and max() are done by Python itself, and the keys are
+cached since the same version strings show up over and over across packages and repositories.
+
+rpmvercmp splits versions into segments of digits or letters, ignoring everything else, and compares them one by one:
+- ~ sorts before anything, even the end of the version (1.0~rc1 < 1.0)
+- ^ sorts after the end of the version but before anything else (1.0 < 1.0^git1 < 1.0.1)
+- numeric segments are newer than alpha segments
+- numeric segments are compared as numbers, alpha segments as strings
+- if everything compared equal, the version with segments left over is newer
+Each segment is mapped to a tuple that starts with its rank in that order, and the end of the version is marked with
+its own rank so shorter versions sort correctly.
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, Tuple
+
+# Ranks of each kind of segment, see the module docstring
+TILDE = (0,)
+END = (1,)
+CARET = (2,)
+ALPHA = 3
+NUMERIC = 4
+
+# Number of distinct version/release strings to keep the sort key of
+KEY_CACHE_SIZE = 65536
+
+SEGMENT_PATTERN = re.compile(r'[0-9]+|[a-zA-Z]+|~|\^')
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def version_key(version: str) -> tuple:
+    """
+    Get the sort key of a version or release string
+
+    :param version: The version or release string, ie. 1.4 or 1.el8
+    :returns: A tuple that sorts the same way rpmvercmp compares versions
+    """
+    key = []
+    for segment in SEGMENT_PATTERN.findall(version or ''):
+        if segment == '~':
+            key.append(TILDE)
+        elif segment == '^':
+            key.append(CARET)
+        elif segment.isdigit():
+            key.append((NUMERIC, int(segment)))
+        else:
+            key.append((ALPHA, segment))
+    key.append(END)
+    return tuple(key)
+
+
+def rpmvercmp(a: str, b: str) -> int:
+    """
+    Compare two version or release strings
+
+    :returns: 1 if a is newer, -1 if b is newer, 0 if they're the same version
+    """
+    key_a = version_key(a)
+    key_b = version_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+def evr_key(epoch, version: str, release: str) -> tuple:
+    """
+    Get the sort key of an epoch, version and release
+
+    :param epoch: The epoch. None or an empty string is the same as 0
+    :param version: The version
+    :param release: The release. None is treated as an empty release
+    :returns: A tuple that sorts the same way rpm compares EVRs
+    """
+    return int(epoch or 0), version_key(version or ''), version_key(release or '')
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def parse_evr(evr: str) -> Tuple[int, str, str]:
+    """
+    Split an epoch:version-release string, ie. 1:1.4-1.el8 into (1, '1.4', '1.el8')
+
+    The epoch is optional and defaults to 0, and so is the release, which defaults to an empty string.
+
+    :param evr: The EVR string
+    :returns: (epoch, version, release)
+    """
+    epoch, separator, version_release = evr.partition(':')
+    if not separator:
+        epoch, version_release = 0, evr
+    version, _, release = version_release.rpartition('-')
+    if not version:
+        version, release = release, ''
+    return int(epoch or 0), version, release
+
+
+def compare_evr(a, b) -> int:
+    """
+    Compare two EVRs
+
+    :param a: EVR string, (epoch, version, release) tuple, or anything evr_of() accepts
+    :param b: Same as a
+    :returns: 1 if a is newer, -1 if b is newer, 0 if they're the same
+    """
+    key_a = evr_of(a)
+    key_b = evr_of(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+def evr_of(item) -> tuple:
+    """
+    Get the sort key out of anything that has an EVR
+
+    :param item: EVR string, (epoch, version, release) tuple, dictionary or database model with epoch, version and
+                 release keys or attributes
+    :returns: The sort key as returned by evr_key()
+    """
+    if isinstance(item, str):
+        return evr_key(*parse_evr(item))
+    if isinstance(item, tuple):
+        return evr_key(*item)
+    if isinstance(item, dict):
+        return evr_key(item.get('epoch'), item.get('version'), item.get('release'))
+    return evr_key(getattr(item, 'epoch', None), getattr(item, 'version', None), getattr(item, 'release', None))
+
+
+def sort_evr(items: Iterable, reverse=False) -> list:
+    """
+    Sort anything that has an EVR from oldest to newest
+
+    :param items: Items accepted by evr_of()
+    :param reverse: Sort from newest to oldest instead
+    :returns: A new sorted list
+    """
+    return sorted(items, key=evr_of, reverse=reverse)
+
+
+def latest(items: Iterable):
+    """
+    Get the newest item
+
+    :param items: Items accepted by evr_of()
+    :returns: The item with the newest EVR, or None if there are no items
+    """
+    return max(items, key=evr_of, default=None)
+
+
+def latest_by_name(items: Iterable, name_key=lambda item: (item.name, item.arch)) -> dict:
+    """
+    Get the newest item of each package, ie. the latest version of every package across repositories
+
+    :param items: Items accepted by evr_of(), such as Packages
+    :param name_key: Function that returns what identifies a package. Defaults to the name and architecture
+    :returns: Dictionary of {name_key(item): newest item}
+    """
+    newest = {}
+    newest_key = {}
+    for item in items:
+        name = name_key(item)
+        key = evr_of(item)
+        if name not in newest or key > newest_key[name]:
+            newest[name] = item
+            newest_key[name] = key
+    return newest
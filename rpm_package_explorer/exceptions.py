@@ -24,3 +24,24 @@ class UnsupportedOtherDatabaseException(Exception):
     def __init__(self, version) -> None:
         super().__init__(f'This other database version is unsupported. Please raise an issue. '
                          f'Currently support version {version} only.')
+
+
+class UnsupportedChecksumException(Exception):
+    """Used when the checksum type is unsupported"""
+    def __init__(self, hash_type, supported) -> None:
+        super().__init__(f'The {hash_type} checksum type is unsupported. Please raise an issue. '
+                         f'Currently support {supported} only.')
+
+
+class ChecksumMismatchException(Exception):
+    """Used when the checksum of a file doesn't match the one it's listed with"""
+    def __init__(self, name, hash_type, expected, actual) -> None:
+        super().__init__(f'{name} is corrupted or incomplete: expected {hash_type} checksum {expected}, '
+                         f'got {actual}')
+
+
+class UnsupportedSchemaVersionException(Exception):
+    """Used when the database has a schema version other than the one in use"""
+    def __init__(self, version, supported) -> None:
+        super().__init__(f'The database schema version {version} is unsupported. Currently support version '
+                         f'{supported} only, older databases can be migrated with migrate_database.py.')
@@ -0,0 +1,321 @@
+"""
+File ownership index, for "which package ships /usr/bin/foo" lookups
+
+Every path from filelists is stored once, sorted, with the pkgIds of the packages that ship it. The paths are
+front-coded in blocks of BLOCK_SIZE: the first path of a block is stored whole and the rest only store what differs
+from the path before them, which is most of the path since files sharing a directory sort next to each other. A path
+is found by a binary search over the first path of each block, then decoding that one block.
+
+The index is written to a single file made of flat arrays, so it's used straight from an mmap without being loaded
+into memory first. Layout, after the header:
+- block index: offset of each block in the block data, plus the end offset
+- block data: the front-coded paths
+- owner index: offset of each path's owners in the owner list, plus the end offset
+- owner list: package numbers, grouped by path
+- package index and package data: the pkgId of each package number
+"""
+import logging
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.loader import row_to_dict
+from .db_model.utils import DB_TABLE
+
+# Number of paths per front-coded block. Larger blocks are smaller on disk but slower to search
+BLOCK_SIZE = 16
+
+# Bumped whenever the file layout changes
+INDEX_MAGIC = b'RPMFIDX1'
+
+# magic, byte order, path count, package count, block size, then the offset of each section and the end of the file
+HEADER = struct.Struct('<8sc7x10Q')
+
+# Characters that start a wildcard in glob patterns
+GLOB_CHARACTERS = '*?['
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_varint(value: int, output: bytearray):
+    while value >= 0x80:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def _decode_varint(data, position: int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _encode_path(path: str) -> bytes:
+    # surrogateescape keeps paths that aren't valid UTF-8 intact
+    return path.encode('utf8', 'surrogateescape')
+
+
+def _decode_path(path: bytes) -> str:
+    return path.decode('utf8', 'surrogateescape')
+
+
+def _align(output: bytearray):
+    """Pad the output so the next array starts at a multiple of 8 bytes and can be used from the mmap as it is"""
+    output.extend(b'\0' * (-len(output) % 8))
+
+
+def write_file_index(owners: Dict[str, Iterable[str]], filename: str):
+    """
+    Write a file ownership index
+
+    :param owners: Dictionary of {path: pkgIds of the packages that ship it}
+    :param filename: The index file to write
+    """
+    packages = {}
+    block_index = array('Q')
+    blocks = bytearray()
+    owner_index = array('Q', [0])
+    owner_list = array('I')
+    previous = b''
+    paths = sorted(owners, key=_encode_path)
+    for number, path in enumerate(paths):
+        encoded = _encode_path(path)
+        if number % BLOCK_SIZE == 0:
+            block_index.append(len(blocks))
+            _encode_varint(len(encoded), blocks)
+            blocks.extend(encoded)
+        else:
+            shared = 0
+            limit = min(len(previous), len(encoded))
+            while shared < limit and previous[shared] == encoded[shared]:
+                shared += 1
+            _encode_varint(shared, blocks)
+            _encode_varint(len(encoded) - shared, blocks)
+            blocks.extend(encoded[shared:])
+        previous = encoded
+        owner_list.extend(sorted({packages.setdefault(pkg_id, len(packages)) for pkg_id in owners[path]}))
+        owner_index.append(len(owner_list))
+    block_index.append(len(blocks))
+
+    package_index = array('Q', [0])
+    package_data = bytearray()
+    for pkg_id in packages:
+        package_data.extend(pkg_id.encode('ascii'))
+        package_index.append(len(package_data))
+
+    output = bytearray(HEADER.size)
+    offsets = []
+    for section in (block_index.tobytes(), blocks, owner_index.tobytes(), owner_list.tobytes(),
+                    package_index.tobytes(), package_data):
+        _align(output)
+        offsets.append(len(output))
+        output.extend(section)
+    byte_order = b'L' if sys.byteorder == 'little' else b'B'
+    HEADER.pack_into(output, 0, INDEX_MAGIC, byte_order, len(paths), len(packages), BLOCK_SIZE, *offsets,
+                     len(output))
+    with open(filename, 'wb') as index_file:
+        index_file.write(output)
+    logger.info(f'Wrote {len(paths)} paths owned by {len(packages)} packages to {filename} ({len(output)} bytes)')
+
+
+def collect_owners(rows) -> Dict[str, set]:
+    """
+    Collect which packages ship each path
+
+    :param rows: Iterable of (table_name, row) tuples from xmlparser.iter_filelists(), or the dictionary returned by
+                 xmlparser.parse_filelists_new(). Only filelist and files rows are used
+    :returns: Dictionary of {path: set of pkgIds}
+    """
+    if isinstance(rows, dict):
+        rows = (('filelist', row) for row in rows.get('filelist', []))
+    owners = {}
+    for table_name, row in rows:
+        if table_name == 'filelist':
+            data = row_to_dict(row)
+            owners.setdefault(data['filename'], set()).add(data['pkgId'])
+        elif table_name == 'files':
+            data = row_to_dict(row)
+            owners.setdefault(data['name'], set()).add(data['pkgId'])
+    return owners
+
+
+class FileIndex(object):
+    """File ownership index read straight from an mmap of the file written by write_file_index()"""
+
+    def __init__(self, filename: str) -> None:
+        """
+        :param filename: The index file
+        """
+        with open(filename, 'rb') as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = data = memoryview(self._mmap)
+        (magic, byte_order, self.path_count, self.package_count, self._block_size, block_index_offset,
+         blocks_offset, owner_index_offset, owners_offset, package_index_offset, packages_offset,
+         end_offset) = HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'{filename} is not a file index, or was written by another version. Rebuild it')
+        if byte_order != (b'L' if sys.byteorder == 'little' else b'B'):
+            raise ValueError(f'{filename} was written on a machine with another byte order. Rebuild it')
+        self._block_count = -(-self.path_count // self._block_size)
+        self._block_index = data[block_index_offset:block_index_offset + (self._block_count + 1) * 8].cast('Q')
+        self._blocks = data[blocks_offset:owner_index_offset]
+        self._owner_index = data[owner_index_offset:owner_index_offset + (self.path_count + 1) * 8].cast('Q')
+        self._owners = data[owners_offset:owners_offset + self._owner_index[-1] * 4].cast('I')
+        self._package_index = data[package_index_offset:
+                                   package_index_offset + (self.package_count + 1) * 8].cast('Q')
+        self._packages = data[packages_offset:end_offset]
+
+    def close(self):
+        """Release the mmap. Nothing returned by the index is backed by it, so that's safe to keep"""
+        for view in (self._block_index, self._blocks, self._owner_index, self._owners, self._package_index,
+                     self._packages, self._data):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'FileIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.path_count
+
+    def _first_path(self, block: int) -> bytes:
+        length, position = _decode_varint(self._blocks, self._block_index[block])
+        return bytes(self._blocks[position:position + length])
+
+    def _decode_block(self, block: int) -> List[bytes]:
+        position = self._block_index[block]
+        end = self._block_index[block + 1]
+        length, position = _decode_varint(self._blocks, position)
+        path = bytes(self._blocks[position:position + length])
+        position += length
+        paths = [path]
+        while position < end:
+            shared, position = _decode_varint(self._blocks, position)
+            length, position = _decode_varint(self._blocks, position)
+            path = path[:shared] + bytes(self._blocks[position:position + length])
+            position += length
+            paths.append(path)
+        return paths
+
+    def _find_block(self, path: bytes) -> int:
+        """Find the block that path is in, if it's in the index at all"""
+        low, high = 0, self._block_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._first_path(middle) <= path:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def _pkg_ids(self, number: int) -> List[str]:
+        pkg_ids = []
+        for package in self._owners[self._owner_index[number]:self._owner_index[number + 1]]:
+            start = self._package_index[package]
+            end = self._package_index[package + 1]
+            pkg_ids.append(bytes(self._packages[start:end]).decode('ascii'))
+        return pkg_ids
+
+    def owners(self, path: str) -> List[str]:
+        """
+        Find the packages that ship a path, ie. owners('/usr/bin/foo')
+
+        :param path: The absolute path
+        :returns: A list of pkgIds, empty if no package ships the path
+        """
+        if not self.path_count:
+            return []
+        encoded = _encode_path(path)
+        block = self._find_block(encoded)
+        paths = self._decode_block(block)
+        index = bisect_right(paths, encoded) - 1
+        if index < 0 or paths[index] != encoded:
+            return []
+        return self._pkg_ids(block * self._block_size + index)
+
+    def prefix(self, prefix: str) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Generator function that finds every path starting with prefix, ie. prefix('/usr/lib64/python3.6/')
+
+        :param prefix: The start of the paths
+        :returns: (path, pkgIds) tuples in sorted order
+        """
+        if not self.path_count:
+            return
+        encoded = _encode_path(prefix)
+        block = self._find_block(encoded)
+        while block < self._block_count:
+            for index, path in enumerate(self._decode_block(block)):
+                if path < encoded:
+                    continue
+                if not path.startswith(encoded):
+                    return
+                yield _decode_path(path), self._pkg_ids(block * self._block_size + index)
+            block += 1
+
+    def glob(self, pattern: str) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Generator function that finds every path matching a shell-style pattern, ie. glob('/usr/bin/python3*')
+
+        Wildcards match / as well, same as fnmatch. Only the paths starting with the part of the pattern before the
+        first wildcard are checked, so patterns starting with a wildcard go through every path.
+
+        :param pattern: The pattern
+        :returns: (path, pkgIds) tuples in sorted order
+        """
+        literal_end = min([pattern.find(character) for character in GLOB_CHARACTERS if character in pattern],
+                          default=len(pattern))
+        for path, pkg_ids in self.prefix(pattern[:literal_end]):
+            if fnmatchcase(path, pattern):
+                yield path, pkg_ids
+
+    @classmethod
+    def build(cls, rows, filename: str) -> 'FileIndex':
+        """
+        Build an index out of parsed filelists and open it
+
+        :param rows: Anything collect_owners() accepts
+        :param filename: The index file to write
+        :returns: The FileIndex
+        """
+        write_file_index(collect_owners(rows), filename)
+        return cls(filename)
+
+    @classmethod
+    def from_database(cls, engine: Engine, filename: str, repo_name: str = None) -> 'FileIndex':
+        """
+        Build an index out of the filelist table of the explorer database and open it
+
+        :param engine: The SQLAlchemy engine of the explorer database
+        :param filename: The index file to write
+        :param repo_name: Only index the packages of this repository. Indexes every package if not provided
+        :returns: The FileIndex
+        """
+        filelist = DB_TABLE['filelist']
+        repo_package = DB_TABLE['repo_package']
+        query = select(filelist.c.filename, filelist.c.pkgId)
+        if repo_name is not None:
+            query = query.where(filelist.c.pkgId.in_(
+                select(repo_package.c.pkgId).where(repo_package.c.repo_name == repo_name)))
+        owners = {}
+        with engine.connect() as connection:
+            for path, pkg_id in connection.execute(query):
+                owners.setdefault(path, set()).add(pkg_id)
+        write_file_index(owners, filename)
+        return cls(filename)
@@ -0,0 +1,242 @@
+"""
+fullfiletimelist parser
+
+Mirrors publish a fullfiletimelist listing every file of the mirror with its modification time and size, which is
+what quick-fedora-mirror uses to tell what changed. It looks like this:
+
+    [Version]
+    2
+
+    [Files]
+    1620000000	d	4096	8/BaseOS/x86_64/os/repodata
+    1620000000	f	3717	8/BaseOS/x86_64/os/repodata/repomd.xml
+
+    [Checksums SHA1]
+    0123456789abcdef0123456789abcdef01234567	8/BaseOS/x86_64/os/repodata/repomd.xml
+
+    [End]
+
+A full mirror has millions of lines, so the file is streamed line by line and every line is split on tabs rather
+than matched against a regex. The part that matters for loading repositories is the repodata directories, so
+read_repodata_trees() only keeps those, and diff_repodata_trees() tells which of them changed between two lists.
+stale_repodata_files() checks a local copy of a repodata directory against the [Checksums] section.
+"""
+import io
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .exceptions import InvalidState, UnsupportedFileListException
+from .io_handler import hash_file
+from .utils import open_file
+
+SUPPORTED_FILETIMELIST_VERSIONS = [2]
+
+# The order the sections come in
+SECTIONS = ['Version', 'Files', 'Checksums', 'End']
+
+REPODATA_DIR = 'repodata'
+
+
+class FileEntry(NamedTuple):
+    """A line of the [Files] section"""
+    mtime: int
+    # f for files, d for directories, l for links
+    type: str
+    size: int
+    path: str
+
+
+class ChecksumEntry(NamedTuple):
+    """A line of the [Checksums] section"""
+    hash_type: str
+    checksum: str
+    path: str
+
+
+class RepodataTree(NamedTuple):
+    """A repodata directory and the files in it"""
+    # The directory that contains the repodata directory, relative to the root of the mirror
+    path: str
+    # {file name: (mtime, size)}
+    files: Dict[str, Tuple[int, int]]
+    # {file name: ChecksumEntry} for the files listed in [Checksums], usually repomd.xml
+    checksums: Dict[str, ChecksumEntry]
+
+    @property
+    def mtime(self) -> int:
+        """Modification time of the newest file"""
+        return max((mtime for mtime, _ in self.files.values()), default=0)
+
+    @property
+    def size(self) -> int:
+        """Total size of the files"""
+        return sum(size for _, size in self.files.values())
+
+
+class TreeChange(NamedTuple):
+    """A repodata directory that differs between two fullfiletimelists"""
+    path: str
+    # added, removed or changed
+    status: str
+    old: Optional[RepodataTree]
+    new: Optional[RepodataTree]
+
+    @property
+    def changed_files(self) -> List[str]:
+        """Names of the files that were added, removed or have another mtime, size or checksum"""
+        old_files = self.old.files if self.old is not None else {}
+        new_files = self.new.files if self.new is not None else {}
+        old_checksums = self.old.checksums if self.old is not None else {}
+        new_checksums = self.new.checksums if self.new is not None else {}
+        return sorted(name for name in old_files.keys() | new_files.keys() | old_checksums.keys() | new_checksums.keys()
+                      if old_files.get(name) != new_files.get(name)
+                      or old_checksums.get(name) != new_checksums.get(name))
+
+
+@contextmanager
+def _open_lines(source):
+    """Open a file name or file object as text, decompressing it if needed"""
+    if isinstance(source, str):
+        file_object = open_file(source, 'rb')
+    else:
+        file_object = source
+    try:
+        if isinstance(file_object, io.TextIOBase):
+            yield file_object
+        else:
+            # Paths that aren't valid UTF-8 are kept as they are rather than failing the whole list
+            yield io.TextIOWrapper(file_object, encoding='utf8', errors='surrogateescape', newline='\n')
+    finally:
+        if file_object is not source:
+            file_object.close()
+
+
+def iter_filetimelist(source, path_contains: str = None) -> Iterator[tuple]:
+    """
+    Generator function that reads a fullfiletimelist one line at a time
+
+    :param source: The file name or file object of the fullfiletimelist
+    :param path_contains: Skip the [Files] and [Checksums] lines that don't contain this, before they're split up.
+                          Much faster than filtering the entries afterwards when only a few paths matter
+    :returns: ('version', int), ('file', FileEntry) and ('checksum', ChecksumEntry) tuples in file order
+    """
+    section = None
+    hash_type = None
+    with _open_lines(source) as lines:
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            if line[0] == '[' and line[-1] == ']':
+                header = line[1:-1]
+                name, _, hash_type = header.partition(' ')
+                if name not in SECTIONS:
+                    raise InvalidState(f'Unknown fullfiletimelist section {line}')
+                if section is not None and SECTIONS.index(name) <= SECTIONS.index(section):
+                    raise InvalidState(f'fullfiletimelist section {line} is out of order')
+                section = name
+                if section == 'End':
+                    return
+                continue
+
+            if path_contains is not None and path_contains not in line and section in ('Files', 'Checksums'):
+                continue
+            if section == 'Files':
+                mtime, file_type, size, path = line.split('\t', 3)
+                yield 'file', FileEntry(int(mtime), file_type, int(size), path)
+            elif section == 'Checksums':
+                checksum, path = line.split('\t', 1)
+                yield 'checksum', ChecksumEntry(hash_type.lower(), checksum, path)
+            elif section == 'Version':
+                version = int(line)
+                if version not in SUPPORTED_FILETIMELIST_VERSIONS:
+                    raise UnsupportedFileListException(SUPPORTED_FILETIMELIST_VERSIONS)
+                yield 'version', version
+            else:
+                raise InvalidState(f'fullfiletimelist data outside of a section: {line}')
+
+
+def _split_repodata_path(path: str):
+    """Split repodata paths into (tree, file name), ie. a/b/repodata/repomd.xml into (a/b, repomd.xml)"""
+    directory, _, name = path.rpartition('/')
+    tree, _, directory_name = directory.rpartition('/')
+    if directory_name != REPODATA_DIR:
+        return None
+    return tree, name
+
+
+def read_repodata_trees(source) -> Dict[str, RepodataTree]:
+    """
+    Read the repodata directories listed in a fullfiletimelist
+
+    :param source: The file name or file object of the fullfiletimelist
+    :returns: Dictionary of {path of the directory containing repodata: RepodataTree}
+    """
+    trees = {}
+    # Only lines that have a repodata directory at all are split up
+    for kind, entry in iter_filetimelist(source, REPODATA_DIR + '/'):
+        if kind == 'version' or (kind == 'file' and not entry.type.startswith('f')):
+            continue
+        split = _split_repodata_path(entry.path)
+        if split is None:
+            continue
+        tree_path, name = split
+        tree = trees.get(tree_path)
+        if tree is None:
+            tree = trees[tree_path] = RepodataTree(tree_path, {}, {})
+        if kind == 'file':
+            tree.files[name] = (entry.mtime, entry.size)
+        else:
+            tree.checksums[name] = entry
+    return trees
+
+
+def diff_repodata_trees(old: Dict[str, RepodataTree], new: Dict[str, RepodataTree]) -> List[TreeChange]:
+    """
+    Compare the repodata directories of two fullfiletimelists
+
+    A directory changed if any file in it was added, removed, or has another modification time, size or checksum.
+
+    :param old: read_repodata_trees() of the older fullfiletimelist
+    :param new: read_repodata_trees() of the newer fullfiletimelist
+    :returns: A list of TreeChange sorted by path. Unchanged directories aren't listed
+    """
+    changes = []
+    for path in sorted(old.keys() | new.keys()):
+        old_tree = old.get(path)
+        new_tree = new.get(path)
+        if old_tree is None:
+            changes.append(TreeChange(path, 'added', None, new_tree))
+        elif new_tree is None:
+            changes.append(TreeChange(path, 'removed', old_tree, None))
+        elif old_tree.files != new_tree.files or old_tree.checksums != new_tree.checksums:
+            changes.append(TreeChange(path, 'changed', old_tree, new_tree))
+    return changes
+
+
+def stale_repodata_files(tree: RepodataTree, mirror_root: str) -> List[str]:
+    """
+    Check a local copy of a repodata directory against the checksums the fullfiletimelist lists for it
+
+    :param tree: The RepodataTree from read_repodata_trees()
+    :param mirror_root: The local directory that has the same layout as the root of the mirror
+    :returns: Sorted names of the files in [Checksums], usually repomd.xml, that are missing or have another checksum
+    """
+    stale = []
+    for name, entry in tree.checksums.items():
+        filename = os.path.join(mirror_root, tree.path, REPODATA_DIR, name)
+        if not os.path.isfile(filename) or hash_file(filename, entry.hash_type) != entry.checksum.lower():
+            stale.append(name)
+    return sorted(stale)
+
+
+def diff_filetimelists(old_source, new_source) -> List[TreeChange]:
+    """
+    Tell which repodata directories changed between two fullfiletimelists, ie. to only reload those repositories
+
+    :param old_source: The file name or file object of the older fullfiletimelist
+    :param new_source: The file name or file object of the newer fullfiletimelist
+    :returns: A list of TreeChange sorted by path
+    """
+    return diff_repodata_trees(read_repodata_trees(old_source), read_repodata_trees(new_source))
@@ -0,0 +1,460 @@
+"""
+Load repositories into the explorer database
+
+A repository is loaded in three steps:
+- pick which metadata listed in repomd.xml to load (select_metadata)
+- decompress each metadata file that needs it (decompress_metadata). SQLite databases are decompressed to a file,
+  on tmpfs when there is one. ingest_repo() parses XML straight from the decompressing stream, ingest_repos() and
+  the prefetcher decompress it ahead of time in their workers. Either way the checksums listed in repomd.xml are
+  verified as the file is read (open_metadata)
+- write everything into the database in one transaction, only changing what changed since the last load
+  (write_metadata)
+
+When given a directory to keep XML indexes in, the decompressed primary, filelists and other XML are kept there while
+they're parsed, along with an offset index of every package in them (see xml_index.py), so a single package can be
+read back without parsing the whole file or going through the database.
+
+ingest_repo() does it all for a single repository, and ingest_repos() does the same for many repositories at once
+with the decompression spread across a process pool. XML is always parsed by the process that writes it, one package
+at a time, so no matter how large filelists.xml is it's never held in memory as a whole.
+
+Every step is recorded in INSTRUMENTATION (see instrumentation.py) as the decompress, parse, write and transaction
+stages, labelled with the repository and metadata type. XML that's streamed into the database is parsed while it's
+written, so its write stage includes the parse stage.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from .db_model.loader import BatchWriter, BulkLoader
+from .db_model.refresh import REPO_METADATA_TABLES, RepoRefresh, filter_unchanged, load_refresh_state, \
+    metadata_name
+from .db_model.utils import iter_sqlite_rows
+from .instrumentation import INSTRUMENTATION, instrumented_rows, stage
+from .io_handler import open_verified, read_data
+from .utils import open_file
+from .xml_index import IndexingReader, PackageOffsetScanner, index_filename, write_xml_index
+from .xmlparser import iter_filelists, iter_otherdata, iter_primary, iter_updateinfo, parse_repomd
+
+SUPPORTED_DATABASE_VERSIONS = [10]
+
+PARSE_DATA = ['primary_db', 'filelists_db', 'other_db', 'primary', 'filelists', 'other', 'group',
+              'group_gz', 'updateinfo']
+
+SKIP_PARSE = ['filelists_db', 'other_db', 'primary', 'filelists', 'other', 'group',
+              'group_gz', 'updateinfo']
+
+# Define which to read first
+PRIORITY = {
+    'primary': ['primary_db', 'primary'],
+    'filelists': ['filelists_db', 'filelists'],
+    'other': ['other_db', 'other'],
+    'group': ['group', 'group_gz'],
+    'updateinfo': ['updateinfo']
+}
+
+DEFAULT_PARSE_DATA = [x for x in PARSE_DATA if x not in SKIP_PARSE]
+
+SQLITE_DATA_TYPES = ['primary_db', 'filelists_db', 'other_db']
+
+XML_ITERATORS = {
+    'primary': iter_primary,
+    'filelists': iter_filelists,
+    'other': iter_otherdata,
+    'updateinfo': iter_updateinfo
+}
+
+# XML that can be kept with a package offset index, see xml_index.py
+INDEXED_XML = ['primary', 'filelists', 'other']
+
+# Decompressed SQLite databases go here if it exists, so they never touch the disk
+TMPFS_DIR = '/dev/shm'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Repo(object):
+    """A repository to be loaded"""
+    name: str
+    # Directory that contains the repodata directory, or the http(s) URL of one for prefetch.prefetch_and_ingest()
+    path: str
+
+
+@dataclass
+class RepoTiming(object):
+    """How long each step of loading a repository took, in seconds"""
+    # Time spent before writing, per metadata type. XML streamed straight into the database is part of write
+    parse: dict = field(default_factory=dict)
+    write: float = 0.0
+
+    def __str__(self) -> str:
+        parse = ', '.join(f'{data_type} {seconds:.2f}s' for data_type, seconds in self.parse.items())
+        return f'parse: {parse or "none"}; write: {self.write:.2f}s'
+
+
+def read_manifest(filename: str):
+    """
+    Read the list of repositories to load
+
+    The manifest is a JSON list of repositories, such as:
+    [
+        {"name": "rocky-8-baseos-x86_64", "path": "/mirror/rocky/8/BaseOS/x86_64/os"},
+        {"name": "rocky-8-appstream-x86_64", "path": "/mirror/rocky/8/AppStream/x86_64/os"}
+    ]
+
+    :param filename: The manifest file name
+    :returns: A list of Repo
+    """
+    with open(filename, encoding='utf8') as manifest:
+        return [Repo(repo['name'], repo['path']) for repo in json.load(manifest)]
+
+
+def select_metadata(repomd_data: dict, parse_data: list = None):
+    """
+    Pick the metadata to load from repomd.xml: the first type of each PRIORITY group that is in parse_data
+
+    :param repomd_data: Parsed repomd.xml data from parse_repomd()
+    :param parse_data: The metadata types that may be loaded. Defaults to DEFAULT_PARSE_DATA
+    :returns: List of metadata types to load, primary first
+    """
+    if parse_data is None:
+        parse_data = DEFAULT_PARSE_DATA
+    selected = []
+    for priority_list in PRIORITY.values():
+        for data_type in priority_list:
+            if data_type in parse_data and data_type in repomd_data:
+                selected.append(data_type)
+                break
+    return selected
+
+
+def default_workdir():
+    """
+    Get the directory to decompress metadata into: tmpfs if there is one, the temporary directory otherwise
+
+    Decompressed XML can be several times the size of the SQLite databases, point workdir at a disk when tmpfs is small
+
+    :returns: The directory
+    """
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def scratch_dir(workdir: str = None):
+    """
+    Context manager that provides a temporary directory to decompress metadata into, removed afterwards
+
+    :param workdir: Directory to create the temporary directory in. Defaults to default_workdir()
+    :returns: The temporary directory
+    """
+    path = tempfile.mkdtemp(prefix='rpm_package_explorer-', dir=workdir or default_workdir())
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def metadata_path(repo_path: str, data: dict):
+    """
+    Get the path to a metadata file listed in repomd.xml
+
+    :param repo_path: Directory that contains the repodata directory
+    :param data: The repomd.xml data of the metadata from parse_repomd()
+    :returns: The path to the metadata file, compressed or not
+    """
+    return os.path.join(repo_path, data['href'])
+
+
+def open_metadata(filename: str, data: dict):
+    """
+    Open a metadata file for reading, decompressing it and verifying both checksums listed in repomd.xml as it's read
+
+    :param filename: The metadata file
+    :param data: The repomd.xml data of the metadata from parse_repomd()
+    :returns: Binary file object of the decompressed data. Reading it to the end raises ChecksumMismatchException if
+              the file doesn't match repomd.xml
+    """
+    return open_verified(filename, data['checksum_hash_type'], data['checksum_hash'],
+                         data.get('open_checksum_hash_type'), data.get('open_checksum_hash'))
+
+
+def decompress_metadata(repo_path: str, data: dict, workdir: str, xml_filename: str = None):
+    """
+    Decompress a metadata file listed in repomd.xml into workdir
+
+    SQLite databases always need this. XML metadata is parsed as it's decompressed, unless it's decompressed ahead of
+    time by the prefetcher.
+
+    :param repo_path: Directory that contains the repodata directory
+    :param data: The repomd.xml data of the metadata from parse_repomd()
+    :param workdir: Directory the decompressed file is written to
+    :param xml_filename: Decompress XML here instead, along with its offset index, see open_indexed_metadata()
+    :returns: The path to the decompressed file
+    """
+    if xml_filename is not None:
+        with open_indexed_metadata(metadata_path(repo_path, data), data, xml_filename) as source:
+            for _ in read_data(source):
+                pass
+        return xml_filename
+    source_filename: str = data['href']
+    dest_filename = source_filename.replace('repodata/', '')
+    if data.get('open_checksum_hash') is not None:
+        # Archives are listed with the checksum of the decompressed data as well, so drop the archive extension
+        dest_filename = dest_filename.rsplit('.', maxsplit=1)[0]
+    source_filepath = metadata_path(repo_path, data)
+    dest_filepath = os.path.join(workdir, dest_filename)
+    with open_metadata(source_filepath, data) as source_data, open_file(dest_filepath, 'wb') as dest_data:
+        for binary_data in read_data(source_data):
+            dest_data.write(binary_data)
+        dest_data.flush()
+    return dest_filepath
+
+
+def indexed_xml_path(xml_index_dir: str, repo_name: str, repo_category: str):
+    """
+    Get where the decompressed XML of a repository is kept along with its offset index
+
+    :param xml_index_dir: The directory XML indexes are kept in
+    :param repo_name: The repository name
+    :param repo_category: The repomd data type, ie. filelists
+    :returns: The path to the decompressed XML, the index is at xml_index.index_filename() of it
+    """
+    return os.path.join(xml_index_dir, repo_name, f'{repo_category}.xml')
+
+
+@contextmanager
+def open_indexed_metadata(filename: str, data: dict, xml_filename: str = None):
+    """
+    Context manager that opens a metadata file like open_metadata(), and if xml_filename is given keeps a copy of
+    the decompressed XML there and writes its offset index once it has all been read and verified
+
+    :param filename: The metadata file
+    :param data: The repomd.xml data of the metadata from parse_repomd()
+    :param xml_filename: Where to keep the decompressed XML. Nothing is kept if not provided
+    :returns: Binary file object of the decompressed data
+    """
+    if xml_filename is None:
+        with open_metadata(filename, data) as source:
+            yield source
+        return
+    os.makedirs(os.path.dirname(xml_filename), exist_ok=True)
+    scanner = PackageOffsetScanner()
+    temporary = f'{xml_filename}.tmp'
+    try:
+        with open_metadata(filename, data) as source, open(temporary, 'wb') as copy:
+            yield IndexingReader(source, scanner, copy)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    # Drop the old index first, so nothing reads the new XML with it
+    if os.path.exists(index_filename(xml_filename)):
+        os.remove(index_filename(xml_filename))
+    os.replace(temporary, xml_filename)
+    write_xml_index(index_filename(xml_filename), scanner.offsets, scanner.root_tag)
+
+
+def write_metadata(writer: BatchWriter, refresh: RepoRefresh, repo_category: str, data: dict, filename: str,
+                   xml_filename: str = None, xml_decompressed: bool = False):
+    """
+    Write a metadata file into the database through the refresh, so only the changes are written
+
+    :param writer: The BatchWriter of the repository transaction
+    :param refresh: RepoRefresh bound to the same writer
+    :param repo_category: The repomd data type, ie. primary_db
+    :param data: The repomd.xml data of the metadata from parse_repomd()
+    :param filename: The decompressed SQLite database, or the XML file which is decompressed as it's parsed
+    :param xml_filename: Where to keep the decompressed XML along with its offset index, when XML is parsed here
+    :param xml_decompressed: Whether XML filename was already decompressed and verified by decompress_metadata()
+    """
+    if repo_category in SQLITE_DATA_TYPES:
+        if data['database_version'] not in SUPPORTED_DATABASE_VERSIONS:
+            logger.warning(f'{repo_category} database version {data["database_version"]} is unsupported, skipping')
+            return
+        if writer.supports_copy:
+            # Let SQLite copy the data over by itself
+            refresh.copy_sqlite(filename, repo_category, data['database_version'])
+        else:
+            refresh.load_rows(repo_category, iter_sqlite_rows(filename, repo_category, data['database_version']))
+    elif repo_category in XML_ITERATORS:
+        load_rows = refresh.replace_rows if metadata_name(repo_category) in REPO_METADATA_TABLES else refresh.load_rows
+        if xml_decompressed:
+            opened = open_file(filename, 'rb')
+        else:
+            opened = open_indexed_metadata(filename, data, xml_filename)
+        with opened as source:
+            load_rows(repo_category, instrumented_rows('parse', XML_ITERATORS[repo_category](source),
+                                                       repo=writer.repo_name, data_type=repo_category))
+    else:
+        logger.warning(f'No database model for {repo_category} yet, skipping')
+        return
+    refresh.save_state(repo_category, data)
+
+
+def changed_metadata(loader: BulkLoader, repo: Repo, parse_data: list, repomd_filename: str = None):
+    """Read repomd.xml of a repository and return its data along with the metadata types that need loading"""
+    repomd_data = parse_repomd(repomd_filename or os.path.join(repo.path, 'repodata', 'repomd.xml'))
+    data_types = select_metadata(repomd_data, parse_data)
+    refresh_state = load_refresh_state(loader.engine, repo.name)
+    return repomd_data, filter_unchanged(repomd_data, data_types, refresh_state, repo.name)
+
+
+def ingest_repo(loader: BulkLoader, repo: Repo, workdir: str = None, parse_data: list = None,
+                xml_index_dir: str = None):
+    """
+    Load a single repository
+
+    XML metadata is parsed while it's written, so its parse time is part of the write time.
+
+    :param loader: The BulkLoader of the explorer database
+    :param repo: The repository to load
+    :param workdir: Directory that SQLite databases are decompressed into. Defaults to default_workdir()
+    :param parse_data: The metadata types that may be loaded. Defaults to DEFAULT_PARSE_DATA
+    :param xml_index_dir: Directory to keep the decompressed XML and offset indexes in, see indexed_xml_path()
+    :returns: RepoTiming of the repository
+    """
+    timing = RepoTiming()
+    repomd_data, data_types = changed_metadata(loader, repo, parse_data)
+    with scratch_dir(workdir) as repo_workdir:
+        files = {}
+        for repo_category in data_types:
+            if repo_category in SQLITE_DATA_TYPES:
+                start = time.perf_counter()
+                with stage('decompress', repo=repo.name, data_type=repo_category):
+                    files[repo_category] = decompress_metadata(repo.path, repomd_data[repo_category], repo_workdir)
+                timing.parse[repo_category] = time.perf_counter() - start
+            else:
+                files[repo_category] = metadata_path(repo.path, repomd_data[repo_category])
+        timing.write = write_repo_files(loader, repo.name, repomd_data, files, xml_index_dir)
+    return timing
+
+
+def write_repo_files(loader: BulkLoader, repo_name: str, repomd_data: dict, files: dict, xml_index_dir: str = None,
+                     xml_decompressed: bool = False):
+    """
+    Write the metadata files of a repository in one transaction
+
+    :param loader: The BulkLoader of the explorer database
+    :param repo_name: The repository name
+    :param repomd_data: Parsed repomd.xml data from parse_repomd()
+    :param files: Dictionary of {repo_category: file name} in the order to write them, primary first. SQLite
+                  databases have to be decompressed already, XML is decompressed as it's parsed unless
+                  xml_decompressed is set
+    :param xml_index_dir: Directory to keep the decompressed XML and offset indexes in, see indexed_xml_path()
+    :param xml_decompressed: Whether the XML files were already decompressed, verified and indexed by
+                             decompress_metadata()
+    :returns: The seconds it took
+    """
+    start = time.perf_counter()
+    with stage('transaction', repo=repo_name), loader.transaction(repo_name) as writer:
+        refresh = RepoRefresh(writer)
+        for repo_category, filename in files.items():
+            with stage('write', repo=repo_name, data_type=repo_category):
+                write_metadata(writer, refresh, repo_category, repomd_data[repo_category], filename,
+                               xml_filename=_xml_filename(xml_index_dir, repo_name, repo_category),
+                               xml_decompressed=xml_decompressed)
+    return time.perf_counter() - start
+
+
+def _xml_filename(xml_index_dir: str, repo_name: str, repo_category: str):
+    """Where to keep the decompressed XML of a metadata file, None if it isn't kept"""
+    if xml_index_dir is None or repo_category not in INDEXED_XML:
+        return None
+    return indexed_xml_path(xml_index_dir, repo_name, repo_category)
+
+
+def _parse_task(repo: Repo, repo_category: str, data: dict, workdir: str, xml_index_dir: str = None):
+    """
+    Process pool task that decompresses one metadata file of one repository
+
+    Only the name of the decompressed file goes back to the writer, which copies SQLite databases over by itself and
+    streams XML into the database one package at a time. XML goes into the XML index directory along with its offset
+    index when there is one, into workdir otherwise.
+
+    :returns: (repo_name, repo_category, file name, seconds taken, INSTRUMENTATION snapshot)
+    """
+    # Worker processes run one task at a time, so whatever is recorded from here on belongs to this task
+    INSTRUMENTATION.reset()
+    start = time.perf_counter()
+    if repo_category in SQLITE_DATA_TYPES or repo_category in XML_ITERATORS:
+        with stage('decompress', repo=repo.name, data_type=repo_category):
+            filename = decompress_metadata(repo.path, data, workdir,
+                                           _xml_filename(xml_index_dir, repo.name, repo_category))
+    else:
+        # Nothing loads it yet, write_metadata() skips it
+        filename = metadata_path(repo.path, data)
+    return repo.name, repo_category, filename, time.perf_counter() - start, INSTRUMENTATION.snapshot()
+
+
+def ingest_repos(loader: BulkLoader, repos: list, workdir: str = None, parse_data: list = None, workers: int = None,
+                 xml_index_dir: str = None):
+    """
+    Load many repositories, decompressing them in parallel
+
+    Every metadata file of every repository is decompressed and verified by its own process pool task. Repositories
+    are parsed and written to the database by this process alone as soon as all of their metadata is decompressed,
+    while the pool carries on with the rest.
+
+    :param loader: The BulkLoader of the explorer database
+    :param repos: List of Repo to load
+    :param workdir: Directory that metadata is decompressed into, one subdirectory per repository. Defaults to
+                    default_workdir()
+    :param parse_data: The metadata types that may be loaded. Defaults to DEFAULT_PARSE_DATA
+    :param workers: Number of worker processes. Defaults to the number of CPUs
+    :param xml_index_dir: Directory to keep the decompressed XML and offset indexes in, see indexed_xml_path()
+    :returns: Dictionary of {repo_name: RepoTiming}
+    """
+    timings = {repo.name: RepoTiming() for repo in repos}
+    repomd = {}
+    pending = {}
+    results = {}
+    with scratch_dir(workdir) as workdir, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for repo in repos:
+            repo_workdir = os.path.join(workdir, repo.name)
+            os.makedirs(repo_workdir, exist_ok=True)
+            repomd_data, data_types = changed_metadata(loader, repo, parse_data)
+            repomd[repo.name] = (repo, repomd_data, data_types, repo_workdir)
+            pending[repo.name] = len(data_types)
+            results[repo.name] = {}
+            for repo_category in data_types:
+                futures.append(executor.submit(_parse_task, repo, repo_category, repomd_data[repo_category],
+                                               repo_workdir, xml_index_dir))
+            if not data_types:
+                logger.info(f'{repo.name} is unchanged')
+
+        for future in as_completed(futures):
+            repo_name, repo_category, filename, seconds, stages = future.result()
+            INSTRUMENTATION.merge(stages)
+            timings[repo_name].parse[repo_category] = seconds
+            results[repo_name][repo_category] = filename
+            pending[repo_name] -= 1
+            if pending[repo_name] == 0:
+                _write_repo(loader, repomd[repo_name], results.pop(repo_name), timings[repo_name])
+
+    for repo_name, timing in timings.items():
+        logger.info(f'{repo_name}: {timing}')
+    return timings
+
+
+def _write_repo(loader: BulkLoader, repo_data: tuple, results: dict, timing: RepoTiming):
+    """Write every decompressed metadata file of a repository in one transaction, then clean up its workdir"""
+    repo, repomd_data, data_types, repo_workdir = repo_data
+    start = time.perf_counter()
+    with stage('transaction', repo=repo.name), loader.transaction(repo.name) as writer:
+        refresh = RepoRefresh(writer)
+        # Write in priority order so primary decides which packages exist before filelists and other are written
+        for repo_category in data_types:
+            with stage('write', repo=repo.name, data_type=repo_category):
+                write_metadata(writer, refresh, repo_category, repomd_data[repo_category], results[repo_category],
+                               xml_decompressed=True)
+    timing.write = time.perf_counter() - start
+    shutil.rmtree(repo_workdir, ignore_errors=True)
@@ -0,0 +1,315 @@
+"""
+Per-stage instrumentation of the ingest pipeline
+
+Records how long each stage (decompression, XML parsing, rearranging, building models, database writes) takes and
+how much it handles, so a slow refresh can be pinned on the stage that's actually slow:
+
+    with stage('decompress', repo='baseos', data_type='primary_db') as recorder:
+        ...
+        recorder.add_rows(rows)
+
+    @instrumented('xmlparser.convert_to_class', rows=count_rows)
+    def convert_to_class(...):
+        ...
+
+    for row in instrumented_rows('parse', iter_primary(source), data_type='primary'):
+        ...
+
+Each stage and set of labels keeps the number of calls, wall time, CPU time, rows and the peak RSS of the process
+once the stage ended. If tracemalloc is tracing (python -X tracemalloc, or tracemalloc.start()), the peak memory
+allocated by Python during the stage is kept as well. Recording a stage costs a few clock reads and a getrusage()
+call, so it's left on all the time; set INSTRUMENTATION.enabled to False to turn it off.
+
+The stages are exported with to_json() or to_prometheus(), the Prometheus text exposition format.
+"""
+import functools
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# Prefix of the exported Prometheus metric names
+METRIC_PREFIX = 'rpm_package_explorer_stage'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats(object):
+    """What was recorded for a stage and set of labels"""
+    calls: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    rows: int = 0
+    # Highest maximum RSS of the process seen when the stage ended
+    peak_rss_bytes: int = 0
+    # Highest tracemalloc peak seen during the stage, None if tracemalloc wasn't tracing
+    peak_traced_bytes: Optional[int] = None
+
+    def merge(self, other: 'StageStats'):
+        """Add the stats of another run of the same stage, ie. from another process"""
+        self.calls += other.calls
+        self.wall_seconds += other.wall_seconds
+        self.cpu_seconds += other.cpu_seconds
+        self.rows += other.rows
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.peak_rss_bytes)
+        if other.peak_traced_bytes is not None:
+            self.peak_traced_bytes = max(self.peak_traced_bytes or 0, other.peak_traced_bytes)
+
+
+class StageRecorder(object):
+    """Handed out by Instrumentation.stage() to count the rows handled by the stage"""
+    __slots__ = ['rows']
+
+    def __init__(self) -> None:
+        self.rows = 0
+
+    def add_rows(self, rows: int = 1):
+        self.rows += rows
+
+
+def _max_rss() -> int:
+    """Maximum RSS of this process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _labels_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+class Instrumentation(object):
+    """Collects StageStats per stage name and labels"""
+
+    def __init__(self, enabled: bool = True) -> None:
+        """
+        :param enabled: Whether stages are recorded at all
+        """
+        self.enabled = enabled
+        # {(stage name, ((label, value), ...)): StageStats}
+        self.stages: Dict[Tuple[str, tuple], StageStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name: str, labels: dict, wall_seconds: float, cpu_seconds: float, rows: int = 0,
+               peak_traced_bytes: int = None):
+        """
+        Add a finished run of a stage
+
+        :param name: The stage name
+        :param labels: Labels telling runs of the stage apart, ie. {'repo': 'baseos', 'data_type': 'primary'}
+        :param wall_seconds: Wall time taken
+        :param cpu_seconds: CPU time taken by the process
+        :param rows: Number of rows handled
+        :param peak_traced_bytes: Peak memory allocated by Python, if tracemalloc was tracing
+        """
+        run = StageStats(1, wall_seconds, cpu_seconds, rows, _max_rss(), peak_traced_bytes)
+        key = (name, _labels_key(labels))
+        with self._lock:
+            stats = self.stages.get(key)
+            if stats is None:
+                self.stages[key] = run
+            else:
+                stats.merge(run)
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """
+        Context manager that records the block as a run of a stage
+
+        :param name: The stage name, ie. decompress
+        :param labels: Labels telling runs of the stage apart, ie. repo='baseos', data_type='primary'
+        :returns: A StageRecorder to count rows with
+        """
+        recorder = StageRecorder()
+        if not self.enabled:
+            yield recorder
+            return
+        depth = getattr(self._local, 'depth', 0)
+        tracing = tracemalloc.is_tracing()
+        if tracing and depth == 0:
+            # Nested stages see the peak since the outermost stage started
+            tracemalloc.reset_peak()
+        self._local.depth = depth + 1
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield recorder
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            self._local.depth = depth
+            self.record(name, labels, wall_seconds, cpu_seconds, recorder.rows,
+                        tracemalloc.get_traced_memory()[1] if tracing else None)
+
+    def instrumented(self, name: str = None, rows: Callable = None, **labels):
+        """
+        Decorator that records every call of a function as a run of a stage
+
+        :param name: The stage name. Defaults to module.function
+        :param rows: Function that gets the number of rows out of the return value, ie. len
+        :param labels: Labels added to every run
+        """
+        def decorator(function: Callable):
+            stage_name = name or f'{function.__module__}.{function.__qualname__}'
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name, **labels) as recorder:
+                    result = function(*args, **kwargs)
+                    if rows is not None:
+                        recorder.add_rows(rows(result))
+                    return result
+            return wrapper
+        return decorator
+
+    def instrumented_rows(self, name: str, rows: Iterable, **labels) -> Iterator:
+        """
+        Generator function that passes rows through while recording the time spent producing them as a stage
+
+        Only the wall time spent inside the iterable counts, not the time the consumer spends on each row, so a
+        parser feeding a database writer is measured separately from the writer. The CPU time is taken from start to
+        end and so includes the consumer.
+
+        :param name: The stage name, ie. parse
+        :param rows: The iterable, ie. iter_primary(source)
+        :param labels: Labels telling runs of the stage apart
+        :returns: The rows of the iterable
+        """
+        if not self.enabled:
+            yield from rows
+            return
+        iterator = iter(rows)
+        wall_seconds = 0.0
+        count = 0
+        perf_counter = time.perf_counter
+        # Reading the CPU clock is a syscall, too slow to do twice a row, so the CPU time includes the consumer
+        cpu_start = time.process_time()
+        try:
+            while True:
+                wall_start = perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    wall_seconds += perf_counter() - wall_start
+                count += 1
+                yield row
+        finally:
+            self.record(name, labels, wall_seconds, time.process_time() - cpu_start, count)
+
+    def reset(self):
+        """Forget everything that was recorded"""
+        with self._lock:
+            self.stages.clear()
+
+    def snapshot(self) -> list:
+        """
+        Get everything that was recorded in a form that can be pickled or turned into JSON
+
+        :returns: List of {stage, labels, calls, wall_seconds, ...} dictionaries
+        """
+        with self._lock:
+            return [{'stage': name, 'labels': dict(labels), **asdict(stats)}
+                    for (name, labels), stats in sorted(self.stages.items())]
+
+    def merge(self, snapshot: list):
+        """
+        Add the stages of a snapshot, ie. one taken in a worker process
+
+        :param snapshot: Output of snapshot()
+        """
+        for entry in snapshot:
+            entry = dict(entry)
+            key = (entry.pop('stage'), _labels_key(entry.pop('labels')))
+            stats = StageStats(**entry)
+            with self._lock:
+                if key in self.stages:
+                    self.stages[key].merge(stats)
+                else:
+                    self.stages[key] = stats
+
+    def to_json(self, **kwargs) -> str:
+        """
+        Export the stages as JSON
+
+        :param kwargs: Passed to json.dumps(), ie. indent=2
+        :returns: JSON list of stages, same layout as snapshot()
+        """
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self) -> str:
+        """
+        Export the stages in the Prometheus text exposition format
+
+        :returns: The metrics, one family per StageStats field
+        """
+        metrics = [
+            ('calls_total', 'counter', 'Number of times the stage ran', 'calls'),
+            ('wall_seconds_total', 'counter', 'Wall time spent in the stage', 'wall_seconds'),
+            ('cpu_seconds_total', 'counter', 'CPU time spent in the stage', 'cpu_seconds'),
+            ('rows_total', 'counter', 'Rows handled by the stage', 'rows'),
+            ('peak_rss_bytes', 'gauge', 'Maximum RSS of the process when the stage ended', 'peak_rss_bytes'),
+            ('peak_traced_bytes', 'gauge', 'Peak memory allocated by Python during the stage', 'peak_traced_bytes')
+        ]
+        snapshot = self.snapshot()
+        lines = []
+        for suffix, metric_type, description, field_name in metrics:
+            lines.append(f'# HELP {METRIC_PREFIX}_{suffix} {description}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{suffix} {metric_type}')
+            for entry in snapshot:
+                if entry[field_name] is None:
+                    continue
+                labels = {'stage': entry['stage'], **entry['labels']}
+                label_text = ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels.items())
+                lines.append(f'{METRIC_PREFIX}_{suffix}{{{label_text}}} {entry[field_name]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename: str):
+        """
+        Write the stages to a file, in the Prometheus format if it ends with .prom and as JSON otherwise
+
+        :param filename: The file to write
+        """
+        with open(filename, 'w', encoding='utf8') as output:
+            output.write(self.to_prometheus() if filename.endswith('.prom') else self.to_json(indent=2))
+
+    def log_summary(self, level: int = logging.INFO):
+        """Log one line per stage, slowest first"""
+        for entry in sorted(self.snapshot(), key=lambda entry: entry['wall_seconds'], reverse=True):
+            labels = ''.join(f' {name}={value}' for name, value in entry['labels'].items())
+            logger.log(level, f'{entry["stage"]}{labels}: {entry["calls"]} calls, {entry["wall_seconds"]:.2f}s wall, '
+                              f'{entry["cpu_seconds"]:.2f}s CPU, {entry["rows"]} rows, '
+                              f'max RSS {entry["peak_rss_bytes"] / 1024 / 1024:.0f} MiB')
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def count_rows(parsed) -> int:
+    """
+    Count the rows of parsed data, for instrumented(rows=count_rows)
+
+    :param parsed: Dictionary of {table_name: list of rows}, or a list of rows
+    :returns: The number of rows
+    """
+    if isinstance(parsed, dict):
+        return sum(len(rows) if isinstance(rows, list) else 1 for rows in parsed.values())
+    return len(parsed)
+
+
+# The instrumentation everything records into
+INSTRUMENTATION = Instrumentation()
+
+stage = INSTRUMENTATION.stage
+instrumented = INSTRUMENTATION.instrumented
+instrumented_rows = INSTRUMENTATION.instrumented_rows
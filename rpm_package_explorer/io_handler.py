@@ -1,6 +1,19 @@
 # read 128 kB
+import hashlib
 import io
-from typing import Union
+import os
+from typing import Callable, List, Union
+
+from .exceptions import ChecksumMismatchException, UnsupportedChecksumException
+from .utils import open_compressed_stream, sniff_codec
+
+# Checksum types used by repomd.xml and fullfiletimelist, to the hashlib name. Old createrepo calls sha1 "sha"
+HASH_TYPES = {
+    'sha': 'sha1',
+    'sha1': 'sha1',
+    'sha256': 'sha256',
+    'sha512': 'sha512'
+}
 
 
 # Use more memory-efficient buffered read method
@@ -17,3 +30,143 @@ def read_data(file_object: Union[io.FileIO, io.BytesIO], read_size=128*1024):
         if not data:
             break
         yield data
+
+
+def new_hash(hash_type: str):
+    """
+    Create the hashlib object of a checksum type
+
+    :param hash_type: The checksum type as written in repomd.xml, ie. sha256
+    :returns: The hashlib object
+    """
+    if hash_type.lower() not in HASH_TYPES:
+        raise UnsupportedChecksumException(hash_type, list(HASH_TYPES))
+    return hashlib.new(HASH_TYPES[hash_type.lower()])
+
+
+class HashingReader(object):
+    """
+    Read-only file object that hashes everything read through it, so checking a checksum takes no extra pass
+
+    Usually used as a tee under a decompressor: HashingReader(open(filename, 'rb'), 'sha256') hashes the compressed
+    data as the decompressor pulls it in.
+    """
+
+    def __init__(self, file_object, hash_type: str = None, expected: str = None, name: str = None,
+                 on_eof: Callable = None, also_close: List = None) -> None:
+        """
+        :param file_object: The binary file object to read from
+        :param hash_type: The checksum type, ie. sha256. Nothing is hashed if not provided
+        :param expected: The checksum that verify() checks against
+        :param name: The name used in errors, such as the file name
+        :param on_eof: Function called once the end of the data has been read
+        :param also_close: Other file objects to close along with this one, ie. the file under a decompressor
+        """
+        self._file = file_object
+        self._hash = new_hash(hash_type) if hash_type else None
+        self.hash_type = hash_type
+        self.expected = expected
+        self.name = name
+        self._on_eof = on_eof
+        self._also_close = also_close or []
+
+    def read(self, size=-1) -> bytes:
+        data = self._file.read(size)
+        if self._hash is not None:
+            self._hash.update(data)
+        if not data and size != 0 and self._on_eof is not None:
+            on_eof, self._on_eof = self._on_eof, None
+            on_eof()
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def drain(self):
+        """Read whatever is left, so the checksum covers the whole file"""
+        for _ in read_data(self):
+            pass
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest() if self._hash is not None else None
+
+    def verify(self):
+        """
+        Check the checksum of what was read against the expected checksum, if there is one
+
+        :raises ChecksumMismatchException: If they don't match
+        """
+        if self._hash is None or self.expected is None:
+            return
+        if self.hexdigest() != self.expected.lower():
+            raise ChecksumMismatchException(self.name, self.hash_type, self.expected, self.hexdigest())
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            for file_object in self._also_close:
+                file_object.close()
+
+    def __enter__(self) -> 'HashingReader':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def open_verified(filename: str, checksum_type: str = None, checksum: str = None, open_checksum_type: str = None,
+                  open_checksum: str = None):
+    """
+    Open a file for reading, decompressing it if it's compressed, and verify its checksums while it's being read
+
+    Both the checksum of the file itself and the checksum of the decompressed data (the open checksum in repomd.xml)
+    are computed in the same read that decompresses it. They are checked once all the data has been read: the read
+    that reaches the end raises ChecksumMismatchException if either doesn't match. Nothing is checked if the data
+    isn't read to the end.
+
+    :param filename: The file name
+    :param checksum_type: The checksum type of the file, ie. sha256
+    :param checksum: The checksum of the file
+    :param open_checksum_type: The checksum type of the decompressed data
+    :param open_checksum: The checksum of the decompressed data
+    :returns: Binary file object of the decompressed data
+    """
+    raw = HashingReader(open(filename, 'rb'), checksum_type, checksum, filename)
+    codec = sniff_codec(filename)
+    if codec is None:
+        stream = raw
+    else:
+        stream = open_compressed_stream(raw, codec, os.path.getsize(filename))
+
+    def verify():
+        # The decompressor may stop short of the end of the file, ie. trailing padding
+        raw.drain()
+        raw.verify()
+        opened.verify()
+
+    opened = HashingReader(stream, open_checksum_type if open_checksum else None, open_checksum,
+                           f'{filename} (decompressed)', verify, [raw] if stream is not raw else None)
+    return opened
+
+
+def hash_file(filename: str, hash_type: str):
+    """
+    Compute the checksum of a file as it is, without decompressing it
+
+    :param filename: The file name
+    :param hash_type: The checksum type, ie. sha256
+    :returns: The checksum as a hex string
+    """
+    with HashingReader(open(filename, 'rb'), hash_type) as reader:
+        reader.drain()
+        return reader.hexdigest()
@@ -0,0 +1,102 @@
+"""
+Package lookups against the explorer database
+
+Only the columns needed to list a package are read, and every lookup goes through a QueryCache when one is given.
+PackageLookup.views() wraps the results in PackageView, which fetches the file list and changelog only when read.
+"""
+import logging
+from typing import Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.utils import DB_TABLE
+from .evr import latest_by_name, sort_evr
+from .package_view import DatabaseDetails, DetailSource, PackageView, package_views
+from .query_cache import QueryCache
+
+# Columns of the packages table returned by the lookups
+PACKAGE_COLUMNS = ['pkgId', 'name', 'arch', 'epoch', 'version', 'release', 'summary', 'location_href', 'repo_name']
+
+logger = logging.getLogger(__name__)
+
+
+def _repo_tuple(repo_names: Iterable[str] = None):
+    """Turn a list of repositories into something hashable and order-independent for the cache key"""
+    return tuple(sorted(set(repo_names))) if repo_names is not None else None
+
+
+def find_packages(engine: Engine, name: str, repo_names: Iterable[str] = None, arch: str = None) -> List[dict]:
+    """
+    Find every version of a package
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param name: The package name
+    :param repo_names: Only look in these repositories. Looks in every repository if not provided
+    :param arch: Only find packages of this architecture
+    :returns: A list of dictionaries of PACKAGE_COLUMNS, newest first
+    """
+    packages = DB_TABLE['packages']
+    repo_package = DB_TABLE['repo_package']
+    # A package in several repositories is stored once, so it's returned once per repository through repo_package
+    query = select(*(repo_package.c[column] if column == 'repo_name' else packages.c[column]
+                     for column in PACKAGE_COLUMNS)) \
+        .select_from(packages.join(repo_package, repo_package.c.pkgId == packages.c.pkgId)) \
+        .where(packages.c.name == name)
+    if repo_names is not None:
+        query = query.where(repo_package.c.repo_name.in_(list(repo_names)))
+    if arch is not None:
+        query = query.where(packages.c.arch == arch)
+    with engine.connect() as connection:
+        rows = [dict(row) for row in connection.execute(query).mappings()]
+    return sort_evr(rows, reverse=True)
+
+
+def latest_packages(engine: Engine, name: str, repo_names: Iterable[str] = None, arch: str = None) -> List[dict]:
+    """
+    Find the newest version of a package for each architecture, ie. the latest kernel of a release
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param name: The package name
+    :param repo_names: Only look in these repositories. Looks in every repository if not provided
+    :param arch: Only find packages of this architecture
+    :returns: A list of dictionaries of PACKAGE_COLUMNS, one per architecture, sorted by architecture
+    """
+    newest = latest_by_name(find_packages(engine, name, repo_names, arch), lambda row: row['arch'])
+    return [newest[arch] for arch in sorted(newest)]
+
+
+class PackageLookup(object):
+    """Package lookups that are cached until the repositories they cover are refreshed"""
+
+    def __init__(self, engine: Engine, cache: QueryCache = None, details: DetailSource = None) -> None:
+        """
+        :param engine: The SQLAlchemy engine of the explorer database
+        :param cache: The cache to use. Defaults to an in-memory QueryCache
+        :param details: Where views() fetch file lists and changelogs from. Defaults to the same database
+        """
+        self.engine = engine
+        self.cache = cache if cache is not None else QueryCache(engine)
+        self.details = details if details is not None else DatabaseDetails(engine)
+
+    def packages(self, name: str, repo_names: Iterable[str] = None, arch: str = None) -> List[dict]:
+        """
+        Same as find_packages(), cached. Don't modify the result
+        """
+        repo_names = _repo_tuple(repo_names)
+        return self.cache.cached(('packages', name, repo_names, arch),
+                                 lambda: find_packages(self.engine, name, repo_names, arch), repo_names)
+
+    def latest(self, name: str, repo_names: Iterable[str] = None, arch: str = None) -> List[dict]:
+        """
+        Same as latest_packages(), cached. Don't modify the result
+        """
+        repo_names = _repo_tuple(repo_names)
+        return self.cache.cached(('latest', name, repo_names, arch),
+                                 lambda: latest_packages(self.engine, name, repo_names, arch), repo_names)
+
+    def views(self, name: str, repo_names: Iterable[str] = None, arch: str = None) -> List[PackageView]:
+        """
+        Same as packages(), as views that fetch the file list and changelog of a package when they're read
+        """
+        return package_views(self.packages(name, repo_names, arch), self.details)
@@ -0,0 +1,172 @@
+"""
+Package views that load the heavy parts of a package only when they're read
+
+A package's primary metadata is small and is what listing pages show, while its file list and changelog are large
+(other.xml is mostly changelogs) and only ever read on a detail page. A PackageView holds the primary metadata from
+the start and fetches the file list and changelog by pkgId the first time they're read, from a DetailSource:
+
+    view = PackageView.from_database(engine, pkg_id)
+    view.name          # already loaded
+    view.changelogs    # queried now, then kept
+
+DatabaseDetails reads them from the explorer database. Anything else that can look rows up by pkgId, ie. an index
+into the decompressed XML, can be used by implementing both methods of DetailSource.
+"""
+import abc
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.utils import DB_TABLE
+
+# Columns of a filelist row returned by the views, pkgId is left out since every row has the view's pkgId
+FILE_COLUMNS = ['filename', 'filetype']
+# Columns of a changelog row returned by the views
+CHANGELOG_COLUMNS = ['author', 'date', 'changelog']
+
+logger = logging.getLogger(__name__)
+
+
+class DetailSource(abc.ABC):
+    """Where a PackageView fetches its file list and changelog from"""
+
+    @abc.abstractmethod
+    def files(self, pkg_id: str) -> List[dict]:
+        """
+        :param pkg_id: The pkgId of the package
+        :returns: List of dictionaries of FILE_COLUMNS, sorted by filename
+        """
+
+    @abc.abstractmethod
+    def changelogs(self, pkg_id: str) -> List[dict]:
+        """
+        :param pkg_id: The pkgId of the package
+        :returns: List of dictionaries of CHANGELOG_COLUMNS, newest first
+        """
+
+
+class DatabaseDetails(DetailSource):
+    """Fetches file lists and changelogs from the filelist and changelog tables of the explorer database"""
+
+    def __init__(self, engine: Engine) -> None:
+        """
+        :param engine: The SQLAlchemy engine of the explorer database
+        """
+        self.engine = engine
+
+    def _query(self, query) -> List[dict]:
+        with self.engine.connect() as connection:
+            return [dict(row) for row in connection.execute(query).mappings()]
+
+    def files(self, pkg_id: str) -> List[dict]:
+        table = DB_TABLE['filelist']
+        return self._query(select(*(table.c[column] for column in FILE_COLUMNS))
+                           .where(table.c.pkgId == pkg_id).order_by(table.c.filename))
+
+    def changelogs(self, pkg_id: str) -> List[dict]:
+        table = DB_TABLE['changelog']
+        return self._query(select(*(table.c[column] for column in CHANGELOG_COLUMNS))
+                           .where(table.c.pkgId == pkg_id).order_by(table.c.date.desc()))
+
+
+class PackageView(object):
+    """
+    A package whose primary metadata is loaded and whose file list and changelog are fetched when first read
+
+    Columns of the package row are read as attributes, ie. view.name or view.location_href.
+    """
+    __slots__ = ['row', 'details', '_files', '_changelogs']
+
+    def __init__(self, row: dict, details: DetailSource) -> None:
+        """
+        :param row: The packages row, it must have a pkgId
+        :param details: Where to fetch the file list and changelog from
+        """
+        self.row = row
+        self.details = details
+        self._files: Optional[List[dict]] = None
+        self._changelogs: Optional[List[dict]] = None
+
+    def __getattr__(self, name: str):
+        # Only called for names that aren't slots or methods
+        if name.startswith('_') or name in ('row', 'details'):
+            # ie. copy or pickle looking things up before __init__ ran
+            raise AttributeError(name)
+        try:
+            return self.row[name]
+        except KeyError:
+            raise AttributeError(f'{self.__class__.__name__} has no attribute {name}') from None
+
+    @classmethod
+    def from_database(cls, engine: Engine, pkg_id: str, details: DetailSource = None) -> Optional['PackageView']:
+        """
+        Load the full packages row of a package
+
+        :param engine: The SQLAlchemy engine of the explorer database
+        :param pkg_id: The pkgId of the package
+        :param details: Where to fetch the file list and changelog from. Defaults to the same database
+        :returns: The view, or None if there's no such package
+        """
+        packages = DB_TABLE['packages']
+        with engine.connect() as connection:
+            row = connection.execute(select(packages).where(packages.c.pkgId == pkg_id).limit(1)).mappings().first()
+        if row is None:
+            return None
+        return cls(dict(row), details if details is not None else DatabaseDetails(engine))
+
+    @property
+    def pkg_id(self) -> str:
+        return self.row['pkgId']
+
+    @property
+    def files(self) -> List[dict]:
+        """The file list, fetched on first read"""
+        if self._files is None:
+            logger.debug(f'Fetching the file list of {self.pkg_id}')
+            self._files = self.details.files(self.pkg_id)
+        return self._files
+
+    @property
+    def changelogs(self) -> List[dict]:
+        """The changelog entries, newest first, fetched on first read"""
+        if self._changelogs is None:
+            logger.debug(f'Fetching the changelog of {self.pkg_id}')
+            self._changelogs = self.details.changelogs(self.pkg_id)
+        return self._changelogs
+
+    @property
+    def details_loaded(self) -> Dict[str, bool]:
+        """Which of the lazily loaded parts have been fetched so far"""
+        return {'files': self._files is not None, 'changelogs': self._changelogs is not None}
+
+    def unload(self):
+        """Drop the fetched file list and changelog, they're fetched again when next read"""
+        self._files = None
+        self._changelogs = None
+
+    def to_dict(self, details: bool = False) -> dict:
+        """
+        :param details: Include the file list and changelog, fetching them if they haven't been yet
+        :returns: The package row, plus files and changelogs if details is set
+        """
+        data = dict(self.row)
+        if details:
+            data['files'] = self.files
+            data['changelogs'] = self.changelogs
+        return data
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.row.get("name")!r}, pkgId={self.pkg_id!r})'
+
+
+def package_views(rows: Iterable[dict], details: DetailSource) -> List[PackageView]:
+    """
+    Wrap package rows into views sharing one DetailSource, ie. the rows of a listing page
+
+    :param rows: Packages rows, each with a pkgId
+    :param details: Where to fetch the file lists and changelogs from
+    :returns: A list of PackageView, in the same order
+    """
+    return [PackageView(row, details) for row in rows]
@@ -0,0 +1,225 @@
+"""
+Fetch and decompress the metadata of many repositories concurrently, then load them
+
+ingest_repo() goes through the metadata files of a repository one after another: the primary database is
+decompressed, then the filelists one, then the other one, and only then is anything written. The files don't depend
+on each other though, and neither do the repositories, so the Prefetcher runs every step that only needs one file as
+its own task:
+
+    repomd.xml -+- fetch primary_db --- decompress -+
+                +- fetch filelists_db - decompress -+- write the repository (one writer thread)
+                +- fetch updateinfo --- decompress -+
+
+The tasks are driven by asyncio and the blocking work (socket reads, file I/O and the codecs, which release the GIL)
+runs in a thread pool, at most `concurrency` steps at once, so fetching one file overlaps with decompressing another,
+of the same repository or of the next one. A repository is written as soon as all of its files are ready, while the
+others are still being fetched; there's only ever one writer, same as ingest_repos().
+
+Repositories are either local directories or http(s) URLs of the directory that contains repodata/. Files of remote
+repositories are downloaded into the work directory first. Unlike ingest_repo(), XML is decompressed ahead of time as
+well, and its checksums verified, so the writer only parses plain files and repositories that only ship XML get the
+same overlap as the ones with SQLite databases. With an XML index directory the XML is decompressed straight into
+it, along with its offset index, rather than into the work directory.
+
+benchmarks/serve.py serves a directory over HTTP, to try this against a repository that isn't local.
+"""
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
+
+from .db_model.loader import BulkLoader
+from .ingest import INDEXED_XML, SQLITE_DATA_TYPES, XML_ITERATORS, Repo, RepoTiming, changed_metadata, \
+    decompress_metadata, indexed_xml_path, scratch_dir, write_repo_files
+from .instrumentation import stage
+from .io_handler import read_data
+
+# Number of fetch and decompress steps that run at once, and of repositories fetched ahead of the writer
+DEFAULT_CONCURRENCY = 8
+
+# Seconds to wait for an HTTP server before giving up
+HTTP_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+def is_url(path: str) -> bool:
+    """Whether a repository path is an http(s) URL rather than a local directory"""
+    return urllib.parse.urlsplit(path).scheme in ('http', 'https')
+
+
+def fetch_file(url: str, filename: str, timeout: float = HTTP_TIMEOUT):
+    """
+    Download a file
+
+    The file is written under a temporary name and renamed once it's complete, so a failed download never leaves a
+    partial file behind.
+
+    :param url: The URL of the file
+    :param filename: Where to write it
+    :param timeout: Seconds to wait for the server
+    :returns: The file name
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temporary = f'{filename}.part'
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response, open(temporary, 'wb') as output:
+            for data in read_data(response):
+                output.write(data)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, filename)
+    return filename
+
+
+@dataclass
+class PrefetchedRepo(object):
+    """A repository whose metadata files are ready to be written"""
+    repo: Repo
+    repomd_data: dict
+    # {repo_category: file name} in the order to write them, decompressed SQLite databases and XML
+    files: Dict[str, str]
+    timing: RepoTiming
+    # Directory the files were fetched and decompressed into, removed once the repository is written
+    workdir: str
+
+
+class Prefetcher(object):
+    """Fetches and decompresses the metadata files that need loading, running the blocking steps in a thread pool"""
+
+    def __init__(self, loader: BulkLoader, workdir: str, parse_data: list = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, timeout: float = HTTP_TIMEOUT,
+                 xml_index_dir: str = None) -> None:
+        """
+        :param loader: The BulkLoader of the explorer database, used to tell which metadata changed
+        :param workdir: Directory to fetch and decompress into, one subdirectory per repository
+        :param parse_data: The metadata types that may be loaded. Defaults to DEFAULT_PARSE_DATA
+        :param concurrency: Number of steps that run at once
+        :param timeout: Seconds to wait for an HTTP server
+        :param xml_index_dir: Directory to decompress primary, filelists and other XML into along with their offset
+                              indexes, see indexed_xml_path(). They go into workdir if not provided
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        self.loader = loader
+        self.workdir = workdir
+        self.parse_data = parse_data
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.xml_index_dir = xml_index_dir
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='prefetch')
+
+    def close(self):
+        """Wait for the running steps and stop the threads"""
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'Prefetcher':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    async def _run(self, function, *args):
+        """Run a blocking function in the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args))
+
+    def _fetch(self, repo: Repo, href: str, fetched_dir: str, data_type: str):
+        """Get a file of a repository by its path relative to the repository, downloading it if it's remote"""
+        if not is_url(repo.path):
+            return os.path.join(repo.path, href)
+        filename = os.path.normpath(os.path.join(fetched_dir, href))
+        if not filename.startswith(os.path.join(fetched_dir, '')):
+            raise ValueError(f'{repo.name} lists a file outside of the repository: {href}')
+        with stage('fetch', repo=repo.name, data_type=data_type):
+            return fetch_file(f'{repo.path.rstrip("/")}/{href}', filename, self.timeout)
+
+    def _decompress(self, repo: Repo, repo_category: str, data: dict, fetched_dir: str, repo_workdir: str):
+        xml_filename = None
+        if self.xml_index_dir is not None and repo_category in INDEXED_XML:
+            xml_filename = indexed_xml_path(self.xml_index_dir, repo.name, repo_category)
+        with stage('decompress', repo=repo.name, data_type=repo_category):
+            return decompress_metadata(repo.path if not is_url(repo.path) else fetched_dir, data, repo_workdir,
+                                       xml_filename)
+
+    async def _prepare(self, repo: Repo, repo_category: str, data: dict, repo_workdir: str, timing: RepoTiming):
+        """Fetch a metadata file, and decompress it if it's going to be loaded"""
+        start = time.perf_counter()
+        fetched_dir = os.path.join(repo_workdir, 'fetched')
+        filename = await self._run(self._fetch, repo, data['href'], fetched_dir, repo_category)
+        if repo_category in SQLITE_DATA_TYPES or repo_category in XML_ITERATORS:
+            filename = await self._run(self._decompress, repo, repo_category, data, fetched_dir, repo_workdir)
+        timing.parse[repo_category] = time.perf_counter() - start
+        return filename
+
+    async def prefetch(self, repo: Repo) -> PrefetchedRepo:
+        """
+        Read repomd.xml of a repository, then fetch and decompress every metadata file that changed at once
+
+        :param repo: The repository
+        :returns: The PrefetchedRepo, its files are empty if nothing changed
+        """
+        repo_workdir = os.path.join(self.workdir, repo.name)
+        os.makedirs(repo_workdir, exist_ok=True)
+        repomd_filename = await self._run(self._fetch, repo, 'repodata/repomd.xml',
+                                          os.path.join(repo_workdir, 'fetched'), 'repomd')
+        repomd_data, data_types = await self._run(changed_metadata, self.loader, repo, self.parse_data,
+                                                  repomd_filename)
+        timing = RepoTiming()
+        filenames = await asyncio.gather(*(
+            self._prepare(repo, repo_category, repomd_data[repo_category], repo_workdir, timing)
+            for repo_category in data_types))
+        return PrefetchedRepo(repo, repomd_data, dict(zip(data_types, filenames)), timing, repo_workdir)
+
+
+async def _prefetch_and_ingest(prefetcher: Prefetcher, repos: List[Repo]):
+    loop = asyncio.get_running_loop()
+    # Bounds how many repositories sit fetched and decompressed on the disk waiting for the writer
+    ahead = asyncio.Semaphore(prefetcher.concurrency)
+    timings = {}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer') as writer:
+        async def ingest(repo: Repo):
+            async with ahead:
+                prefetched = await prefetcher.prefetch(repo)
+                try:
+                    if not prefetched.files:
+                        logger.info(f'{repo.name} is unchanged')
+                    else:
+                        prefetched.timing.write = await loop.run_in_executor(writer, functools.partial(
+                            write_repo_files, prefetcher.loader, repo.name, prefetched.repomd_data, prefetched.files,
+                            xml_decompressed=True))
+                finally:
+                    shutil.rmtree(prefetched.workdir, ignore_errors=True)
+            timings[repo.name] = prefetched.timing
+
+        await asyncio.gather(*(ingest(repo) for repo in repos))
+    return timings
+
+
+def prefetch_and_ingest(loader: BulkLoader, repos: List[Repo], workdir: str = None, parse_data: list = None,
+                        concurrency: int = DEFAULT_CONCURRENCY, xml_index_dir: str = None):
+    """
+    Load many repositories, local or over HTTP, fetching and decompressing their metadata concurrently
+
+    :param loader: The BulkLoader of the explorer database
+    :param repos: List of Repo to load, their paths being directories or http(s) URLs
+    :param workdir: Directory to fetch and decompress into. Defaults to default_workdir()
+    :param parse_data: The metadata types that may be loaded. Defaults to DEFAULT_PARSE_DATA
+    :param concurrency: Number of fetch and decompress steps that run at once
+    :param xml_index_dir: Directory to keep the decompressed XML and offset indexes in, see indexed_xml_path()
+    :returns: Dictionary of {repo_name: RepoTiming}, where parse is the time to fetch and decompress each file
+    """
+    with scratch_dir(workdir) as workdir, \
+            Prefetcher(loader, workdir, parse_data, concurrency, xml_index_dir=xml_index_dir) as prefetcher:
+        timings = asyncio.run(_prefetch_and_ingest(prefetcher, repos))
+    for repo in repos:
+        logger.info(f'{repo.name}: {timings[repo.name]}')
+    return timings
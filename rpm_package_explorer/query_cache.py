@@ -0,0 +1,225 @@
+"""
+Query result cache
+
+The same lookups (popular package names, the latest kernel of a release) hit the database over and over, while the
+data behind them only changes when a repository is refreshed. Every result is cached along with a fingerprint of the
+repomd.xml checksums of the repositories the query looked at, which is what the refresh_state table keeps for every
+metadata file that was loaded. Once a repository is refreshed its checksums change, so does the fingerprint, and the
+old results are never returned again. No expiry time has to be guessed.
+
+Results are kept in a bounded LRU in memory, and optionally in a SQLite file so they survive restarts and are shared
+between processes.
+"""
+import hashlib
+import logging
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.utils import DB_TABLE
+
+# Number of results kept in memory
+DEFAULT_CACHE_SIZE = 1024
+
+# Number of results kept in the cache file
+DEFAULT_DISK_CACHE_SIZE = 100000
+
+# The cache file is trimmed down to its size every this many writes rather than on every write
+PRUNE_INTERVAL = 100
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(checksums: Iterable[Tuple[str, str, str]]) -> str:
+    """
+    Combine metadata checksums into a single fingerprint. The order doesn't matter
+
+    :param checksums: Iterable of (repo_name, data_type, checksum_hash) tuples
+    :returns: The fingerprint as a hex string
+    """
+    digest = hashlib.sha256()
+    for repo_name, data_type, checksum_hash in sorted(checksums):
+        digest.update(f'{repo_name}\t{data_type}\t{checksum_hash}\n'.encode('utf8'))
+    return digest.hexdigest()
+
+
+def repomd_checksums(repo_name: str, repomd_data: dict, data_types: Iterable[str] = None):
+    """
+    Get the checksums of a repomd.xml as fingerprint() takes them
+
+    :param repo_name: The repository name
+    :param repomd_data: Parsed repomd.xml data from parse_repomd()
+    :param data_types: Only use these metadata types, ie. the ones that were loaded. Uses every type if not provided
+    :returns: List of (repo_name, data_type, checksum_hash) tuples
+    """
+    if data_types is None:
+        data_types = repomd_data.keys()
+    return [(repo_name, data_type, repomd_data[data_type]['checksum_hash']) for data_type in data_types]
+
+
+def database_checksums(engine: Engine, repo_names: Iterable[str] = None):
+    """
+    Get the checksums of the metadata that was last loaded into the explorer database as fingerprint() takes them
+
+    :param engine: The SQLAlchemy engine of the explorer database
+    :param repo_names: Only get the checksums of these repositories. Gets every repository if not provided
+    :returns: List of (repo_name, data_type, checksum_hash) tuples
+    """
+    table = DB_TABLE['refresh_state']
+    query = select(table.c.repo_name, table.c.data_type, table.c.checksum_hash)
+    if repo_names is not None:
+        query = query.where(table.c.repo_name.in_(list(repo_names)))
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(query)]
+
+
+class QueryCache(object):
+    """LRU cache of query results that goes stale by itself whenever a repository it covers is refreshed"""
+
+    def __init__(self, engine: Engine, max_entries: int = DEFAULT_CACHE_SIZE, filename: str = None,
+                 max_disk_entries: int = DEFAULT_DISK_CACHE_SIZE) -> None:
+        """
+        :param engine: The SQLAlchemy engine of the explorer database, to read the repository checksums from
+        :param max_entries: Number of results kept in memory
+        :param filename: SQLite file to also keep results in. Results are only kept in memory if not provided
+        :param max_disk_entries: Number of results kept in the file
+        """
+        self.engine = engine
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # {(query, fingerprint): result}, least recently used first
+        self._entries = OrderedDict()
+        self._disk = None
+        self._disk_writes = 0
+        if filename is not None:
+            self._disk = sqlite3.connect(filename)
+            self._disk.execute('CREATE TABLE IF NOT EXISTS query_cache (query_key TEXT NOT NULL, '
+                               'fingerprint TEXT NOT NULL, result BLOB NOT NULL, stored REAL NOT NULL, '
+                               'PRIMARY KEY (query_key, fingerprint))')
+            self._disk.execute('CREATE INDEX IF NOT EXISTS query_cache_stored ON query_cache (stored)')
+            self._disk.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def fingerprint(self, repo_names: Iterable[str] = None) -> str:
+        """
+        Get the current fingerprint of some repositories
+
+        :param repo_names: The repositories. Covers every repository if not provided
+        :returns: The fingerprint as a hex string
+        """
+        return fingerprint(database_checksums(self.engine, repo_names))
+
+    @staticmethod
+    def _query_key(query: tuple) -> str:
+        # Queries are tuples of strings, numbers and None, so their repr is stable between processes
+        return hashlib.sha256(repr(query).encode('utf8')).hexdigest()
+
+    def get(self, query: tuple, fingerprint: str) -> Tuple[bool, object]:
+        """
+        Look up a result
+
+        :param query: What identifies the query, ie. ('latest', 'kernel', ('rocky8-baseos',), None)
+        :param fingerprint: The fingerprint of the repositories the query covers
+        :returns: (True, result) if there's a cached result, (False, None) otherwise
+        """
+        key = (query, fingerprint)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+        if self._disk is not None:
+            row = self._disk.execute('SELECT result FROM query_cache WHERE query_key = ? AND fingerprint = ?',
+                                     (self._query_key(query), fingerprint)).fetchone()
+            if row is not None:
+                result = pickle.loads(row[0])
+                self._remember(key, result)
+                self.disk_hits += 1
+                return True, result
+        self.misses += 1
+        return False, None
+
+    def put(self, query: tuple, fingerprint: str, result):
+        """
+        Store a result
+
+        :param query: What identifies the query
+        :param fingerprint: The fingerprint of the repositories the query covers
+        :param result: The result, anything that can be pickled
+        """
+        self._remember((query, fingerprint), result)
+        if self._disk is None:
+            return
+        query_key = self._query_key(query)
+        with self._disk:
+            # Results of older fingerprints can't be hit anymore, the repositories only ever move forward
+            self._disk.execute('DELETE FROM query_cache WHERE query_key = ? AND fingerprint != ?',
+                               (query_key, fingerprint))
+            self._disk.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)',
+                               (query_key, fingerprint, pickle.dumps(result, pickle.HIGHEST_PROTOCOL), time.time()))
+        self._disk_writes += 1
+        if self._disk_writes % PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def _remember(self, key: tuple, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def cached(self, query: tuple, compute: Callable, repo_names: Iterable[str] = None,
+               fingerprint: Optional[str] = None):
+        """
+        Get the result of a query from the cache, or run it and cache the result
+
+        Results are shared with the cache, so don't modify them.
+
+        :param query: What identifies the query, every argument that changes the result should be in it
+        :param compute: Function without arguments that runs the query
+        :param repo_names: The repositories the query covers. Covers every repository if not provided
+        :param fingerprint: The fingerprint of those repositories if it's already known, ie. from repomd_checksums()
+        :returns: The result
+        """
+        if fingerprint is None:
+            fingerprint = self.fingerprint(repo_names)
+        found, result = self.get(query, fingerprint)
+        if not found:
+            result = compute()
+            self.put(query, fingerprint, result)
+        return result
+
+    def prune(self):
+        """Trim the cache file down to max_disk_entries, dropping the oldest results first"""
+        if self._disk is None:
+            return
+        with self._disk:
+            self._disk.execute('DELETE FROM query_cache WHERE rowid IN (SELECT rowid FROM query_cache '
+                               'ORDER BY stored DESC LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+
+    def clear(self):
+        """Drop every cached result, in memory and in the file"""
+        self._entries.clear()
+        if self._disk is not None:
+            with self._disk:
+                self._disk.execute('DELETE FROM query_cache')
+
+    def close(self):
+        """Close the cache file"""
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def __enter__(self) -> 'QueryCache':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
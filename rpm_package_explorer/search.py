@@ -0,0 +1,349 @@
+"""
+Package search index over name, summary and description
+
+Answers "which packages are called something like pyhton-reqests" and "which packages mention websocket" across
+every indexed repository without going through the packages table.
+
+Two inverted indexes are kept:
+- name trigrams: every distinct package name is broken into the three character runs it contains. A substring
+  query only checks the names that contain every trigram of the query, and a misspelled query only compares against
+  the names sharing enough trigrams with it.
+- words: the words of the name, summary and description, each mapping to the packages that use it along with the
+  fields it was seen in.
+
+Ranking favours the name: an exact name match comes first, then names starting with the query, names containing
+it, names close to it, and finally packages whose summary or description has every word of the query. Packages
+with the same score are sorted by name, then newest EVR first.
+
+The index can be saved to disk and loaded back, so it's built once at ingest time.
+"""
+import heapq
+import logging
+import pickle
+import re
+from array import array
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .db_model.loader import row_to_dict
+from .db_model.utils import DB_TABLE
+from .evr import evr_key
+
+# Bumped whenever the saved index layout changes
+INDEX_FORMAT_VERSION = 1
+
+# Scores of each kind of name match. Shorter names get a little more, so python3 comes before python3-devel
+EXACT_SCORE = 1000
+PREFIX_SCORE = 500
+SUBSTRING_SCORE = 300
+# Multiplied by how similar the name is, between FUZZY_CUTOFF and 1
+FUZZY_SCORE = 200
+
+# Weight of a query word found in each field, added up over the words of the query
+NAME_WEIGHT = 8
+SUMMARY_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+# How similar a name has to be to count as a fuzzy match, as difflib ratio
+FUZZY_CUTOFF = 0.7
+# Names compared in full for fuzzy matches, the ones sharing the most trigrams with the query
+FUZZY_CANDIDATES = 200
+
+# Bit of each field in the word postings
+_NAME = 4
+_SUMMARY = 2
+_DESCRIPTION = 1
+_FIELD_WEIGHTS = {mask: (NAME_WEIGHT if mask & _NAME else 0) + (SUMMARY_WEIGHT if mask & _SUMMARY else 0)
+                  + (DESCRIPTION_WEIGHT if mask & _DESCRIPTION else 0) for mask in range(8)}
+# Names are also broken into trigrams with these around them, so the start and end of a name count for fuzzy matches
+_PAD_START = '\x02'
+_PAD_END = '\x03'
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+logger = logging.getLogger(__name__)
+
+
+class SearchResult(NamedTuple):
+    """A package matching a search"""
+    score: float
+    pkg_id: str
+    name: str
+    arch: str
+    epoch: int
+    version: str
+    release: str
+    repo_name: Optional[str]
+    summary: str
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Split text into lowercase words, ie. 'Python HTTP for Humans.' into ['python', 'http', 'for', 'humans']
+
+    :param text: The text
+    :returns: A list of words, empty if there's no text
+    """
+    return _WORD.findall(text.lower()) if text else []
+
+
+def trigrams(text: str) -> set:
+    """
+    Get the three character runs of a string, ie. {'pyt', 'yth', 'tho', 'hon'} for python
+
+    :param text: The string
+    :returns: A set of trigrams, empty if the string is shorter than three characters
+    """
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+
+def _name_trigrams(name: str) -> set:
+    return trigrams(name) | trigrams(_PAD_START + name + _PAD_END)
+
+
+class SearchIndex(object):
+    """Inverted index of package names, summaries and descriptions"""
+
+    def __init__(self) -> None:
+        # (pkgId, name, arch, epoch, version, release, repo_name, summary) of each package, by package number
+        self._packages = []
+        # Distinct lowercase names, by name number, with the package numbers of each
+        self._names = []
+        self._name_numbers = {}
+        self._name_packages = []
+        # {trigram: array of name numbers}
+        self._trigrams = {}
+        # {word: (array of package numbers, array of field bits)}, package numbers ascending
+        self._words = {}
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def add_package(self, row, repo_name: str = None):
+        """
+        Add a package to the index
+
+        :param row: Database model object or dictionary containing a packages row
+        :param repo_name: The repository the package is from. Uses the repo_name of the row if not provided
+        """
+        data = row_to_dict(row)
+        number = len(self._packages)
+        self._packages.append((data['pkgId'], data['name'], data['arch'], data['epoch'], data['version'],
+                               data['release'], repo_name or data.get('repo_name'), data['summary']))
+
+        name = data['name'].lower()
+        name_number = self._name_numbers.get(name)
+        if name_number is None:
+            name_number = self._name_numbers[name] = len(self._names)
+            self._names.append(name)
+            self._name_packages.append([])
+            for trigram in _name_trigrams(name):
+                self._trigrams.setdefault(trigram, array('I')).append(name_number)
+        self._name_packages[name_number].append(number)
+
+        fields = {}
+        for mask, text in ((_NAME, data['name']), (_SUMMARY, data['summary']), (_DESCRIPTION, data['description'])):
+            for word in tokenize(text):
+                fields[word] = fields.get(word, 0) | mask
+        for word, mask in fields.items():
+            postings = self._words.get(word)
+            if postings is None:
+                postings = self._words[word] = (array('I'), array('B'))
+            postings[0].append(number)
+            postings[1].append(mask)
+
+    def add(self, table_name: str, row, repo_name: str = None):
+        """
+        Add a packages row
+
+        :param table_name: The table name as used in DB_MODEL. Rows of other tables are ignored
+        :param row: Database model object or dictionary containing the row data
+        :param repo_name: The repository the package is from
+        """
+        if table_name == 'packages':
+            self.add_package(row, repo_name)
+
+    def add_all(self, rows: Iterable[Tuple[str, object]], repo_name: str = None):
+        """
+        Add the packages rows from an iterable of (table_name, row) tuples, such as the output of
+        xmlparser.iter_primary()
+
+        :param rows: Iterable of (table_name, row) tuples
+        :param repo_name: The repository the packages are from
+        """
+        for table_name, row in rows:
+            self.add(table_name, row, repo_name)
+
+    def _names_containing(self, query: str) -> List[int]:
+        """Find the name numbers of the names that contain query"""
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            # Too short for trigrams, there aren't that many distinct names anyway
+            return [number for number, name in enumerate(self._names) if query in name]
+        postings = sorted((self._trigrams.get(trigram, ()) for trigram in query_trigrams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return [number for number in candidates if query in self._names[number]]
+
+    def _similar_names(self, query: str) -> Dict[int, float]:
+        """Find the names close to query, ie. with a typo. Returns {name number: similarity}"""
+        query_trigrams = _name_trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        # Names that share less than a third of the trigrams of the query can't be close enough
+        minimum = len(query_trigrams) / 3
+        similar = {}
+        matcher = SequenceMatcher(None, b='')
+        matcher.set_seq2(query)
+        for number, count in shared.most_common(FUZZY_CANDIDATES):
+            if count < minimum:
+                break
+            matcher.set_seq1(self._names[number])
+            if matcher.real_quick_ratio() < FUZZY_CUTOFF or matcher.quick_ratio() < FUZZY_CUTOFF:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= FUZZY_CUTOFF:
+                similar[number] = ratio
+        return similar
+
+    def _match_words(self, words: List[str]) -> Dict[int, int]:
+        """Find the packages that have every word. Returns {package number: weight}"""
+        postings = []
+        for word in set(words):
+            posting = self._words.get(word)
+            if posting is None:
+                return {}
+            postings.append(posting)
+        if not postings:
+            return {}
+        postings.sort(key=lambda posting: len(posting[0]))
+        numbers, masks = postings[0]
+        weights = {number: _FIELD_WEIGHTS[mask] for number, mask in zip(numbers, masks)}
+        for numbers, masks in postings[1:]:
+            matched = {}
+            for number, mask in zip(numbers, masks):
+                weight = weights.get(number)
+                if weight is not None:
+                    matched[number] = weight + _FIELD_WEIGHTS[mask]
+            weights = matched
+            if not weights:
+                break
+        return weights
+
+    def search(self, query: str, limit: Optional[int] = 20, fuzzy: bool = True,
+               repo_names: Iterable[str] = None) -> List[SearchResult]:
+        """
+        Search packages by name, summary and description, ie. search('requests') or search('pyhton-reqests')
+
+        :param query: What to look for. A name or part of one, or words from the summary or description
+        :param limit: The maximum number of results. Returns every match if None
+        :param fuzzy: Whether to also look for names close to the query, for typos
+        :param repo_names: Only return packages of these repositories. Searches every repository if not provided
+        :returns: A list of SearchResult, best match first
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        name_scores = {}
+        for number in self._names_containing(query):
+            name = self._names[number]
+            if name == query:
+                score = EXACT_SCORE
+            elif name.startswith(query):
+                score = PREFIX_SCORE
+            else:
+                score = SUBSTRING_SCORE
+            name_scores[number] = score - (len(name) - len(query)) / len(name)
+        if fuzzy:
+            for number, ratio in self._similar_names(query).items():
+                name_scores.setdefault(number, FUZZY_SCORE * ratio)
+
+        scores = self._match_words(tokenize(query))
+        for number, score in name_scores.items():
+            for package_number in self._name_packages[number]:
+                scores[package_number] = scores.get(package_number, 0) + score
+
+        if repo_names is not None:
+            repo_names = set(repo_names)
+            scores = {number: score for number, score in scores.items() if self._packages[number][6] in repo_names}
+        if limit is not None and len(scores) > limit:
+            # Only the best few get sorted, along with everything tied with the last of them since the name and EVR
+            # decide between those
+            cutoff = heapq.nlargest(limit, scores.values())[-1]
+            scores = {number: score for number, score in scores.items() if score >= cutoff}
+        results = [SearchResult(score, *self._packages[number]) for number, score in scores.items()]
+        # Newest first, then by score and name; each sort keeps the order of the one before for ties
+        results.sort(key=lambda result: evr_key(result.epoch, result.version, result.release), reverse=True)
+        results.sort(key=lambda result: (-result.score, result.name))
+        return results[:limit] if limit is not None else results
+
+    def save(self, filename: str):
+        """
+        Save the index to a file
+
+        :param filename: The file to write
+        """
+        with open(filename, 'wb') as index_file:
+            pickle.dump((INDEX_FORMAT_VERSION, self._packages, self._names, self._name_packages, self._trigrams,
+                         self._words), index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename: str) -> 'SearchIndex':
+        """
+        Load an index saved with save(). The file is unpickled, so only load files this project wrote
+
+        :param filename: The file to read
+        :returns: The SearchIndex
+        """
+        with open(filename, 'rb') as index_file:
+            data = pickle.load(index_file)
+        if data[0] != INDEX_FORMAT_VERSION:
+            raise ValueError(f'Search index format {data[0]} is unsupported, rebuild the index')
+        index = cls()
+        _, index._packages, index._names, index._name_packages, index._trigrams, index._words = data
+        index._name_numbers = {name: number for number, name in enumerate(index._names)}
+        return index
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, object]], repo_name: str = None) -> 'SearchIndex':
+        """
+        Build an index out of parsed rows, such as the output of xmlparser.iter_primary()
+
+        :param rows: Iterable of (table_name, row) tuples
+        :param repo_name: The repository the packages are from
+        :returns: The SearchIndex
+        """
+        index = cls()
+        index.add_all(rows, repo_name)
+        return index
+
+    @classmethod
+    def from_database(cls, engine: Engine, repo_name: str = None) -> 'SearchIndex':
+        """
+        Build an index out of the packages table of the explorer database
+
+        :param engine: The SQLAlchemy engine of the explorer database
+        :param repo_name: Only index the packages of this repository. Indexes every package if not provided
+        :returns: The SearchIndex
+        """
+        index = cls()
+        packages = DB_TABLE['packages']
+        repo_package = DB_TABLE['repo_package']
+        query = select(packages.c.pkgId, packages.c.name, packages.c.arch, packages.c.epoch, packages.c.version,
+                       packages.c.release, packages.c.summary, packages.c.description, repo_package.c.repo_name) \
+            .select_from(packages.join(repo_package, repo_package.c.pkgId == packages.c.pkgId))
+        if repo_name is not None:
+            query = query.where(repo_package.c.repo_name == repo_name)
+        with engine.connect() as connection:
+            for row in connection.execute(query).mappings():
+                index.add_package(dict(row))
+        logger.info(f'Indexed {len(index)} packages for search')
+        return index
@@ -1,14 +1,226 @@
 import bz2
 import gzip
+import io
+import logging
 import lzma
+import os
+import shutil
 import sqlite3
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+# Decompress files at least this big with an external decompressor when one is installed. It runs in its own process
+# (pigz, lbzip2 and xz -T0 even use several threads), so decompression happens alongside parsing instead of before it
+EXTERNAL_DECOMPRESS_THRESHOLD = 4 * 1024 * 1024
+
+# Set to False to only ever use the Python modules
+USE_EXTERNAL_DECOMPRESSORS = True
+
+# Number of bytes read to tell which compression a file uses
+MAGIC_SIZE = 8
+
+# Number of bytes written at a time to a decompressor fed through stdin
+FEED_SIZE = 128 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Codec(object):
+    """A compression format that open_file() knows how to read"""
+    name: str
+    # File extensions without the dot, used when the file can't be sniffed (ie. it's being written)
+    extensions: List[str]
+    # Bytes every file of this format starts with
+    magic: bytes
+    # Function that opens a file name or file object with a Python module as gzip.open(filename, mode) would, or
+    # returns None if there's no module
+    open_module: Callable
+    # Commands that decompress a file to stdout, the first one that is installed is used
+    commands: List[List[str]] = field(default_factory=list)
+
+
+def _open_zstd(filename, mode='rb'):
+    """Open a zstd file name or file object with whichever zstd module is installed. Returns None if there isn't one"""
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.open(filename, mode)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    if 'r' in mode:
+        # Repodata may be made of several frames, so keep reading past the end of the first one
+        source = filename if hasattr(filename, 'read') else open(filename, 'rb')
+        return zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True, closefd=True)
+    return zstandard.open(filename, mode)
+
+
+# Registry of the compression formats open_file() can read, in the order magic bytes are checked
+CODECS = {}
+
+
+def register_codec(codec: Codec):
+    """
+    Add a compression format to open_file(), or replace the one with the same name
+
+    :param codec: The Codec to register
+    """
+    CODECS[codec.name] = codec
+
+
+register_codec(Codec('gzip', ['gz'], b'\x1f\x8b', gzip.open, [['pigz', '-dc'], ['gzip', '-dc']]))
+register_codec(Codec('bzip2', ['bz2'], b'BZh', bz2.open, [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']]))
+register_codec(Codec('xz', ['xz'], b'\xfd7zXZ\x00', lzma.open, [['xz', '-dc', '-T0']]))
+register_codec(Codec('zstd', ['zst', 'zstd'], b'\x28\xb5\x2f\xfd', _open_zstd, [['zstd', '-dcq']]))
+
+
+class _ProcessReader(io.RawIOBase):
+    """Read-only file object over the stdout of a decompressor process"""
+
+    def __init__(self, command: List[str], source) -> None:
+        """
+        :param command: The decompressor command line
+        :param source: The file name to decompress, or a file object that is fed to the decompressor through stdin
+        """
+        super().__init__()
+        self._command = command
+        self._feeder = None
+        if isinstance(source, str):
+            self._process = subprocess.Popen(command + [source], stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        else:
+            self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+            self._feeder = threading.Thread(target=self._feed, args=(source,), daemon=True)
+            self._feeder.start()
+        self._eof = False
+
+    def _feed(self, source):
+        try:
+            while True:
+                data = source.read(FEED_SIZE)
+                if not data:
+                    break
+                self._process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # The decompressor exited or was killed, close() reports why
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        read = self._process.stdout.readinto(buffer)
+        if not read:
+            self._eof = True
+            if self._feeder is not None:
+                # Everything fed in has been read by now, let the feeder finish so the source is left at its end
+                self._feeder.join()
+        return read
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        if not self._eof:
+            # Stopped reading early, the decompressor doesn't need to finish
+            self._process.kill()
+        self._process.stdout.close()
+        return_code = self._process.wait()
+        if self._feeder is not None:
+            self._feeder.join()
+        if self._eof and return_code != 0:
+            raise OSError(f'{self._command[0]} exited with status {return_code}')
+
+
+def _find_command(codec: Codec) -> Optional[List[str]]:
+    for command in codec.commands:
+        if shutil.which(command[0]) is not None:
+            return command
+    return None
+
+
+def sniff_codec(filename: str) -> Optional[Codec]:
+    """
+    Tell which compression format a file uses from its first bytes
+
+    :param filename: The file to check
+    :returns: The Codec, or None if the file isn't compressed (or uses a format that isn't registered)
+    """
+    with open(filename, 'rb') as file:
+        magic = file.read(MAGIC_SIZE)
+    for codec in CODECS.values():
+        if magic.startswith(codec.magic):
+            return codec
+    return None
+
+
+def codec_for_extension(filename: str) -> Optional[Codec]:
+    """
+    Tell which compression format a file uses from its extension
+
+    :param filename: The file name
+    :returns: The Codec, or None if the extension isn't one of a registered format
+    """
+    file_ext = filename.rsplit('.', 1)[-1]
+    for codec in CODECS.values():
+        if file_ext in codec.extensions:
+            return codec
+    return None
+
+
+def _open_compressed(codec: Codec, source, mode: str, size: int = None):
+    if 'r' not in mode:
+        file = codec.open_module(source, mode)
+        if file is None:
+            raise ValueError(f'Writing {codec.name} files requires a {codec.name} Python module')
+        return file
+
+    if isinstance(source, str):
+        size = os.path.getsize(source)
+    command = _find_command(codec) if USE_EXTERNAL_DECOMPRESSORS else None
+    if command is not None and size is not None and size >= EXTERNAL_DECOMPRESS_THRESHOLD:
+        return io.BufferedReader(_ProcessReader(command, source))
+    file = codec.open_module(source, 'rb')
+    if file is not None:
+        return file
+    # No module for it, so the external decompressor is the only option no matter the file size
+    command = _find_command(codec)
+    if command is None:
+        raise ValueError(f'Reading {codec.name} files requires a {codec.name} Python module or the '
+                         f'{" or ".join(command[0] for command in codec.commands)} command')
+    return io.BufferedReader(_ProcessReader(command, source))
+
+
+def open_compressed_stream(file_object, codec: Codec, size: int = None):
+    """
+    Decompress a binary file object that's already open for reading, ie. one that does something with the compressed
+    data as it's read
+
+    :param file_object: The file object of the compressed data
+    :param codec: The compression format, from sniff_codec()
+    :param size: The compressed size if it's known, to decide whether to use an external decompressor
+    :returns: Binary file object of the decompressed data
+    """
+    return _open_compressed(codec, file_object, 'rb', size)
 
 
 def open_file(filename: str, mode='r', encoding=None):
-    """Get the file extension and process the file based on the file extension
+    """Figure out the compression of the file and open it with a decompressor
     Else, open the file using the provided encoding spec or just do
     ASCII-based read
 
+    Files being read are recognised by their magic bytes so the file name doesn't matter, files being written go
+    by their extension. Compressed files are always opened in binary mode.
+
     WARNING: This code DO NOT check if the provided mode and encoding will
     not raise an exception from underlying open() call.
 
@@ -18,13 +230,12 @@ def open_file(filename: str, mode='r', encoding=None):
 
     :returns: File object for the filename in their respective file object type
     """
-    file_ext = filename.rsplit('.', 1)[-1]
-    if file_ext == 'gz':
-        return gzip.open(filename)
-    elif file_ext == 'bz2':
-        return bz2.open(filename)
-    elif file_ext == 'xz':
-        return lzma.open(filename)
+    if 'r' in mode and '+' not in mode:
+        codec = sniff_codec(filename)
+    else:
+        codec = codec_for_extension(filename)
+    if codec is not None:
+        return _open_compressed(codec, filename, mode.replace('t', '').replace('b', '') + 'b')
     elif encoding is not None:
         return open(filename, mode, encoding=encoding)
     else:
@@ -0,0 +1,405 @@
+"""
+Byte offset index into decompressed primary, filelists and other XML
+
+Showing a single package otherwise means parsing the whole XML file up to it. The index maps every pkgId to the
+(start, end) byte offsets of its <package> element in the decompressed XML, so one package is read with a single
+slice of an mmap and parsed on its own.
+
+The offsets are found by scanning the bytes as they go past, so the index is built during the parse that happens
+anyway: IndexingReader sits between the decompressor and the parser, feeding a PackageOffsetScanner and optionally
+keeping a copy of the decompressed XML for the index to point into. build_xml_index() does the same for an XML file
+on its own.
+
+None of the compressions used for repodata can be seeked into, so the index always points into decompressed XML.
+
+The index is a sidecar file next to the XML, written as flat arrays that are used straight from an mmap, same as
+file_index. Layout, after the header:
+- root tag: the start tag of the root element, ie. <metadata xmlns=... xmlns:rpm=... packages="...">, which declares
+  the namespaces a <package> element needs to be parsed on its own
+- keys: the pkgIds, sorted, each padded with zero bytes to the length of the longest one
+- offsets: start and end offset of each package, in the same order as the keys
+"""
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .package_view import CHANGELOG_COLUMNS, FILE_COLUMNS, DetailSource
+from .xmlparser import PACKAGE_PARSERS
+
+# Bumped whenever the file layout changes
+INDEX_MAGIC = b'RPMXIDX1'
+
+# magic, byte order, package count, key length, then the offset of each section and the end of the file
+HEADER = struct.Struct('<8sc7x6Q')
+
+# Extension of the index file, added to the name of the XML file
+INDEX_EXTENSION = '.idx'
+
+PACKAGE_START = b'<package'
+PACKAGE_END = b'</package>'
+# Bytes that can follow the tag name, anything else is another tag such as <packager> or <packagelist>
+TAG_NAME_END = b' \t\r\n>/'
+
+# filelists and other carry the pkgId on the <package> element, primary in <checksum pkgid="YES">
+PKGID_ATTRIBUTE = re.compile(rb'\spkgid\s*=\s*["\']([^"\']*)["\']')
+CHECKSUM_ELEMENT = re.compile(rb'<checksum\b[^>]*>\s*([^<\s]*)\s*</checksum>')
+ROOT_NAME = re.compile(rb'<([^\s>/]+)')
+
+logger = logging.getLogger(__name__)
+
+
+def index_filename(xml_filename: str) -> str:
+    """
+    :param xml_filename: The decompressed XML file
+    :returns: The name of its sidecar index
+    """
+    return xml_filename + INDEX_EXTENSION
+
+
+def _package_id(element: bytes) -> Optional[str]:
+    """Find the pkgId of a <package> element"""
+    match = PKGID_ATTRIBUTE.search(element, 0, element.find(b'>') + 1)
+    if match is None:
+        match = CHECKSUM_ELEMENT.search(element)
+    if match is None:
+        return None
+    return match.group(1).decode('ascii')
+
+
+class PackageOffsetScanner(object):
+    """
+    Finds the byte offsets of every <package> element directly under the root element of primary, filelists or
+    other XML, fed a chunk at a time
+
+    Only the bytes of the package being scanned are kept, so memory doesn't grow with the file.
+    """
+
+    def __init__(self) -> None:
+        # {pkgId: (start, end)}
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        # Start tag of the root element, None until it has been seen
+        self.root_tag: Optional[bytes] = None
+        self._buffer = bytearray()
+        # Offset of the first byte of the buffer
+        self._position = 0
+        # Where to carry on searching the buffer from
+        self._search = 0
+        # Offset of the start of the package being scanned, None between packages
+        self._start: Optional[int] = None
+
+    def _drop(self, count: int):
+        del self._buffer[:count]
+        self._position += count
+        self._search = 0
+
+    def _find_root(self) -> bool:
+        buffer = self._buffer
+        while True:
+            index = buffer.find(b'<', self._search)
+            if index == -1 or index + 1 >= len(buffer):
+                return False
+            if buffer[index + 1] in b'?!':
+                # XML declaration, comment or doctype
+                self._search = index + 1
+                continue
+            end = buffer.find(b'>', index)
+            if end == -1:
+                return False
+            self.root_tag = bytes(buffer[index:end + 1])
+            self._drop(end + 1)
+            return True
+
+    def feed(self, data: bytes):
+        """
+        Scan the next chunk of the XML
+
+        :param data: The bytes following the ones fed so far
+        """
+        buffer = self._buffer
+        buffer += data
+        if self.root_tag is None and not self._find_root():
+            return
+        while True:
+            if self._start is None:
+                index = buffer.find(PACKAGE_START, self._search)
+                if index == -1:
+                    # Keep what could be the first part of <package
+                    self._drop(max(0, len(buffer) - len(PACKAGE_START) + 1))
+                    return
+                if index + len(PACKAGE_START) >= len(buffer):
+                    self._drop(index)
+                    return
+                if buffer[index + len(PACKAGE_START)] not in TAG_NAME_END:
+                    self._search = index + len(PACKAGE_START)
+                    continue
+                self._start = self._position + index
+                self._drop(index)
+                self._search = len(PACKAGE_START)
+            else:
+                index = buffer.find(PACKAGE_END, self._search)
+                if index == -1:
+                    self._search = max(self._search, len(buffer) - len(PACKAGE_END) + 1)
+                    return
+                end = index + len(PACKAGE_END)
+                pkg_id = _package_id(bytes(buffer[:end]))
+                if pkg_id is None:
+                    logger.warning(f'Package at offset {self._start} has no pkgId, not indexing it')
+                else:
+                    self.offsets.setdefault(pkg_id, (self._start, self._start + end))
+                self._start = None
+                self._drop(end)
+
+
+class IndexingReader(object):
+    """
+    Read-only file object that scans the decompressed XML read through it for package offsets, and optionally
+    writes a copy of it for the index to point into
+    """
+
+    def __init__(self, file_object, scanner: PackageOffsetScanner, copy_to=None) -> None:
+        """
+        :param file_object: The binary file object of the decompressed XML, ie. from open_verified()
+        :param scanner: The scanner to feed
+        :param copy_to: Binary file object to write everything read to
+        """
+        self._file = file_object
+        self.scanner = scanner
+        self._copy_to = copy_to
+
+    def read(self, size=-1) -> bytes:
+        data = self._file.read(size)
+        self.scanner.feed(data)
+        if self._copy_to is not None:
+            self._copy_to.write(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'IndexingReader':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def _align(output: bytearray):
+    """Pad the output so the next array starts at a multiple of 8 bytes and can be used from the mmap as it is"""
+    output.extend(b'\0' * (-len(output) % 8))
+
+
+def write_xml_index(filename: str, offsets: Dict[str, Tuple[int, int]], root_tag: bytes):
+    """
+    Write an offset index
+
+    :param filename: The index file to write
+    :param offsets: Dictionary of {pkgId: (start, end)}, ie. PackageOffsetScanner.offsets
+    :param root_tag: Start tag of the root element of the XML
+    """
+    pkg_ids = sorted(pkg_id.encode('ascii') for pkg_id in offsets)
+    key_length = max(map(len, pkg_ids), default=0)
+    keys = bytearray()
+    positions = array('Q')
+    for pkg_id in pkg_ids:
+        keys.extend(pkg_id.ljust(key_length, b'\0'))
+        positions.extend(offsets[pkg_id.decode('ascii')])
+
+    output = bytearray(HEADER.size)
+    section_offsets = []
+    for section in (root_tag or b'', keys, positions.tobytes()):
+        _align(output)
+        section_offsets.append(len(output))
+        output.extend(section)
+    byte_order = b'L' if sys.byteorder == 'little' else b'B'
+    HEADER.pack_into(output, 0, INDEX_MAGIC, byte_order, len(pkg_ids), key_length, *section_offsets, len(output))
+    # Written under another name first, so a reader never sees half an index
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'wb') as index_file:
+        index_file.write(output)
+    os.replace(temporary, filename)
+    logger.info(f'Wrote offsets of {len(pkg_ids)} packages to {filename}')
+
+
+def build_xml_index(xml_filename: str, filename: str = None) -> str:
+    """
+    Scan a decompressed XML file and write its offset index
+
+    :param xml_filename: The decompressed primary, filelists or other XML
+    :param filename: The index file to write. Defaults to index_filename(xml_filename)
+    :returns: The name of the index file
+    """
+    scanner = PackageOffsetScanner()
+    with open(xml_filename, 'rb') as xml_file:
+        for data in iter(lambda: xml_file.read(1024 * 1024), b''):
+            scanner.feed(data)
+    filename = filename or index_filename(xml_filename)
+    write_xml_index(filename, scanner.offsets, scanner.root_tag)
+    return filename
+
+
+class XmlIndex(object):
+    """Offset index read straight from an mmap, along with the XML it points into"""
+
+    def __init__(self, xml_filename: str, filename: str = None) -> None:
+        """
+        :param xml_filename: The decompressed XML file
+        :param filename: Its index file. Defaults to index_filename(xml_filename)
+        """
+        filename = filename or index_filename(xml_filename)
+        with open(filename, 'rb') as index_file:
+            self._index_mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = data = memoryview(self._index_mmap)
+        (magic, byte_order, self.package_count, self._key_length, root_offset, keys_offset, offsets_offset,
+         end_offset) = HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'{filename} is not an XML offset index, or was written by another version. Rebuild it')
+        if byte_order != (b'L' if sys.byteorder == 'little' else b'B'):
+            raise ValueError(f'{filename} was written on a machine with another byte order. Rebuild it')
+        self.root_tag = bytes(data[root_offset:keys_offset]).rstrip(b'\0')
+        root_name = ROOT_NAME.match(self.root_tag)
+        self._root_end = b'</' + root_name.group(1) + b'>' if root_name else b''
+        self._keys = data[keys_offset:keys_offset + self.package_count * self._key_length]
+        self._offsets = data[offsets_offset:offsets_offset + self.package_count * 16].cast('Q')
+        with open(xml_filename, 'rb') as xml_file:
+            # mmap can't map an empty file
+            self._xml_mmap = mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.fstat(xml_file.fileno()).st_size else None
+
+    def close(self):
+        """Release the mmaps. Nothing returned by the index is backed by them, so that's safe to keep"""
+        for view in (self._keys, self._offsets, self._data):
+            view.release()
+        self._index_mmap.close()
+        if self._xml_mmap is not None:
+            self._xml_mmap.close()
+
+    def __enter__(self) -> 'XmlIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.package_count
+
+    def __contains__(self, pkg_id: str) -> bool:
+        return self.offsets(pkg_id) is not None
+
+    def _key(self, number: int) -> bytes:
+        start = number * self._key_length
+        return bytes(self._keys[start:start + self._key_length])
+
+    def offsets(self, pkg_id: str) -> Optional[Tuple[int, int]]:
+        """
+        :param pkg_id: The pkgId of the package
+        :returns: The (start, end) offsets of its <package> element, or None if it isn't in the index
+        """
+        encoded = pkg_id.encode('ascii')
+        if len(encoded) > self._key_length:
+            return None
+        key = encoded.ljust(self._key_length, b'\0')
+        low, high = 0, self.package_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.package_count or self._key(low) != key:
+            return None
+        return self._offsets[low * 2], self._offsets[low * 2 + 1]
+
+    def read_package(self, pkg_id: str) -> Optional[bytes]:
+        """
+        :param pkg_id: The pkgId of the package
+        :returns: The bytes of its <package> element, or None if it isn't in the index
+        """
+        offsets = self.offsets(pkg_id)
+        if offsets is None:
+            return None
+        return self._xml_mmap[offsets[0]:offsets[1]]
+
+    def package_element(self, pkg_id: str) -> Optional[ET.Element]:
+        """
+        Parse the <package> element of a package on its own
+
+        :param pkg_id: The pkgId of the package
+        :returns: The element, or None if it isn't in the index
+        """
+        package = self.read_package(pkg_id)
+        if package is None:
+            return None
+        # The root element declares the namespaces, ie. rpm: in primary
+        return ET.fromstring(self.root_tag + package + self._root_end)[0]
+
+    def rows(self, pkg_id: str, repo_category: str) -> List[tuple]:
+        """
+        Parse a package into rows, the same as xmlparser's parsers produce
+
+        :param pkg_id: The pkgId of the package
+        :param repo_category: The repomd data type of the XML, one of primary, filelists or other
+        :returns: A list of (table_name, row) tuples, empty if the package isn't in the index
+        """
+        element = self.package_element(pkg_id)
+        if element is None:
+            return []
+        return PACKAGE_PARSERS[repo_category](element)
+
+
+class XmlDetails(DetailSource):
+    """Fetches file lists and changelogs for PackageView out of the offset indexes of filelists and other XML"""
+
+    def __init__(self, filelists: XmlIndex = None, other: XmlIndex = None) -> None:
+        """
+        :param filelists: Index of the filelists XML. Packages have no files if not provided
+        :param other: Index of the other XML. Packages have no changelog if not provided
+        """
+        self.filelists = filelists
+        self.other = other
+
+    @classmethod
+    def from_directory(cls, directory: str) -> 'XmlDetails':
+        """
+        Open the indexes kept by ingest, see ingest.indexed_xml_path()
+
+        :param directory: The directory of the repository, holding filelists.xml and other.xml with their indexes
+        :returns: The XmlDetails
+        """
+        indexes = {}
+        for repo_category in ('filelists', 'other'):
+            xml_filename = os.path.join(directory, f'{repo_category}.xml')
+            if os.path.exists(index_filename(xml_filename)):
+                indexes[repo_category] = XmlIndex(xml_filename)
+        return cls(**indexes)
+
+    def files(self, pkg_id: str) -> List[dict]:
+        if self.filelists is None:
+            return []
+        files = [{column: row[column] for column in FILE_COLUMNS}
+                 for _, row in self.filelists.rows(pkg_id, 'filelists')]
+        return sorted(files, key=lambda row: row['filename'])
+
+    def changelogs(self, pkg_id: str) -> List[dict]:
+        if self.other is None:
+            return []
+        changelogs = [{column: row[column] for column in CHANGELOG_COLUMNS}
+                      for _, row in self.other.rows(pkg_id, 'other')]
+        return sorted(changelogs, key=lambda row: row['date'] or 0, reverse=True)
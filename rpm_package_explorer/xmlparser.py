@@ -1,9 +1,27 @@
+from datetime import datetime, timezone
 from typing import Union
+from xml.etree import ElementTree as ET
 import declxml as dxml
 from .utils import open_file
+from .instrumentation import count_rows, instrumented, instrumented_rows
+from .db_model.records import iter_records
 from .db_model.utils import DBModelFactory
 
+# Namespace used by attributes such as xml:base and xml:lang
+XML_NAMESPACE = '{http://www.w3.org/XML/1998/namespace}'
 
+# Top-level comps elements that iter_groups() parses, in the order parse_groups() returns them
+GROUP_TYPES = ['group', 'category', 'environment']
+
+# Dependency types that lives under <format> in primary.xml, in the order parse_primary_new returns them
+PRIMARY_DEPENDENCY_TYPES = ['conflicts', 'enhances', 'obsoletes', 'provides', 'recommends', 'requires',
+                            'suggests', 'supplements']
+
+PRIMARY_TABLES = ['packages', 'conflicts', 'enhances', 'files', 'obsoletes', 'provides', 'recommends', 'requires',
+                  'suggests', 'supplements']
+
+
+@instrumented('xmlparser.parse_repomd', rows=len)
 def parse_repomd(filename: str):
     """
     Read and return the repomd data
@@ -52,6 +70,7 @@ def rearrange_data(xml_dict: dict, key_name):
     return new_dict
 
 
+@instrumented('xmlparser.rearrange_data_merge_pkgid', rows=count_rows)
 def rearrange_data_merge_pkgid(dict_data: dict, key_name: str):
     """
     Merge package conflicts/enhances/obsoletes/provides/recommends/requires/suggests/supplements
@@ -97,7 +116,14 @@ def rearrange_data_merge_pkgid(dict_data: dict, key_name: str):
     return dict_data
 
 
+@instrumented('xmlparser.convert_to_class', rows=count_rows)
 def convert_to_class(root_dictionary: dict):
+    """
+    Replace the row dictionaries of every table with database models, in place
+
+    :param root_dictionary: Dictionary of {table_name: list of row dictionaries}
+    :returns: The same dictionary
+    """
     for k, v in root_dictionary.items():
         new_array = []
         for iv in v:
@@ -105,8 +131,10 @@ def convert_to_class(root_dictionary: dict):
             model_factory = DBModelFactory(k, iv)
             new_array.append(model_factory.db_model)
         root_dictionary.update({k: new_array})
+    return root_dictionary
 
 
+@instrumented('xmlparser.parse_filelists', rows=count_rows)
 def parse_filelists(filename: str):
     """Parse filelists XML data into Python dictionary form"""
     package_processor = dxml.array(dxml.dictionary(
@@ -127,6 +155,7 @@ def parse_filelists(filename: str):
     return dxml.parse_from_file(filelists_processor, filename)
 
 
+@instrumented('xmlparser.parse_otherdata', rows=count_rows)
 def parse_otherdata(filename: str):
     """Parse other xml data into Python dictionary form"""
     package_processor = dxml.array(dxml.dictionary(
@@ -148,6 +177,7 @@ def parse_otherdata(filename: str):
     return dxml.parse_from_file(otherlist_processor, filename)
 
 
+@instrumented('xmlparser.parse_updateinfo', rows=count_rows)
 def parse_updateinfo(filename: str):
     """Parse updateinfo data into Python dictionary form"""
     reference_processor = dxml.dictionary('reference', [
@@ -198,204 +228,536 @@ def parse_updateinfo(filename: str):
     return dxml.parse_from_file(updates_processor, filename)
 
 
-def parse_groups(filename: str):
+def _local_name(tag: str):
+    """Strip the namespace from an ElementTree tag, ie. {http://linux.duke.edu/metadata/rpm}entry -> entry"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element: ET.Element):
+    """Return the stripped text of an element the same way declxml does, or an empty string if there's none"""
+    if element is None or element.text is None:
+        return ''
+    return element.text.strip()
+
+
+def _attr(element: ET.Element, attribute: str, default=None):
+    """Return the stripped attribute value, or default if the element or the attribute does not exist"""
+    if element is None:
+        return default
+    value = element.get(attribute)
+    if value is None:
+        return default
+    return value.strip()
+
+
+def _int_attr(element: ET.Element, attribute: str, default=None):
+    """Return the attribute as an integer, or default if the element or the attribute does not exist"""
+    if element is None:
+        return default
+    value = element.get(attribute)
+    if value is None:
+        return default
+    return int(value)
+
+
+def _iterparse_packages(source, tag: str = 'package'):
     """
-    Parse comps data and returns it in Python dictionary form
+    Generator function that yields every <package> element that sits directly under the root element.
+
+    The root element is cleared after each package is consumed so only one package is kept in memory at a time,
+    regardless of how large the XML file is.
+
+    :param source: The filename, compressed or not, or binary file object of the XML file
+    :param tag: The element to yield instead of <package>, ie. update for updateinfo.xml
+    :returns: Completed <package> elements, one at a time
     """
-    # Oh cock this one has fucking DTD
-    # So I have few ways to do it:
-    # - ignore comps file forever (which I prefer **not** to)
-    # - compile libcomps and use that instead (too much effort)
-    # - do it the hard way and learn lxml (ugh)
-    # - or jank it
-    #
-    # HMMMMMMMMMMMMMMMMMMM.
-
-    # BEGIN jank
-    new_filename = filename.replace('comps', 'compsnew')
-    with open_file(filename, encoding='utf8') as src_file, open_file(new_filename, 'w', encoding='utf8') as dest_file:
-        for line in src_file.readlines():
-            if line.find('DOCTYPE comps') != -1 or line.find('DTD Comps info') != -1 or line.find('comps.dtd') != -1:
-                continue
-            dest_file.writelines(line.replace('xml:', ''))
-    # END jank
-
-    # header_processor data are shared across group, category and environment
-    header_processor: list = [
-        dxml.string('id'),
-        dxml.array(dxml.dictionary('name', [
-            dxml.string('.', 'lang', default='en', required=False),
-            dxml.string('.', alias='content')
-        ], alias='entry'), alias='name'),
-        dxml.array(dxml.dictionary('description', [
-            dxml.string('.', 'lang', default='en', required=False),
-            dxml.string('.', alias='content')
-        ], alias='entry'), alias='description')
-    ]
-
-    group_child_elem = header_processor.copy()
-    group_child_elem.extend([
-        dxml.boolean('default'),
-        dxml.boolean('uservisible'),
-        dxml.dictionary('packagelist', [
-            dxml.array(dxml.dictionary('packagereq', [
-                dxml.string('.', 'type'),
-                dxml.string('.', alias='package_name')
-            ]))
-        ])
-    ])
-    group_processor = dxml.array(dxml.dictionary('group', group_child_elem))
+    if isinstance(source, str):
+        with open_file(source, 'rb') as file_object:
+            yield from _iterparse_packages(file_object, tag)
+        return
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    depth = 1
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and _local_name(element.tag) == tag:
+            yield element
+            # Drop the package (and everything before it) from the tree once it has been consumed
+            root.clear()
+
+
+def _parse_dependency_entry(entry: ET.Element, dependency_type: str):
+    """Parse a single <rpm:entry> element into the same dictionary layout that declxml produces"""
+    row = {
+        'name': _attr(entry, 'name', ''),
+        'flags': _attr(entry, 'flags'),
+        'epoch': _int_attr(entry, 'epoch'),
+        'version': _attr(entry, 'ver'),
+        'release': _attr(entry, 'rel')
+    }
+    # requires require extra `pre` attribute to signal that this is a pre-requisite requirement
+    if dependency_type == 'requires':
+        row['pre'] = _int_attr(entry, 'pre', 0)
+    return row
 
-    groupid_elem = [dxml.array(dxml.string('groupid'))]
-    category_child_elem = header_processor.copy()
-    category_child_elem.extend([
-        dxml.integer('display_order'),
-        dxml.dictionary('grouplist', groupid_elem)
-    ])
-    category_processor = dxml.array(dxml.dictionary('category', category_child_elem))
 
-    environment_child_elem = header_processor.copy()
-    environment_child_elem.extend([
-        dxml.integer('display_order'),
-        dxml.dictionary('grouplist', groupid_elem),
-        dxml.dictionary('optionlist', groupid_elem)
-    ])
-    environment_processor = dxml.array(dxml.dictionary('environment', environment_child_elem))
+def _parse_primary_package(package: ET.Element):
+    """
+    Parse a single <package> element from primary.xml
 
-    comps_processor = dxml.dictionary('comps', [group_processor, category_processor, environment_processor])
-    return dxml.parse_from_file(comps_processor, new_filename)
+    :param package: The <package> element
+    :returns: A list of (table_name, row) tuples, starting with the packages row followed by its
+              dependency and file rows
+    """
+    children = {_local_name(child.tag): child for child in package}
+    version = children.get('version')
+    checksum = children.get('checksum')
+    time = children.get('time')
+    size = children.get('size')
+    location = children.get('location')
+    package_format = children.get('format')
+    format_children = list(package_format) if package_format is not None else []
+    format_elements = {_local_name(child.tag): child for child in format_children}
+    pkg_id = _text(checksum)
+
+    rows = [('packages', {
+        'pkgId': pkg_id,
+        'name': _text(children.get('name')),
+        'arch': _text(children.get('arch')),
+        'version': _attr(version, 'ver', ''),
+        'epoch': _int_attr(version, 'epoch'),
+        'release': _attr(version, 'rel', ''),
+        'summary': _text(children.get('summary')),
+        'description': _text(children.get('description')),
+        'url': _text(children.get('url')),
+        'time_file': _int_attr(time, 'file'),
+        'time_build': _int_attr(time, 'build'),
+        'rpm_license': _text(format_elements.get('license')),
+        'rpm_vendor': _text(format_elements.get('vendor')),
+        'rpm_group': _text(format_elements.get('group')),
+        'rpm_buildhost': _text(format_elements.get('buildhost')),
+        'rpm_sourcerpm': _text(format_elements.get('sourcerpm')),
+        'rpm_header_start': _int_attr(format_elements.get('header-range'), 'start'),
+        'rpm_header_end': _int_attr(format_elements.get('header-range'), 'end'),
+        'rpm_packager': _text(children.get('packager')),
+        'size_package': _int_attr(size, 'package'),
+        'size_installed': _int_attr(size, 'installed'),
+        'size_archive': _int_attr(size, 'archive'),
+        'location_href': _attr(location, 'href', ''),
+        # createrepo writes this as xml:base, which declxml never picked up
+        'location_base': _attr(location, f'{XML_NAMESPACE}base', _attr(location, 'base')),
+        'checksum_type': _attr(checksum, 'type', '')
+    })]
+
+    dependency_rows = {}
+    file_rows = []
+    for child in format_children:
+        tag = _local_name(child.tag)
+        if tag == 'file':
+            file_rows.append({'name': _text(child), 'type': _attr(child, 'type', 'file'), 'pkgId': pkg_id})
+        elif tag in PRIMARY_DEPENDENCY_TYPES:
+            entries = dependency_rows.setdefault(tag, [])
+            for entry in child:
+                row = _parse_dependency_entry(entry, tag)
+                row['pkgId'] = pkg_id
+                entries.append(row)
+
+    # Keep the same table ordering as PRIMARY_TABLES
+    for table_name in PRIMARY_TABLES[1:]:
+        if table_name == 'files':
+            rows.extend(('files', row) for row in file_rows)
+        else:
+            rows.extend((table_name, row) for row in dependency_rows.get(table_name, []))
+    return rows
 
 
-def parse_primary_new(filename: str):
+def _iter_primary_rows(source):
     """
-    Parse primary.xml using new approach of parsing data by database model
+    Generator function that parses primary.xml in a single pass
 
-    :param filename: The filename for primary.xml
-    :returns: A dictionary containing parsed data
+    :param source: The filename or file object for primary.xml
+    :returns: (table_name, row) tuples for every package, in document order
     """
-    # # Fuck XML.
-    # # Also, fuck primary.xml.
+    for package in _iterparse_packages(source):
+        yield from _parse_primary_package(package)
 
-    # Alright, new approach, new way, and probably the **best** way to work with XML.
-    # Downside of this approach is it is required to parse file repeatedly
-    # Maybe I will use the _proper_ way by combining all processor into an array and iterate
-    # through the processor array
 
-    # Root dictionary to hold all parsed data.
-    root_dictionary = {}
+def _parse_filelists_package(package: ET.Element):
+    """
+    Parse a single <package> element from filelists.xml
 
-    # Packages database model parsing
-    package_processor = dxml.array(dxml.dictionary('package', [
-        dxml.string('checksum', alias='pkgId'),
-        dxml.string('name'),
-        dxml.string('arch'),
-        dxml.string('version', 'ver', alias='version'),
-        dxml.integer('version', 'epoch', alias='epoch'),
-        dxml.string('version', 'rel', alias='release'),
-        dxml.string('summary'),
-        dxml.string('description'),
-        dxml.string('url'),
-        dxml.integer('time', 'file', alias='time_file'),
-        dxml.integer('time', 'build', alias='time_build'),
-        dxml.string('format/license', alias='rpm_license'),
-        dxml.string('format/vendor', alias='rpm_vendor'),
-        dxml.string('format/group', alias='rpm_group'),
-        dxml.string('format/buildhost', alias='rpm_buildhost'),
-        dxml.string('format/sourcerpm', alias='rpm_sourcerpm'),
-        dxml.integer('format/header-range', 'start', alias='rpm_header_start'),
-        dxml.integer('format/header-range', 'end', alias='rpm_header_end'),
-        dxml.string('packager', alias='rpm_packager'),
-        dxml.integer('size', 'package', alias='size_package'),
-        dxml.integer('size', 'installed', alias='size_installed'),
-        dxml.integer('size', 'archive', alias='size_archive'),
-        dxml.string('location', 'href', alias='location_href'),
-        dxml.string('location', 'base', alias='location_base', default=None, required=False),
-        dxml.string('checksum', 'type', alias='checksum_type')
-    ]), nested='metadata')
-    root_dictionary.update({'packages': dxml.parse_from_file(package_processor, filename)})
-
-    parse_array = ['conflicts', 'enhances', 'files', 'obsoletes', 'provides', 'recommends', 'requires',
-                   'suggests', 'supplements']
-
-    for parse_name in parse_array:
-        processor = None
-        if parse_name == 'files':
-            file_processor = [
-                dxml.string('.', alias='name'),
-                dxml.string('.', 'type', required=False, default='file')
-            ]
-            processor = dxml.array(dxml.dictionary('package', [
-                dxml.string('checksum', alias='pkgId'),
-                dxml.array(dxml.dictionary('file', file_processor, required=False),
-                           nested=f'format', alias=f'{parse_name}', omit_empty=True)
-            ]), nested='metadata')
-        else:
-            nevr_processor = [
-                dxml.string('.', 'name'),
-                dxml.string('.', 'flags', required=False, default=None),
-                dxml.integer('.', 'epoch', required=False, default=None),
-                dxml.string('.', 'ver', required=False, alias='version', default=None),
-                dxml.string('.', 'rel', required=False, alias='release', default=None)
-            ]
-
-            # requires require extra `pre` attribute to signal that this is a pre-requisite requirement
-            if parse_name == 'requires':
-                nevr_processor.append(dxml.integer('.', 'pre', required=False, default=0))
-
-            processor = dxml.array(dxml.dictionary('package', [
-                dxml.string('checksum', alias='pkgId'),
-                dxml.array(dxml.dictionary('entry', nevr_processor, required=False),
-                           nested=f'format/{parse_name}', alias=f'{parse_name}', omit_empty=True)
-            ]), nested='metadata')
-        root_dictionary.update({parse_name: dxml.parse_from_file(processor, filename)})
-    # Yes, I know that these two lines are woefully inefficient.
-    rearrange_data_merge_pkgid(root_dictionary, 'pkgId')
-    convert_to_class(root_dictionary)
+    :param package: The <package> element
+    :returns: A list of ('filelist', row) tuples
+    """
+    pkg_id = _attr(package, 'pkgid', '')
+    return [('filelist', {'filename': _text(child), 'filetype': _attr(child, 'type', 'file'), 'pkgId': pkg_id})
+            for child in package if _local_name(child.tag) == 'file']
+
+
+def _parse_otherdata_package(package: ET.Element):
+    """
+    Parse a single <package> element from other.xml
+
+    :param package: The <package> element
+    :returns: A list of ('changelog', row) tuples
+    """
+    pkg_id = _attr(package, 'pkgid', '')
+    return [('changelog', {'author': _attr(child, 'author', ''), 'date': _int_attr(child, 'date'),
+                           'changelog': _text(child), 'pkgId': pkg_id})
+            for child in package if _local_name(child.tag) == 'changelog']
+
+
+# Parses a single <package> element into (table_name, row) tuples, by repomd data type
+PACKAGE_PARSERS = {
+    'primary': _parse_primary_package,
+    'filelists': _parse_filelists_package,
+    'other': _parse_otherdata_package
+}
+
+
+def _iter_filelists_rows(source):
+    """
+    Generator function that parses filelists.xml in a single pass
+
+    :param source: The filename or file object for filelists.xml
+    :returns: ('filelist', row) tuples for every file, in document order
+    """
+    for package in _iterparse_packages(source):
+        yield from _parse_filelists_package(package)
+
+
+def _iter_otherdata_rows(source):
+    """
+    Generator function that parses other.xml in a single pass
+
+    :param source: The filename or file object for other.xml
+    :returns: ('changelog', row) tuples for every changelog entry, in document order
+    """
+    for package in _iterparse_packages(source):
+        yield from _parse_otherdata_package(package)
+
+
+def _iter_models(rows):
+    """Wrap (table_name, row) tuples into (table_name, database model) tuples"""
+    for table_name, row in rows:
+        yield table_name, DBModelFactory(table_name, row).db_model
+
+
+def _wrap_rows(rows, compact: bool):
+    """Wrap (table_name, row) tuples into database models, or compact records if compact is set"""
+    if compact:
+        return iter_records(rows)
+    return _iter_models(rows)
+
+
+def iter_primary(source, compact=False):
+    """
+    Generator function that yields primary.xml data one database model at a time
+
+    Each package is yielded as ('packages', Packages) followed by its conflicts, enhances, files, obsoletes,
+    provides, recommends, requires, suggests and supplements rows, so only one package is held in memory at a time.
+
+    :param source: The filename, compressed or not, or binary file object of primary.xml
+    :param compact: Yield CompactRecord instead of database models, for when many rows are kept in memory
+    :returns: (table_name, database model) tuples in document order
+    """
+    return instrumented_rows('xmlparser.iter_primary', _wrap_rows(_iter_primary_rows(source), compact))
+
+
+def iter_filelists(source, compact=False):
+    """
+    Generator function that yields filelists.xml data one FileList model at a time
+
+    :param source: The filename, compressed or not, or binary file object of filelists.xml
+    :param compact: Yield CompactRecord instead of database models, for when many rows are kept in memory
+    :returns: ('filelist', FileList) tuples in document order
+    """
+    return instrumented_rows('xmlparser.iter_filelists', _wrap_rows(_iter_filelists_rows(source), compact))
+
+
+def iter_otherdata(source, compact=False):
+    """
+    Generator function that yields other.xml data one ChangeLog model at a time
+
+    :param source: The filename, compressed or not, or binary file object of other.xml
+    :param compact: Yield CompactRecord instead of database models, for when many rows are kept in memory
+    :returns: ('changelog', ChangeLog) tuples in document order
+    """
+    return instrumented_rows('xmlparser.iter_otherdata', _wrap_rows(_iter_otherdata_rows(source), compact))
+
+
+def _timestamp(value: str):
+    """Convert an updateinfo date, either 2021-01-01 00:00:00, 2021-01-01 or a Unix timestamp, into a timestamp"""
+    if value is None or not value.strip():
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for date_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(value, date_format).replace(tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_update(update: ET.Element):
+    """
+    Parse a single <update> element from updateinfo.xml
+
+    :param update: The <update> element
+    :returns: A list of (table_name, row) tuples, starting with the advisory row followed by its package and
+              reference rows
+    """
+    children = {}
+    for child in update:
+        children.setdefault(_local_name(child.tag), child)
+    advisory_id = _text(children.get('id'))
+    rows = [('advisory', {
+        'advisory_id': advisory_id,
+        'issuer': update.get('from'),
+        'status': update.get('status'),
+        'type': update.get('type'),
+        'version': update.get('version'),
+        'title': _text(children.get('title')),
+        'issued': _timestamp(_attr(children.get('issued'), 'date')),
+        'updated': _timestamp(_attr(children.get('updated'), 'date')),
+        'rights': _text(children.get('rights')),
+        'release': _text(children.get('release')),
+        'pushcount': _int_text(children.get('pushcount')),
+        'severity': _text(children.get('severity')),
+        'summary': _text(children.get('summary')),
+        'description': _text(children.get('description'))
+    })]
+
+    references = children.get('references')
+    for reference in references if references is not None else []:
+        rows.append(('advisory_reference', {
+            'advisory_id': advisory_id,
+            'ref_id': reference.get('id'),
+            'type': reference.get('type'),
+            'href': reference.get('href'),
+            'title': reference.get('title')
+        }))
+
+    package_list = children.get('pkglist')
+    for collection in package_list if package_list is not None else []:
+        for package in collection:
+            if _local_name(package.tag) != 'package':
+                continue
+            package_children = {_local_name(child.tag): child for child in package}
+            checksum = package_children.get('sum')
+            rows.append(('advisory_package', {
+                'advisory_id': advisory_id,
+                'collection': collection.get('short'),
+                'name': _attr(package, 'name', ''),
+                'epoch': _int_attr(package, 'epoch'),
+                'version': _attr(package, 'version'),
+                'release': _attr(package, 'release'),
+                'arch': _attr(package, 'arch'),
+                'src': _attr(package, 'src'),
+                'filename': _text(package_children.get('filename')),
+                'checksum_type': _attr(checksum, 'type'),
+                'checksum': _text(checksum)
+            }))
+    return rows
+
+
+def _iter_updateinfo_rows(source):
+    """
+    Generator function that parses updateinfo.xml in a single pass
+
+    :param source: The filename or file object for updateinfo.xml
+    :returns: (table_name, row) tuples for every update, in document order
+    """
+    for update in _iterparse_packages(source, 'update'):
+        yield from _parse_update(update)
+
+
+def iter_updateinfo(source, compact=False):
+    """
+    Generator function that yields updateinfo.xml data flattened into advisory, advisory_package and
+    advisory_reference rows
+
+    Each update is yielded as ('advisory', Advisory) followed by its references and the packages it fixes.
+
+    :param source: The filename, compressed or not, or binary file object of updateinfo.xml
+    :param compact: Yield CompactRecord instead of database models, for when many rows are kept in memory
+    :returns: (table_name, database model) tuples in document order
+    """
+    return instrumented_rows('xmlparser.iter_updateinfo', _wrap_rows(_iter_updateinfo_rows(source), compact))
+
+
+def _collect(root_dictionary: dict, models):
+    """Group (table_name, database model) tuples into root_dictionary by table name"""
+    for table_name, db_model in models:
+        root_dictionary.setdefault(table_name, []).append(db_model)
     return root_dictionary
 
 
+@instrumented('xmlparser.parse_primary_new', rows=count_rows)
+def parse_primary_new(filename: str):
+    """
+    Parse primary.xml using new approach of parsing data by database model
+
+    The file is parsed in a single pass, one <package> at a time, rather than once per database model.
+    Use iter_primary() instead if the whole repository doesn't need to be held in memory.
+
+    :param filename: The filename for primary.xml, compressed or not
+    :returns: A dictionary containing parsed data
+    """
+    return _collect({table_name: [] for table_name in PRIMARY_TABLES}, iter_primary(filename))
+
+
+@instrumented('xmlparser.parse_filelists_new', rows=count_rows)
 def parse_filelists_new(filename: str):
     """
     Parse filelists.xml using new approach of parsing data by database model
 
-    :param filename: The filename for filelists.xml
+    Use iter_filelists() instead if the whole repository doesn't need to be held in memory.
+
+    :param filename: The filename for filelists.xml, compressed or not
     :returns: A dictionary containing parsed data
     """
-    root_dictionary = {}
-
-    filelist_processor = dxml.array(dxml.dictionary('package', [
-                dxml.string('.', 'pkgid', alias='pkgId'),
-                dxml.array(dxml.dictionary('.', [
-                    dxml.string('.', alias='filename'),
-                    dxml.string('.', 'type', required=False, default='file', alias='filetype')
-                ], required=False), nested='file', alias=f'filelist')
-            ]), nested='filelists')
-    # Yes, I know that these two lines are woefully inefficient.
-    root_dictionary.update({'filelist': dxml.parse_from_file(filelist_processor, filename)})
-    rearrange_data_merge_pkgid(root_dictionary, 'pkgId')
-    convert_to_class(root_dictionary)
-    return root_dictionary
+    return _collect({'filelist': []}, iter_filelists(filename))
 
 
+@instrumented('xmlparser.parse_otherdata_new', rows=count_rows)
 def parse_otherdata_new(filename: str):
     """
     Parse otherdata.xml using new approach of parsing data by database model
 
-    :param filename: The filename for otherdata.xml
+    Use iter_otherdata() instead if the whole repository doesn't need to be held in memory.
+
+    :param filename: The filename for otherdata.xml, compressed or not
     :returns: A dictionary containing parsed data
     """
-    root_dictionary = {}
+    return _collect({'changelog': []}, iter_otherdata(filename))
 
-    filelist_processor = dxml.array(dxml.dictionary('package', [
-                dxml.string('.', 'pkgid', alias='pkgId'),
-                dxml.array(dxml.dictionary('.', [
-                    dxml.string('.', 'author', alias='author'),
-                    dxml.integer('.', 'date', alias='date'),
-                    dxml.string('.', alias='changelog')
-                ], required=False), nested='changelog', alias=f'changelog')
-            ]), nested='otherdata')
-    # Yes, I know that these two lines are woefully inefficient.
-    root_dictionary.update({'changelog': dxml.parse_from_file(filelist_processor, filename)})
-    rearrange_data_merge_pkgid(root_dictionary, 'pkgId')
-    convert_to_class(root_dictionary)
-    return root_dictionary
+
+def _wanted_language(lang: str, languages) -> bool:
+    """Whether a translation is in the languages being kept, either as it is (pt_BR) or by its language (pt)"""
+    if languages is None or lang in languages:
+        return True
+    return lang.split('@', 1)[0].split('_', 1)[0] in languages
+
+
+def _bool_text(element: ET.Element, default: bool):
+    """Return the text of an element as a boolean, or default if the element does not exist"""
+    if element is None:
+        return default
+    return _text(element).lower() in ('true', 'yes', '1')
+
+
+def _int_text(element: ET.Element):
+    """Return the text of an element as an integer, or None if the element is missing, empty or not a number"""
+    try:
+        return int(_text(element))
+    except ValueError:
+        return None
+
+
+def _group_ids(element: ET.Element):
+    """Parse a <grouplist> or <optionlist> element"""
+    if element is None:
+        return None
+    return {'groupid': [_text(child) for child in element if _local_name(child.tag) == 'groupid']}
+
+
+def _parse_comps_element(element: ET.Element, languages):
+    """
+    Parse a <group>, <category> or <environment> element into the same dictionary layout as declxml produced
+
+    :param element: The element
+    :param languages: The translations to keep, None keeps all of them
+    :returns: Dictionary of the element
+    """
+    row = {'id': None, 'name': [], 'description': []}
+    children = {}
+    for child in element:
+        tag = _local_name(child.tag)
+        if tag in ('name', 'description'):
+            # The untranslated entry is always kept, as the fallback
+            lang = child.get(f'{XML_NAMESPACE}lang')
+            if lang is None or _wanted_language(lang, languages):
+                row[tag].append({'lang': lang or 'en', 'content': _text(child)})
+        else:
+            children.setdefault(tag, child)
+
+    row['id'] = _text(children.get('id'))
+    kind = _local_name(element.tag)
+    if kind == 'group':
+        # Same defaults as yum and libcomps use for groups that leave them out
+        row['default'] = _bool_text(children.get('default'), default=False)
+        row['uservisible'] = _bool_text(children.get('uservisible'), default=True)
+        package_list = children.get('packagelist')
+        row['packagelist'] = None if package_list is None else {'packagereq': [
+            {'type': child.get('type'), 'package_name': _text(child)}
+            for child in package_list if _local_name(child.tag) == 'packagereq']}
+    else:
+        row['display_order'] = _int_text(children.get('display_order'))
+        row['grouplist'] = _group_ids(children.get('grouplist'))
+        if kind == 'environment':
+            row['optionlist'] = _group_ids(children.get('optionlist'))
+    return row
+
+
+def _iter_groups_rows(source, languages):
+    """
+    Generator function that parses comps XML in a single pass
+
+    expat skips the DOCTYPE by itself and reports xml:lang under the XML namespace, so the file is read as it is.
+
+    :param source: The binary file object of comps XML
+    :param languages: The translations to keep, None keeps all of them
+    :returns: (element type, dictionary) tuples, in document order
+    """
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    depth = 1
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            kind = _local_name(element.tag)
+            if kind in GROUP_TYPES:
+                yield kind, _parse_comps_element(element, languages)
+            # Translations that weren't kept go along with the rest of the element
+            root.clear()
+
+
+def iter_groups(source, languages=None):
+    """
+    Generator function that yields comps data one group, category or environment at a time
+
+    :param source: The filename, compressed or not, or binary file object of comps XML
+    :param languages: Languages to keep the translated names and descriptions of, ie. {'de', 'pt_BR'}. A language
+                      without a territory keeps every territory of it, so 'pt' keeps pt_BR too. The untranslated
+                      entry is always kept. Keeps every translation if not provided
+    :returns: (element type, dictionary) tuples in document order, element type being one of GROUP_TYPES
+    """
+    if languages is not None:
+        languages = frozenset(languages)
+    if isinstance(source, str):
+        def rows():
+            with open_file(source, 'rb') as file_object:
+                yield from _iter_groups_rows(file_object, languages)
+        return instrumented_rows('xmlparser.iter_groups', rows())
+    return instrumented_rows('xmlparser.iter_groups', _iter_groups_rows(source, languages))
+
+
+@instrumented('xmlparser.parse_groups', rows=count_rows)
+def parse_groups(filename: str, languages=None):
+    """
+    Parse comps data and returns it in Python dictionary form
+
+    :param filename: The filename for comps XML, compressed or not
+    :param languages: Languages to keep the translations of, see iter_groups(). Keeps all of them if not provided
+    :returns: Dictionary of {element type: list of dictionaries}
+    """
+    return _collect({kind: [] for kind in GROUP_TYPES}, iter_groups(filename, languages))
@@ -0,0 +1,32 @@
+"""
+Search packages by name, summary and description
+
+Usage: python search_packages.py search.idx python3-requests [--limit 20] [--repo BaseOS]
+
+The index is built by ingest_repos.py --search-index.
+"""
+import argparse
+import logging
+import time
+
+from rpm_package_explorer.search import SearchIndex
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search packages in the search index')
+    parser.add_argument('index', help='The search index file')
+    parser.add_argument('query', nargs='+', help='Package name, part of one, or words from the description')
+    parser.add_argument('--limit', type=int, default=20, help='Maximum number of results')
+    parser.add_argument('--repo', action='append', default=None, help='Only search this repository, repeatable')
+    parser.add_argument('--exact', action='store_true', help="Don't look for names close to the query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    index = SearchIndex.load(args.index)
+    start = time.perf_counter()
+    results = index.search(' '.join(args.query), args.limit, not args.exact, args.repo)
+    logging.info(f'{len(results)} results in {(time.perf_counter() - start) * 1000:.1f}ms')
+    for result in results:
+        epoch = f'{result.epoch}:' if result.epoch else ''
+        print(f'{result.name}-{epoch}{result.version}-{result.release}.{result.arch}\t{result.repo_name}\t'
+              f'{result.summary}')